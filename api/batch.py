@@ -0,0 +1,230 @@
+"""Пакетные операции API: один запрос со списком операций вместо сотен отправок форм.
+
+Тело запроса: {"operations": [{"action": ..., "type": ..., "id": ..., "data": {...}}, ...]}.
+Типы и действия:
+    ad      - create, update, deactivate
+    image   - create, delete (дополнительные иллюстрации)
+    comment - create, update, deactivate
+Для create и update в data передаются поля, как в обычных запросах API. Файлы
+изображений передаются в запросе multipart: поле operations содержит JSON, а в data
+вместо файла указывается имя поля запроса с файлом.
+
+Все операции сначала проверяются; если хотя бы одна неверна, ничего не выполняется
+и возвращаются ошибки по номерам операций. Иначе операции выполняются в одной
+транзакции массовыми запросами (main/bulk.py): записи, на которые ссылаются
+операции, загружаются одним запросом на модель, добавление - bulk_create,
+изменение - bulk_update."""
+
+from django.conf import settings
+from django.db import transaction
+
+from main import bulk
+from main.deletion import delete_images, file_remover
+from main.models import Ad, AdditionalImage, Comment, SubRubric
+from .permissions import can_edit_ad, get_ad
+from .serializers import AdWriteSerializer, AdditionalImageSerializer, CommentSerializer, CommentUpdateSerializer, \
+    comment_author
+
+CREATE = 'create'
+UPDATE = 'update'
+DEACTIVATE = 'deactivate'
+DELETE = 'delete'
+
+TYPES = {
+    'ad': (AdWriteSerializer, (CREATE, UPDATE, DEACTIVATE)),
+    'image': (AdditionalImageSerializer, (CREATE, DELETE)),
+    'comment': (CommentSerializer, (CREATE, UPDATE, DEACTIVATE)),
+}
+UPDATE_SERIALIZERS = {'comment': CommentUpdateSerializer} # если при изменении поля проверяются иначе
+
+
+def get_max_operations():
+    return getattr(settings, 'API_BATCH_MAX_OPERATIONS', 500)
+
+
+def get_queryset(kind):
+    if kind == 'ad':
+        return Ad.objects.for_edit()
+    if kind == 'image':
+        return AdditionalImage.objects.select_related('ad').defer('ad__search_vector')
+    return Comment.objects.select_related('ad').defer('ad__search_vector')
+
+
+def _as_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Operation:
+    def __init__(self, index, action, kind, pk, data):
+        self.index = index
+        self.action = action
+        self.kind = kind
+        self.pk = pk
+        self.data = data
+        self.instance = None
+        self.validated_data = None
+
+
+class Batch:
+    def __init__(self, request, operations):
+        self.request = request
+        self.user = request.user
+        self.raw_operations = operations
+        self.operations = []
+        self.errors = []
+
+    def add_error(self, index, errors):
+        if isinstance(errors, str):
+            errors = {'non_field_errors': [errors]}
+        self.errors.append({'index': index, 'errors': errors})
+
+    def parse(self):
+        if not isinstance(self.raw_operations, list) or not self.raw_operations:
+            self.add_error(None, 'Ожидается непустой список операций')
+            return
+        if len(self.raw_operations) > get_max_operations():
+            self.add_error(None, f'Не больше {get_max_operations()} операций в одном запросе')
+            return
+        for index, raw in enumerate(self.raw_operations):
+            if not isinstance(raw, dict):
+                self.add_error(index, 'Операция должна быть объектом')
+                continue
+            action, kind, data = raw.get('action'), raw.get('type'), raw.get('data') or {}
+            if kind not in TYPES:
+                self.add_error(index, {'type': [f'Допустимые типы: {", ".join(TYPES)}']})
+                continue
+            if action not in TYPES[kind][1]:
+                self.add_error(index, {'action': [f'Допустимые действия: {", ".join(TYPES[kind][1])}']})
+                continue
+            if not isinstance(data, dict):
+                self.add_error(index, {'data': ['Ожидается объект']})
+                continue
+            pk = _as_pk(raw.get('id'))
+            if action != CREATE and pk is None:
+                self.add_error(index, {'id': ['Обязательное поле.']})
+                continue
+            if 'image' in data and isinstance(data['image'], str):
+                # в запросе multipart в data указывается имя поля с файлом
+                data = dict(data, image=self.request.FILES.get(data['image'], data['image']))
+            self.operations.append(Operation(index, action, kind, pk, data))
+
+    def preload(self):
+        '''Загружает одним запросом на модель записи, на которые ссылаются операции'''
+        ids = {kind: set() for kind in TYPES}
+        ad_ids, rubric_ids = set(), set()
+        for operation in self.operations:
+            if operation.pk is not None and operation.action != CREATE:
+                ids[operation.kind].add(operation.pk)
+            ad_ids.add(_as_pk(operation.data.get('ad')))
+            rubric_ids.add(_as_pk(operation.data.get('rubric')))
+        self.instances = {kind: get_queryset(kind).in_bulk(pks) if pks else {} for kind, pks in ids.items()}
+        ad_ids.discard(None)
+        rubric_ids.discard(None)
+        ads = dict(self.instances['ad'])
+        missing = ad_ids - ads.keys()
+        if missing:
+            ads.update(get_queryset('ad').in_bulk(missing))
+        self.preloaded = {
+            Ad: ads,
+            SubRubric: SubRubric.objects.in_bulk(rubric_ids) if rubric_ids else {},
+        }
+
+    def validate(self):
+        context = {'request': self.request, 'preloaded': self.preloaded}
+        for operation in self.operations:
+            serializer_class = TYPES[operation.kind][0]
+            if operation.action == UPDATE:
+                serializer_class = UPDATE_SERIALIZERS.get(operation.kind, serializer_class)
+            if operation.action != CREATE:
+                operation.instance = self.instances[operation.kind].get(operation.pk)
+                if operation.instance is None:
+                    self.add_error(operation.index, {'id': [f'Запись {operation.pk} не найдена.']})
+                    continue
+                if not can_edit_ad(self.user, get_ad(operation.instance)):
+                    self.add_error(operation.index, 'Изменять можно только свои объявления.')
+                    continue
+            if operation.action in (DEACTIVATE, DELETE):
+                continue
+            serializer = serializer_class(operation.instance, data=operation.data,
+                                          partial=operation.action == UPDATE, context=context)
+            if not serializer.is_valid():
+                self.add_error(operation.index, serializer.errors)
+                continue
+            operation.validated_data = serializer.validated_data
+            if operation.kind == 'image' and not can_edit_ad(self.user, operation.validated_data['ad']):
+                self.add_error(operation.index, 'Иллюстрации можно добавлять только к своим объявлениям.')
+
+    def select(self, kind, action):
+        return [operation for operation in self.operations if operation.kind == kind and operation.action == action]
+
+    @staticmethod
+    def apply_changes(instance, validated_data):
+        '''Переносит изменения в запись. Возвращает имена замененных файлов'''
+        replaced = []
+        for name, value in validated_data.items():
+            if name == 'image':
+                if instance.image:
+                    replaced.append(instance.image.name)
+                # bulk_update не сохраняет файлы, поэтому файл сохраняется в хранилище сразу
+                instance.image.save(value.name, value, save=False)
+            else:
+                setattr(instance, name, value)
+        return replaced
+
+    def execute(self):
+        with transaction.atomic():
+            ads = []
+            for operation in self.select('ad', CREATE):
+                operation.instance = Ad(author=self.user, **operation.validated_data)
+                ads.append(operation.instance)
+            bulk.create_ads(ads)
+            images = []
+            for operation in self.select('image', CREATE):
+                operation.instance = AdditionalImage(**operation.validated_data)
+                images.append(operation.instance)
+            bulk.create_images(images)
+            comments = []
+            for operation in self.select('comment', CREATE):
+                operation.instance = Comment(author=comment_author(self.user), **operation.validated_data)
+                comments.append(operation.instance)
+            bulk.create_comments(comments)
+
+            replaced = []
+            for kind, update in (('ad', bulk.update_ads), ('comment', bulk.update_comments)):
+                changed, fields = {}, set()
+                for operation in self.select(kind, UPDATE):
+                    replaced.extend(self.apply_changes(operation.instance, operation.validated_data))
+                    changed[operation.instance.pk] = operation.instance
+                    fields.update(operation.validated_data)
+                if fields:
+                    update(list(changed.values()), fields)
+            if replaced:
+                # bulk_update не отправляет post_save, поэтому замененные файлы удаляются здесь,
+                # как это делает django_cleanup
+                transaction.on_commit(lambda: file_remover.put_many(replaced))
+
+            bulk.deactivate_ads([operation.instance for operation in self.select('ad', DEACTIVATE)])
+            comments = {}
+            for operation in self.select('comment', DEACTIVATE):
+                operation.instance.is_active = False
+                comments[operation.instance.pk] = operation.instance
+            bulk.update_comments(list(comments.values()), ['is_active'])
+            pks = [operation.pk for operation in self.select('image', DELETE)]
+            if pks:
+                delete_images(AdditionalImage.objects.filter(pk__in=pks))
+
+    def run(self):
+        '''Возвращает (результаты, ошибки); при ошибках ничего не выполняется'''
+        self.parse()
+        if self.operations:
+            self.preload()
+            self.validate()
+        if self.errors:
+            return None, sorted(self.errors, key=lambda error: -1 if error['index'] is None else error['index'])
+        self.execute()
+        return [{'index': operation.index, 'type': operation.kind, 'action': operation.action,
+                 'id': operation.instance.pk if operation.action != DELETE else operation.pk}
+                for operation in sorted(self.operations, key=lambda operation: operation.index)], None
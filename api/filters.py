@@ -0,0 +1,49 @@
+from django import forms
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from main.search import search_ads
+
+
+class AdFilterForm(forms.Form):
+    '''Параметры отбора объявлений в адресе запроса API'''
+    rubric = forms.IntegerField(required=False, min_value=1)
+    super_rubric = forms.IntegerField(required=False, min_value=1)
+    author = forms.IntegerField(required=False, min_value=1)
+    price_min = forms.FloatField(required=False)
+    price_max = forms.FloatField(required=False)
+    created_after = forms.DateTimeField(required=False)
+    created_before = forms.DateTimeField(required=False)
+    keyword = forms.CharField(required=False, max_length=20)
+
+    LOOKUPS = {
+        'rubric': 'rubric_id',
+        'super_rubric': 'rubric__super_rubric_id',
+        'author': 'author_id',
+        'price_min': 'price__gte',
+        'price_max': 'price__lte',
+        'created_after': 'created_at__gte',
+        'created_before': 'created_at__lt',
+    }
+
+    def filter(self, queryset):
+        data = self.cleaned_data
+        lookups = {lookup: data[name] for name, lookup in self.LOOKUPS.items() if data[name] is not None}
+        if lookups:
+            queryset = queryset.filter(**lookups)
+        if data['keyword']:
+            # при поиске объявления сортируются по релевантности
+            queryset = search_ads(queryset, data['keyword'])
+        return queryset
+
+
+class AdFilterBackend(BaseFilterBackend):
+    '''Отбор объявлений: ?rubric=, ?super_rubric=, ?author=, ?price_min=, ?price_max=,
+    ?created_after=, ?created_before= (дата или дата и время) и ?keyword=.
+    Неверные значения параметров дают ответ 400 с описанием ошибок'''
+
+    def filter_queryset(self, request, queryset, view):
+        form = AdFilterForm(request.query_params)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+        return form.filter(queryset)
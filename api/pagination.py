@@ -0,0 +1,45 @@
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from main.pagination import KeysetPaginator
+
+
+class KeysetCursorPagination(BasePagination):
+    '''Курсорная пагинация для DRF поверх main.pagination.KeysetPaginator.
+    Общее количество записей возвращается только по запросу (?count=1) и считается
+    приблизительно, поэтому глубокие страницы стоят столько же, сколько первая.'''
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.paginator = KeysetPaginator(queryset, self.get_page_size(request))
+        self.page = self.paginator.get_page(request.query_params.get(self.cursor_query_param))
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+        }
+        if self.request.query_params.get(self.count_query_param):
+            body['count'] = self.paginator.count
+        body['results'] = data
+        return Response(body)
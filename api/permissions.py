@@ -0,0 +1,26 @@
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+
+from main.models import Ad
+
+
+def get_ad(obj):
+    return obj if isinstance(obj, Ad) else obj.ad
+
+
+def can_edit_ad(user, ad):
+    '''Объявление, его иллюстрации и комментарии к нему изменяют автор объявления и персонал'''
+    return user.is_staff or ad.author_id == user.pk
+
+
+def can_comment_ad(user, ad):
+    '''Комментировать можно опубликованные объявления; снятые с публикации - только их автору и персоналу'''
+    return ad.is_active or can_edit_ad(user, ad)
+
+
+class IsAdAuthorOrStaff(BasePermission):
+    message = 'Изменять можно только свои объявления.'
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in SAFE_METHODS:
+            return True
+        return can_edit_ad(request.user, get_ad(obj))
@@ -1,14 +1,141 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
-from main.models import Rubric, Ad
+from rest_framework.exceptions import ValidationError
+from main.models import Rubric, Ad, AdditionalImage, Comment
+from main.uploads import HeaderImageField
+from .permissions import can_comment_ad
 
 
 class RubricSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rubric
-        fields = ['name', 'super_rubric']
+        fields = ['name', 'super_rubric', 'ad_count']
 
 
 class AdSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ad
-        fields = ['rubric', 'title', 'content', 'price', 'contacts', 'image', 'author', 'is_active', 'created_at']
+        fields = ['id', 'rubric', 'title', 'content', 'price', 'contacts', 'image', 'author', 'is_active',
+                  'created_at', 'comment_count']
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''Связанная запись сначала ищется среди загруженных заранее одним запросом
+    (context['preloaded'][модель] - словарь {ключ: запись}, см. api/batch.py)'''
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.get_queryset().model)
+        if preloaded is not None:
+            try:
+                return preloaded[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class HeaderImageSerializerField(serializers.ImageField):
+    '''Изображение проверяется по заголовку файла (см. main/uploads.py)'''
+    default_error_messages = {
+        'format': HeaderImageField.default_error_messages['format'],
+        'too_large': HeaderImageField.default_error_messages['too_large'],
+    }
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('_DjangoImageField', HeaderImageField)
+        super().__init__(**kwargs)
+
+
+class AdWriteSerializer(serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+    image = HeaderImageSerializerField(required=False)
+
+    class Meta:
+        model = Ad
+        fields = AdSerializer.Meta.fields
+        read_only_fields = ['author', 'created_at']
+
+
+class AdditionalImageSerializer(serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+    image = HeaderImageSerializerField()
+
+    class Meta:
+        model = AdditionalImage
+        fields = ['id', 'ad', 'image']
+
+
+class CommentSerializer(serializers.ModelSerializer):
+    '''Комментарий пользователя API: имя автора берется из учетной записи (см. comment_author)'''
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'ad', 'author', 'content', 'is_active', 'created_at']
+        read_only_fields = ['author', 'is_active', 'created_at']
+
+    def validate_ad(self, ad):
+        request = self.context.get('request')
+        if request is not None and not can_comment_ad(request.user, ad):
+            raise ValidationError('Объявление снято с публикации.')
+        return ad
+
+
+class CommentUpdateSerializer(CommentSerializer):
+    '''Изменение комментария: перенести его к другому объявлению или сменить автора нельзя'''
+
+    class Meta(CommentSerializer.Meta):
+        read_only_fields = ['ad', 'author', 'is_active', 'created_at']
+
+
+def comment_author(user):
+    '''Имя автора комментария, добавленного пользователем user'''
+    return user.username[:Comment._meta.get_field('author').max_length]
+
+
+class ValuesSerializer:
+    '''Быстрая сериализация строк queryset.values(): объекты моделей не создаются,
+    а для каждого поля заранее выбирается функция преобразования значения.
+    Поля и их представление берутся из обычного сериализатора модели, так что
+    результат совпадает с результатом serializer.data. Поддерживаются простые поля,
+    первичные ключи связанных записей и файлы.'''
+
+    def __init__(self, serializer, fields=None):
+        self.request = serializer.context.get('request')
+        available = serializer.fields
+        if fields is None:
+            fields = [name for name, field in available.items() if not field.write_only]
+        unknown = [name for name in fields if name not in available or available[name].write_only]
+        if unknown:
+            raise ValidationError({'fields': [f'Неизвестные поля: {", ".join(unknown)}']})
+        self.columns = [(name, available[name].source, self.get_converter(available[name])) for name in fields]
+
+    @property
+    def source_fields(self):
+        '''Имена полей для queryset.values()'''
+        return [source for _, source, _ in self.columns]
+
+    def get_converter(self, field):
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            return None # values() уже возвращает ключ связанной записи
+        if isinstance(field, serializers.FileField):
+            return self.file_url
+        if isinstance(field, (serializers.CharField, serializers.BooleanField, serializers.IntegerField,
+                              serializers.FloatField)):
+            return None
+        return field.to_representation
+
+    def file_url(self, name):
+        if not name:
+            return None
+        url = default_storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def to_representation(self, row):
+        data = {}
+        for name, source, convert in self.columns:
+            value = row[source]
+            data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
@@ -1,12 +1,28 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
-from .views import RubricList, RubricDetail, AdList, AdDetail
+from .views import RubricList, RubricDetail, AdList, AdDetail, AdExport, AdImport, AdDeactivate, \
+    AdImageList, ImageCreate, ImageDetail, AdCommentList, CommentCreate, CommentDetail, CommentDeactivate, BatchView, \
+    ad_list_async, ad_detail_async
+
+async_views = getattr(settings, 'ASYNC_VIEWS', False) # при ASGI - асинхронные варианты, см. views.py
 
 urlpatterns = [
     path('rubrics/', RubricList.as_view()),
     path('rubrics/<int:pk>/', RubricDetail.as_view()),
-    path('ads/all', AdList.as_view()),
-    path('ads/<int:pk>/', AdDetail.as_view()),
+    path('ads/all', ad_list_async if async_views else AdList.as_view()),
+    path('ads/<int:pk>/', ad_detail_async if async_views else AdDetail.as_view()),
+    path('ads/<int:pk>/deactivate', AdDeactivate.as_view()),
+    path('ads/<int:pk>/images/', AdImageList.as_view()),
+    path('ads/<int:pk>/comments/', AdCommentList.as_view()),
+    path('images/', ImageCreate.as_view()),
+    path('images/<int:pk>/', ImageDetail.as_view()),
+    path('comments/', CommentCreate.as_view()),
+    path('comments/<int:pk>/', CommentDetail.as_view()),
+    path('comments/<int:pk>/deactivate', CommentDeactivate.as_view()),
+    path('batch', BatchView.as_view()),
+    path('ads/export', AdExport.as_view()),
+    path('ads/import', AdImport.as_view()),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
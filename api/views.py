@@ -1,7 +1,23 @@
-from rest_framework import generics
+import json
+
+from rest_framework import generics, status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.contrib.auth.models import User
-from main.models import Rubric, Ad
-from .serializers import RubricSerializer, AdSerializer
+from django.http import StreamingHttpResponse
+from main import bulk, export, importing
+from main.aio import async_view
+from main.models import Rubric, Ad, AdditionalImage, Comment
+from main.pagination import KeysetPaginator
+from .batch import Batch
+from .filters import AdFilterBackend
+from .pagination import KeysetCursorPagination
+from .permissions import IsAdAuthorOrStaff, can_edit_ad
+from .serializers import RubricSerializer, AdSerializer, ValuesSerializer, AdWriteSerializer, \
+    AdditionalImageSerializer, CommentSerializer, CommentUpdateSerializer, comment_author
 
 
 class RubricList(generics.ListAPIView):
@@ -14,11 +30,216 @@ class RubricDetail(generics.RetrieveAPIView):
     serializer_class = RubricSerializer
 
 
-class AdList(generics.ListAPIView):
-    queryset = Ad.objects.all()
+class SparseFieldsMixin:
+    '''?fields=title,price,created_at - выводятся только перечисленные поля сериализатора.
+    Записи выбираются через .values() только с нужными столбцами и сериализуются
+    ValuesSerializer, без создания объектов моделей'''
+    fields_query_param = 'fields'
+
+    def get_values_serializer(self):
+        fields = self.request.query_params.get(self.fields_query_param)
+        if fields:
+            fields = list(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+        return ValuesSerializer(self.get_serializer(), fields or None)
+
+
+def check_upload_limits(request):
+    '''Ошибки превышения лимитов выгрузки файлов (см. main/uploads.py)'''
+    if getattr(request._request, 'upload_errors', None):
+        raise ValidationError({'detail': request._request.upload_errors})
+
+
+class AdList(SparseFieldsMixin, generics.ListCreateAPIView):
+    queryset = Ad.objects.for_api()
     serializer_class = AdSerializer
+    pagination_class = KeysetCursorPagination
+    filter_backends = [AdFilterBackend]
+    permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def get_serializer_class(self):
+        return AdWriteSerializer if self.request.method == 'POST' else AdSerializer
 
-class AdDetail(generics.RetrieveAPIView):
-    queryset = Ad.objects.all()
+    def perform_create(self, serializer):
+        check_upload_limits(self.request)
+        serializer.save(author=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        # ключи сортировки нужны пагинатору для курсоров, даже если их нет среди выводимых полей
+        keys = [name for name, _ in KeysetPaginator.get_keys(queryset)]
+        rows = queryset.values(*dict.fromkeys([*serializer.source_fields, *keys]))
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(serializer.serialize(page))
+
+
+class AdDetail(SparseFieldsMixin, generics.RetrieveUpdateAPIView):
+    queryset = Ad.objects.for_api()
     serializer_class = AdSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly, IsAdAuthorOrStaff]
+
+    def get_serializer_class(self):
+        return AdSerializer if self.request.method == 'GET' else AdWriteSerializer
+
+    def perform_update(self, serializer):
+        check_upload_limits(self.request)
+        serializer.save()
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_values_serializer()
+        row = generics.get_object_or_404(self.get_queryset().values(*serializer.source_fields), pk=kwargs['pk'])
+        return Response(serializer.to_representation(row))
+
+
+class AdDeactivate(generics.GenericAPIView):
+    '''Снятие объявления с публикации'''
+    queryset = Ad.objects.for_edit()
+    permission_classes = [IsAuthenticated, IsAdAuthorOrStaff]
+
+    def post(self, request, *args, **kwargs):
+        ad = self.get_object()
+        bulk.deactivate_ads([ad])
+        return Response({'id': ad.pk, 'is_active': ad.is_active})
+
+
+class AdImageList(generics.ListAPIView):
+    '''Дополнительные иллюстрации объявления'''
+    serializer_class = AdditionalImageSerializer
+
+    def get_queryset(self):
+        return AdditionalImage.objects.filter(ad=self.kwargs['pk'])
+
+
+class ImageCreate(generics.CreateAPIView):
+    serializer_class = AdditionalImageSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        check_upload_limits(self.request)
+        if not can_edit_ad(self.request.user, serializer.validated_data['ad']):
+            raise PermissionDenied('Иллюстрации можно добавлять только к своим объявлениям.')
+        serializer.save()
+
+
+class ImageDetail(generics.RetrieveDestroyAPIView):
+    queryset = AdditionalImage.objects.select_related('ad').defer('ad__search_vector')
+    serializer_class = AdditionalImageSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly, IsAdAuthorOrStaff]
+
+
+class AdCommentList(generics.ListAPIView):
+    '''Опубликованные комментарии к объявлению'''
+    serializer_class = CommentSerializer
+
+    def get_queryset(self):
+        return Comment.objects.filter(ad=self.kwargs['pk'], is_active=True)
+
+
+class CommentCreate(generics.CreateAPIView):
+    serializer_class = CommentSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(author=comment_author(self.request.user))
+
+
+class CommentDetail(generics.RetrieveUpdateAPIView):
+    queryset = Comment.objects.select_related('ad').defer('ad__search_vector')
+    serializer_class = CommentSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly, IsAdAuthorOrStaff]
+
+    def get_serializer_class(self):
+        return CommentSerializer if self.request.method == 'GET' else CommentUpdateSerializer
+
+
+class CommentDeactivate(generics.GenericAPIView):
+    '''Скрытие комментария автором объявления или персоналом'''
+    queryset = Comment.objects.select_related('ad').defer('ad__search_vector')
+    permission_classes = [IsAuthenticated, IsAdAuthorOrStaff]
+
+    def post(self, request, *args, **kwargs):
+        comment = self.get_object()
+        if comment.is_active:
+            comment.is_active = False
+            bulk.update_comments([comment], ['is_active'])
+        return Response({'id': comment.pk, 'is_active': comment.is_active})
+
+
+class BatchView(APIView):
+    '''Пакетные операции над объявлениями, иллюстрациями и комментариями в одной
+    транзакции (см. api/batch.py)'''
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        check_upload_limits(request)
+        operations = request.data.get('operations')
+        if isinstance(operations, str):
+            try:
+                operations = json.loads(operations)
+            except ValueError:
+                raise ValidationError({'operations': ['Неверный JSON']})
+        results, errors = Batch(request, operations).run()
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': results})
+
+
+class AdExport(generics.GenericAPIView):
+    '''Потоковая выгрузка всех объявлений, в том числе снятых с публикации, с контактами
+    (см. main/export.py) - только для администраторов: ?output=ndjson (по умолчанию)
+    или csv, ?fields= - выгружаемые поля, ?since= - водяной знак предыдущей выгрузки.
+    Отборы те же, что у списка объявлений. Новый водяной знак возвращается
+    в заголовке X-Export-Watermark'''
+    queryset = Ad.objects.all()
+    permission_classes = [IsAdminUser]
+    filter_backends = [AdFilterBackend]
+
+    def get(self, request, *args, **kwargs):
+        output_format = request.query_params.get('output', export.NDJSON)
+        if output_format not in export.FORMATS:
+            raise ValidationError({'output': [f'Допустимые форматы: {", ".join(export.FORMATS)}']})
+        fields = [name.strip() for name in request.query_params.get('fields', '').split(',') if name.strip()]
+        try:
+            queryset, watermark = export.prepare_export(self.filter_queryset(self.get_queryset()),
+                                                        request.query_params.get('since'))
+            stream = export.export_ads(queryset, output_format, fields,
+                                       base_url=request.build_absolute_uri('/')[:-1])
+        except ValueError as exc:
+            raise ValidationError({'detail': [str(exc)]})
+        response = StreamingHttpResponse(stream, content_type=export.FORMATS[output_format])
+        response['Content-Disposition'] = f'attachment; filename="ads.{output_format}"'
+        if watermark:
+            response['X-Export-Watermark'] = watermark
+        return response
+
+
+class AdImport(APIView):
+    '''Загрузка объявлений администратором (см. main/importing.py): file - файл NDJSON или CSV,
+    archive - необязательный архив zip или tar с изображениями, format - формат файла, если
+    его нельзя определить по расширению. Возвращает количество добавленных объявлений
+    и ошибки по строкам. Большие файлы лучше загружать командой import_ads'''
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        check_upload_limits(request)
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['Обязательное поле.']})
+        input_format = request.data.get('format') or importing.guess_format(upload.name)
+        if input_format not in importing.FORMATS:
+            raise ValidationError({'format': [f'Допустимые форматы: {", ".join(importing.FORMATS)}']})
+        archive = request.FILES.get('archive')
+        # изображения берутся только из архива: пути к файлам на сервере через API не принимаются
+        result = importing.import_ads(upload, input_format,
+                                      archive=archive.temporary_file_path() if archive else None,
+                                      executor=importing.get_executor() if archive else None)
+        return Response(result.as_dict())
+
+
+# асинхронные варианты для ASGI (ASYNC_VIEWS, см. api/urls.py): в DRF нет асинхронных
+# представлений, поэтому они целиком выполняются в потоках пула (main/aio.py), а не в общем
+# потоке, где ASGI-обработчик Django 3.2 по очереди выполняет все синхронные контроллеры
+ad_list_async = async_view(AdList.as_view())
+ad_detail_async = async_view(AdDetail.as_view())
@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'callboard.settings')
+os.environ.setdefault('CALLBOARD_ASYNC_VIEWS', '1') # асинхронные контроллеры, см. main/aio.py
 
 application = get_asgi_application()
@@ -47,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middlewares.MetricsMiddleware', #замеры запросов, см. main/metrics.py
+    'main.middlewares.QueryDetectorMiddleware', #поиск N+1 и медленных запросов при DEBUG, см. main/query_detector.py
+    'main.middlewares.ReplicaMiddleware', #чтение с реплик, см. main/replicas.py
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,7 +63,8 @@ ROOT_URLCONF = 'callboard.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.metrics.DjangoTemplates', #стандартный движок с замером времени отрисовки
+        'NAME': 'django', #имя движка как у стандартного (engines['django'])
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,26 +85,78 @@ WSGI_APPLICATION = 'callboard.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-
-    'default': {
+#база выбирается переменной окружения CALLBOARD_DB: postgres или sqlite. С CALLBOARD_SQLITE_REPLICA=1
+#к SQLite добавляется реплика - локальная проверка чтения с реплик на двух файлах, копия обновляется
+#командой python manage.py sync_replica (до первого запуска реплика пуста).
+#реплики PostgreSQL только для чтения - CALLBOARD_DB_REPLICAS: адреса через запятую (host или host:port),
+#см. main/replicas.py
 
+DATABASE_BACKENDS = {
+    'postgres': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
-
         'NAME': 'callboard',
-
         'USER': 'postgres',
-
         'PASSWORD': 'qwerty',
-
         'HOST': 'localhost',
-
         'PORT': '5432',
+        'CONN_MAX_AGE': 300, #соединение не закрывается после запроса и используется следующими
+    },
+    'sqlite': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(BASE_DIR.joinpath('db.sqlite3')),
+    },
+}
 
-    }
+CALLBOARD_DB = os.environ.get('CALLBOARD_DB', 'postgres')
+DATABASES = {
+    'default': DATABASE_BACKENDS[CALLBOARD_DB],
+}
+if CALLBOARD_DB == 'sqlite' and os.environ.get('CALLBOARD_SQLITE_REPLICA') == '1':
+    DATABASES['replica'] = {**DATABASES['default'], 'NAME': str(BASE_DIR.joinpath('db_replica.sqlite3')),
+                            'TEST': {'MIRROR': 'default'}}
+for number, address in enumerate(filter(None, os.environ.get('CALLBOARD_DB_REPLICAS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host,
+                                     'PORT': port or DATABASES['default'].get('PORT', ''),
+                                     'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['main.replicas.ReplicaRouter']
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default'] #чтение при запросах к сайту
+REPLICA_PIN_COOKIE = 'callboard_primary' #после POST чтение идет с основной базы, пока живет эта cookie
+REPLICA_PIN_SECONDS = 10 #срок жизни cookie - с запасом больше обычного отставания реплик
+REPLICA_MAX_LAG = 5 #реплики, отставшие больше стольких секунд, не используются
+REPLICA_CHECK_INTERVAL = 10 #как часто проверять доступность и отставание реплик, секунд
+DATABASE_HEALTH_CHECK_INTERVAL = 30 #как часто проверять постоянные соединения перед запросом, секунд
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# бэкенд выбирается переменной окружения CALLBOARD_CACHE: locmem, file или redis
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'callboard',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CALLBOARD_CACHE_DIR', str(BASE_DIR.joinpath('cache'))),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'redis': { # подходит любой сервер с протоколом Redis, нужен пакет django-redis
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('CALLBOARD_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
 
+CACHES = {
+    'default': CACHE_BACKENDS[os.environ.get('CALLBOARD_CACHE', 'locmem')],
 }
 
+PAGE_CACHE_ALIAS = 'default' #кэш для страниц гостей и версий данных, см. main/caching.py
+PAGE_CACHE_TIMEOUT = 600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -139,6 +195,11 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = BASE_DIR.joinpath('staticfiles') #сюда collectstatic собирает файлы с хэшами в именах и сжатыми копиями
+#в рабочем режиме (CALLBOARD_STATIC_MANIFEST=1) имена файлов с хэшем и сжатые копии, см. main/staticfiles.py;
+#тогда страницы отрисовываются только после collectstatic. Для разработки и тестов - обычное хранилище
+if os.environ.get('CALLBOARD_STATIC_MANIFEST') == '1':
+    STATICFILES_STORAGE = 'main.staticfiles.CompressedManifestStaticFilesStorage'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -161,6 +222,82 @@ THUMBNAIL_ALIASES = {
             'size': (96, 96),
             'crop': 'scale',
         },
+        'detail': { #изображения на странице объявления
+            'size': (600, 600),
+            'crop': 'scale',
+        },
     },
 }
 THUMBNAIL_BASEDIR = 'thumbnails' #задали имя папки для хранения миниатюр
+THUMBNAIL_VARIANT_EXTENSIONS = ('jpg', 'webp') #форматы, в которых заранее создаются все миниатюры
+THUMBNAIL_PREGENERATE = True #создавать миниатюры в фоне после сохранения объявления, см. main/thumbnails.py
+THUMBNAIL_WORKERS = 2 #процессов в пуле создания миниатюр
+
+SEARCH_CONFIG = 'russian' #конфигурация полнотекстового поиска PostgreSQL для поиска объявлений
+
+RUBRIC_TREE_CACHE = None #псевдоним кэша из CACHES для общей версии дерева рубрик; None - только кэш процесса
+RUBRIC_COUNTS_TIMEOUT = 60 #сколько секунд счетчики объявлений в боковой панели берутся из кэша
+#изменение счетчиков не сбрасывает кэш страниц: в странице гостя из кэша (PAGE_CACHE_TIMEOUT) счетчики могут
+#отставать еще и на ее срок, а пока не изменились данные самой страницы, ETag тот же и браузер видит прежние счетчики
+
+MAIL_QUEUE_MAX_ATTEMPTS = 5 #после стольких неудачных попыток письмо считается неотправленным
+MAIL_QUEUE_RETRY_DELAY = 60 #пауза перед повторной отправкой в секундах, удваивается с каждой попыткой
+MAIL_QUEUE_LEASE = 300 #на столько секунд письма пачки откладываются для других обработчиков, пока идет отправка
+COMMENT_DIGEST_WINDOW = 900 #за сколько секунд комментарии объединяются в одно письмо автору объявления
+
+#выгружаемые файлы всегда пишутся во временные файлы частями, см. main/uploads.py
+FILE_UPLOAD_HANDLERS = ['main.uploads.LimitedUploadHandler']
+UPLOAD_MAX_FILES = 10 #не больше стольких файлов в одном запросе
+UPLOAD_MAX_TOTAL_SIZE = 30 * 1024 * 1024 #общий размер файлов в одном запросе, байт
+UPLOAD_MAX_PIXELS = 50_000_000 #изображения с большим числом точек отклоняются по заголовку
+UPLOAD_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP') #допустимые форматы изображений
+UPLOAD_MAX_DIMENSION = 2560 #исходные изображения больше этого размера по стороне уменьшаются в фоне
+
+DEFAULT_FILE_STORAGE = 'main.storage.ContentAddressedStorage' #файлы называются по хэшу содержимого, одинаковые хранятся один раз
+MEDIA_SHARD_DEPTH = 2 #уровней вложенных папок для файлов: ab/cd/abcd....jpg
+MEDIA_SHARD_WIDTH = 2 #символов хэша в имени каждой папки
+
+EXPORT_CHUNK_SIZE = 2000 #записей на одно чтение из курсора и на одну порцию потоковой выгрузки
+EXPORT_WATERMARK_LAG = 60 #изменения последних стольких секунд выгружаются в следующий раз: их транзакции могли не зафиксироваться
+IMPORT_WORKERS = 2 #процессов для загрузки изображений при импорте объявлений через API
+API_BATCH_MAX_OPERATIONS = 500 #не больше стольких операций в одном пакетном запросе API
+
+#замеры запросов: SQL, шаблоны, кэш страниц и общее время, см. main/metrics.py
+METRICS_ENABLED = True
+METRICS_SERVER_TIMING = True #добавлять в ответы заголовок Server-Timing
+METRICS_ALLOWED_IPS = ('127.0.0.1',) #с этих адресов /metrics доступен без входа (для Prometheus)
+
+#поиск повторяющихся (N+1) и медленных SQL-запросов, см. main/query_detector.py
+QUERY_DETECTOR = DEBUG #разбор стека на каждый запрос к базе - только для разработки и тестового сервера
+QUERY_DETECTOR_STRICT = False #выбрасывать исключение вместо записи в журнал (для тестов)
+QUERY_DETECTOR_REPEAT = 3 #столько одинаковых запросов из одного места считаются N+1
+QUERY_DETECTOR_SLOW_MS = 100 #запросы дольше стольких миллисекунд считаются медленными
+QUERY_BUDGETS = {} #наибольшее число SQL-запросов по имени маршрута, например {'main:index': 4}
+
+#асинхронные контроллеры страниц объявлений и API объявлений, см. main/aio.py. callboard/asgi.py включает их
+ASYNC_VIEWS = os.environ.get('CALLBOARD_ASYNC_VIEWS') == '1'
+ASYNC_THREADS = 32 #потоков для запросов к базе из асинхронных контроллеров (не больше стольких подключений)
+
+#пул заранее созданных капч формы комментария гостя, пополняется командой captcha_pool, см. main/captcha_pool.py
+CAPTCHA_GET_FROM_POOL = True #не удалять просроченные капчи при каждой проверке ответа - это делает команда
+CAPTCHA_GET_FROM_POOL_TIMEOUT = 5 #обновляемая капча (captcha/refresh/) выдается, если ей осталось жить столько минут
+CAPTCHA_POOL_SIZE = 500 #столько капч пула должно быть пригодно к выдаче
+CAPTCHA_POOL_LIFETIME = 30 #время жизни капчи пула в минутах
+CAPTCHA_POOL_REFRESH = 60 #раз в столько секунд процесс перечитывает ключи пула из базы
+CAPTCHA_POOL_DIR = MEDIA_ROOT.joinpath('captcha') #готовые картинки капч пула
+CAPTCHA_POOL_PURGE_INTERVAL = 300 #если команда не запускалась столько секунд, просроченные капчи удаляются при отрисовке формы
+
+#сессии читаются из кэша и пишутся в базу фоновым потоком пачками, см. main/sessions.py
+#нужен общий для процессов кэш, поэтому с кэшем в памяти (CALLBOARD_CACHE=locmem) сессии хранятся в базе
+SESSION_ENGINE = 'django.contrib.sessions.backends.db' if os.environ.get('CALLBOARD_CACHE', 'locmem') == 'locmem' \
+    else 'main.sessions'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_CLEANUP_BATCH_SIZE = 1000 #просроченных сессий на один DELETE в команде clear_sessions
+#всплывающие сообщения хранятся в cookie, в сессию попадают только не уместившиеся в нее
+MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
+
+#отдача статических файлов самим сайтом, см. main/staticfiles.py (вместо этого их может отдавать веб-сервер из STATIC_ROOT)
+STATIC_SERVE = True
+STATIC_MAX_AGE = 60 #срок кэширования файлов без хэша в имени, с; файлы с хэшем кэшируются на год
+STATIC_FONT_AWESOME_SUBSET = False #оставлять в шрифтах font-awesome только значки из шаблонов (нужен пакет fonttools)
+STATIC_FONT_AWESOME_ICONS = () #значки, добавляемые на страницы динамически, например ('user', 'trash')
@@ -14,21 +14,28 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.contrib.staticfiles.views import serve
-from django.views.decorators.cache import never_cache
 from django.conf.urls.static import static
 
+from main.staticfiles import serve as serve_static
+from main.views import captcha_image, metrics
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),
     path('', include('api.urls')),
+    # картинки капч из пула отдаются готовыми файлами (см. main/captcha_pool.py)
+    re_path(r'^captcha/image/(?P<key>\w+)/$', captcha_image, {'scale': 1}),
+    re_path(r'^captcha/image/(?P<key>\w+)@2/$', captcha_image, {'scale': 2}),
     path('captcha/', include('captcha.urls')),
     path('', include('main.urls'))
 ]
 
+if settings.STATIC_SERVE:
+    # сжатые копии и долгое кэширование файлов из STATIC_ROOT, см. main/staticfiles.py
+    urlpatterns.append(path('static/<path:path>', serve_static))
 if settings.DEBUG:
-    urlpatterns.append(path('static/<path:path>', never_cache(serve)))
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) # маршрут для обработки static files
 
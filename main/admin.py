@@ -2,16 +2,16 @@ from django.contrib import admin
 import datetime
 
 from .forms import SubRubricForm
-from .models import AdvUser, SuperRubric, SubRubric, AdditionalImage, Ad
-from .utilities import send_activation_notification
+from .models import AdvUser, SuperRubric, SubRubric, AdditionalImage, Ad, OutgoingMail
+from .deletion import delete_ads, delete_users
+from . import utilities
 
 
 def send_activation_notifications(modeladmin, request, queryset):
-    for rec in queryset:
-        if not rec.is_activated:
-            send_activation_notification(rec)
-    modeladmin.message_user(request, 'Письма с напоминаниями отправлены')
-send_activation_notification.short_description = 'Отправка писем с напоминанием о необходимости активации'
+    users = queryset.filter(is_activated=False)
+    utilities.send_activation_notifications(users) # письма ставятся в очередь одним запросом
+    modeladmin.message_user(request, 'Письма с напоминаниями поставлены в очередь на отправку')
+send_activation_notifications.short_description = 'Отправка писем с напоминанием о необходимости активации'
 
 
 class NonactivatedFilter(admin.SimpleListFilter):
@@ -44,7 +44,10 @@ class AdvUserAdmin(admin.ModelAdmin):
               'groups', 'user_permissions',
               ('last_login', 'date_joined'))
     readonly_fields = ('last_login', 'date_joined')
-    actions = (send_activation_notification,) #рассылка напоминаний неактивировавшимся пользователям
+    actions = (send_activation_notifications,) #рассылка напоминаний неактивировавшимся пользователям
+
+    def delete_queryset(self, request, queryset): # действие "Удалить выбранные" - массовым удалением
+        delete_users(queryset)
 
 
 class SubRubricInline(admin.TabularInline): # с помощью TabularInline две связанные модели можно поместить на одну
@@ -54,11 +57,14 @@ class SubRubricInline(admin.TabularInline): # с помощью TabularInline д
 
 class SuperRubricAdmin(admin.ModelAdmin):
     exclude = ('super_rubric',) # убирает поле выбора надрубрики из формы создания надрубрик
+    list_display = ('__str__', 'ad_count') # счетчик хранится в записи, запросов COUNT нет
     inlines = (SubRubricInline,) #inlines добавляет поля модели SubRubric через TabularInline
 
 
 class SubRubricAdmin(admin.ModelAdmin):
     form = SubRubricForm
+    list_display = ('__str__', 'ad_count')
+    list_select_related = ('super_rubric',)
 
 
 class AdditionalImageInline(admin.TabularInline):
@@ -66,13 +72,25 @@ class AdditionalImageInline(admin.TabularInline):
 
 
 class AdAdmin(admin.ModelAdmin):
-    list_display = ('rubric', 'title', 'author', 'created_at')
+    list_display = ('rubric', 'title', 'author', 'created_at', 'comment_count')
+    list_select_related = ('rubric__super_rubric', 'author') # __str__ подрубрики обращается к надрубрике
     fields = (('rubric', 'author'), 'title', 'content', 'price', #'rubric' и 'author' вывели в одну строку для удобства.
               'contacts', 'image', 'is_active')
     inlines = (AdditionalImageInline,)
 
+    def delete_queryset(self, request, queryset):
+        delete_ads(queryset)
+
+
+class OutgoingMailAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'user', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('user',)
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
 
 admin.site.register(AdvUser, AdvUserAdmin)
 admin.site.register(SuperRubric, SuperRubricAdmin)
 admin.site.register(SubRubric, SubRubricAdmin)
 admin.site.register(Ad, AdAdmin)
+admin.site.register(OutgoingMail, OutgoingMailAdmin)
@@ -0,0 +1,69 @@
+"""Средства для асинхронных контроллеров (ASGI, настройка ASYNC_VIEWS).
+
+В Django 3.2 нет асинхронного интерфейса ORM, а ASGI-обработчик выполняет все
+синхронные контроллеры в одном общем потоке - пока один запрос ждет базу, остальные
+стоят в очереди. Асинхронные контроллеры выполняют запросы к базе, отрисовку шаблонов
+и прочий синхронный код через run_sync() в потоках общего пула, поэтому независимые
+запросы одной страницы можно выполнять одновременно (asyncio.gather), а разные
+страницы не ждут друг друга.
+
+Пул свой, на ASYNC_THREADS потоков: пул по умолчанию (sync_to_async) на машине с одним
+ядром дает всего пять потоков. Размер пула - наибольшее число одновременных обращений
+к базе из асинхронных контроллеров процесса. У каждого потока свое подключение к базе;
+после вызова оно закрывается, если истек CONN_MAX_AGE или подключение неисправно, иначе
+используется следующими вызовами в этом потоке. Контекстные переменные (реплика
+запроса, метрики, см. replicas.py и metrics.py) передаются в поток."""
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.shortcuts import render
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(getattr(settings, 'ASYNC_THREADS', 32),
+                                               thread_name_prefix='callboard-sync')
+    return _executor
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_sync(func):
+    '''Асинхронный вариант синхронной функции func, выполняемой в потоке пула'''
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), partial(context.run, _call, func, args, kwargs))
+    return wrapper
+
+
+async def render_async(request, template_name, context=None):
+    '''render() в потоке пула: обработчики контекста и шаблоны могут обращаться к базе'''
+    return await run_sync(render)(request, template_name, context)
+
+
+def async_view(view):
+    '''Асинхронная обертка синхронного контроллера, выполняемого в потоке пула, а не
+    в общем потоке синхронных контроллеров'''
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run_sync(view)(request, *args, **kwargs)
+    return wrapper
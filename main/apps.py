@@ -9,6 +9,15 @@ class MainConfig(AppConfig):
     name = 'main'
     verbose_name = 'Доска объявлений'
 
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401 регистрируем обработчики сигналов моделей
+        from .metrics import install_dispatcher
+        from .replicas import check_connections
+        request_started.connect(check_connections, dispatch_uid='main.replicas.check_connections')
+        connection_created.connect(install_dispatcher, dispatch_uid='main.metrics.install_dispatcher')
+
 
 user_registered = Signal(providing_args=['instance'])
 
@@ -20,6 +29,16 @@ def user_registered_dispatcher(sender, **kwargs):
 user_registered.connect(user_registered_dispatcher)
 
 
+ads_deleted = Signal() # аргументы: ads - список словарей с pk, rubric_id, author_id и is_active удаленных объявлений
+# сигналы массовых операций (main/bulk.py), отправляются после фиксации транзакции:
+ads_created = Signal() # ads - словари с pk, rubric_id, author_id, is_active добавленных объявлений,
+                       # images - имена файлов их изображений
+ads_updated = Signal() # ads - то же плюс previous_rubric_id и was_active (значения до изменения),
+                       # images - имена новых файлов изображений
+comments_changed = Signal() # comments - словари с pk, ad_id, is_active и created (новый комментарий)
+                            # или was_active (прежнее значение is_active)
+
+
 
 
 
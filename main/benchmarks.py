@@ -0,0 +1,301 @@
+"""Замеры производительности страниц сайта, API и обработчика контекста боковой панели.
+
+Сценарии выполняются тестовым клиентом на текущей базе (заполнить ее можно командой
+manage.py seed_callboard): сначала warmup раз без замеров, затем repeat раз с замером
+времени. Количество SQL-запросов (CaptureQueriesContext) и выделения памяти
+(tracemalloc) считаются отдельными проходами, чтобы их накладные расходы не попадали
+во время. Страницы для гостей кэшируются (main/caching.py): в сценариях ":cold" кэш
+очищается перед каждым запросом, в сценариях ":warm" - нет. На время замеров все
+псевдонимы CACHES заменяются кэшем в памяти процесса, так что общий кэш не затрагивается.
+
+Результаты - словарь, пригодный для записи в JSON; compare() сравнивает результаты двух
+версий и отмечает ухудшения. Используется командой manage.py benchmark.
+
+run_load() - нагрузочный прогон для сравнения WSGI и ASGI (manage.py benchmark_load):
+много одновременных запросов через обработчик WSGI в пуле потоков или через
+обработчик ASGI в цикле событий, с искусственной задержкой каждого SQL-запроса,
+изображающей сетевую задержку до сервера базы."""
+
+import asyncio
+import contextvars
+import gc
+import itertools
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.test import AsyncClient, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+Scenario = namedtuple('Scenario', ('name', 'run', 'prepare'))
+
+ALLOCATION_RUNS = 5 # проходов с tracemalloc на сценарий
+METRICS = ('p50_ms', 'p95_ms', 'queries', 'peak_kb') # сравниваемые показатели
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _request(client, url):
+    def run():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise BenchmarkError(f'{url}: код ответа {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+    return run
+
+
+def get_scenarios(using='default'):
+    '''Список сценариев (Scenario) по данным текущей базы'''
+    from .caching import get_cache
+    from .middlewares import callboard_context_processor
+    from .models import Ad, SubRubric
+    from .pagination import KeysetPaginator
+    from .rubric_tree import invalidate_rubric_tree
+    active = Ad.objects.using(using).filter(is_active=True)
+    ad = active.order_by('-comment_count').only('pk', 'rubric', 'title').first()
+    rubric = SubRubric.objects.using(using).order_by('-ad_count').first()
+    if ad is None or rubric is None:
+        raise BenchmarkError('Нет объявлений - заполните базу командой manage.py seed_callboard')
+    keyword = ad.title.split()[0]
+    cursor = KeysetPaginator(active.for_list(), 2).get_page().next_cursor or ''
+    client = Client()
+
+    def clear_cache():
+        get_cache().clear()
+
+    def clear_sidebar():
+        invalidate_rubric_tree()
+        get_cache().clear()
+
+    factory = RequestFactory()
+
+    def sidebar():
+        return callboard_context_processor(factory.get('/'))
+
+    pages = [
+        ('index:cold', '/', clear_cache),
+        ('index:warm', '/', None),
+        ('index_page2:cold', f'/?page={cursor}', clear_cache),
+        ('by_rubric:cold', f'/{rubric.pk}/', clear_cache),
+        ('by_rubric_keyword:cold', f'/{rubric.pk}/?keyword={keyword}', clear_cache),
+        ('detail:cold', f'/{ad.rubric_id}/{ad.pk}/', clear_cache),
+        ('detail:warm', f'/{ad.rubric_id}/{ad.pk}/', None),
+        ('api_rubrics', '/rubrics/', None),
+        ('api_ads', '/ads/all', None),
+        ('api_ads_fields', '/ads/all?fields=id,title,price,created_at', None),
+        ('api_ads_filter', f'/ads/all?rubric={rubric.pk}&price_min=1000&price_max=50000', None),
+        ('api_ads_keyword', f'/ads/all?keyword={keyword}', None),
+        ('api_ad_detail', f'/ads/{ad.pk}/', None),
+    ]
+    scenarios = [Scenario(name, _request(client, url), prepare) for name, url, prepare in pages]
+    scenarios.append(Scenario('sidebar_context:cold', sidebar, clear_sidebar))
+    scenarios.append(Scenario('sidebar_context:warm', sidebar, None))
+    return scenarios
+
+
+def summarize(timings):
+    '''Процентили времени в миллисекундах'''
+    if len(timings) > 1:
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    else:
+        cuts = timings * 99
+    summary = {'min_ms': min(timings), 'mean_ms': statistics.fmean(timings),
+               'p50_ms': cuts[49], 'p90_ms': cuts[89], 'p95_ms': cuts[94], 'p99_ms': cuts[98],
+               'max_ms': max(timings)}
+    return {name: round(value, 3) for name, value in summary.items()}
+
+
+def measure(scenario, repeat=50, warmup=3, allocations=True, using='default'):
+    '''Замеряет один сценарий. Возвращает словарь с процентилями, числом запросов и памятью'''
+    def prepare():
+        if scenario.prepare:
+            scenario.prepare()
+
+    for _ in range(warmup):
+        prepare()
+        scenario.run()
+    prepare()
+    with CaptureQueriesContext(connections[using]) as context:
+        scenario.run()
+    result = {'queries': len(context.captured_queries)}
+
+    timings = []
+    gc.collect()
+    for _ in range(repeat):
+        prepare()
+        start = time.perf_counter()
+        scenario.run()
+        timings.append((time.perf_counter() - start) * 1000)
+    result.update(summarize(timings))
+
+    if allocations:
+        peaks, retained = [], []
+        tracemalloc.start()
+        try:
+            for _ in range(min(repeat, ALLOCATION_RUNS)):
+                prepare()
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                scenario.run()
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(current - before)
+        finally:
+            tracemalloc.stop()
+        result['peak_kb'] = round(statistics.median(peaks) / 1024, 1)
+        result['retained_kb'] = round(statistics.median(retained) / 1024, 1)
+    return result
+
+
+def _git_commit():
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                   capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return completed.stdout.strip() or None
+
+
+def get_meta(repeat, warmup, using='default'):
+    from .models import Ad, AdditionalImage, AdvUser, Comment, Rubric
+    return {
+        'created_at': timezone.now().isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connections[using].vendor,
+        'debug': settings.DEBUG,
+        'repeat': repeat,
+        'warmup': warmup,
+        'rows': {model._meta.model_name: model.objects.using(using).count()
+                 for model in (Rubric, AdvUser, Ad, AdditionalImage, Comment)},
+    }
+
+
+def run_benchmarks(repeat=50, warmup=3, only=None, allocations=True, using='default', log=None):
+    '''Выполняет сценарии (only - список названий или их начал) и возвращает
+    {'meta': {...}, 'results': {сценарий: {...}}}'''
+    caches = {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                      'LOCATION': f'callboard-benchmark-{alias}'} for alias in settings.CACHES}
+    with override_settings(CACHES=caches, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        scenarios = get_scenarios(using)
+        if only:
+            scenarios = [scenario for scenario in scenarios
+                         if any(scenario.name.startswith(prefix) for prefix in only)]
+        results = {}
+        for scenario in scenarios:
+            results[scenario.name] = measure(scenario, repeat, warmup, allocations, using)
+            if log:
+                log(scenario.name, results[scenario.name])
+    return {'meta': get_meta(repeat, warmup, using), 'results': results}
+
+
+def compare(baseline, current, threshold=0.2):
+    '''Сравнивает результаты двух прогонов. Время и память считаются ухудшившимися,
+    если выросли больше чем на threshold (доля), число запросов - при любом росте.
+    Возвращает список (сценарий, показатель, было, стало, ухудшение)'''
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric in METRICS:
+            if metric not in result or metric not in before:
+                continue
+            old, new = before[metric], result[metric]
+            if metric == 'queries':
+                regression = new > old
+            else:
+                regression = new > old * (1 + threshold)
+            rows.append((name, metric, old, new, regression))
+    return rows
+
+
+def get_load_urls(using='default'):
+    '''Адреса для нагрузочного прогона: главная, рубрика, объявление и API объявлений'''
+    from .models import Ad
+    ad = Ad.objects.using(using).filter(is_active=True).order_by('-comment_count').first()
+    if ad is None:
+        raise BenchmarkError('Нет объявлений - заполните базу командой manage.py seed_callboard')
+    return ['/', f'/{ad.rubric_id}/', f'/{ad.rubric_id}/{ad.pk}/', '/ads/all', f'/ads/{ad.pk}/']
+
+
+def _sql_delay(seconds):
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+def _run_wsgi(urls, concurrency, total):
+    clients = {}
+    numbers = itertools.count()
+
+    def run(url):
+        client = clients.setdefault(threading.get_ident(), Client())
+        start = time.perf_counter()
+        response = client.get(url)
+        return url, response.status_code, time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        # в потоки пула передается контекст с обертками SQL-запросов (см. metrics.execute_wrapper)
+        futures = [executor.submit(contextvars.copy_context().run, run, urls[next(numbers) % len(urls)])
+                   for _ in range(total)]
+        return [future.result() for future in futures]
+
+
+async def _run_asgi(urls, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncClient()
+
+    async def run(url):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(url)
+            return url, response.status_code, time.perf_counter() - start
+
+    return await asyncio.gather(*(run(urls[number % len(urls)]) for number in range(total)))
+
+
+def run_load(server='wsgi', concurrency=50, total=1000, sql_delay_ms=2.0, page_cache=False,
+             urls=None, using='default'):
+    '''Выполняет total запросов по адресам urls, не больше concurrency одновременно,
+    через обработчик server ('wsgi' или 'asgi'). Без page_cache кэш страниц отключен
+    (DummyCache), и каждый запрос выполняет контроллер. Возвращает пропускную способность
+    и процентили времени ответа'''
+    from .metrics import execute_wrapper
+    if server not in ('wsgi', 'asgi'):
+        raise BenchmarkError(f'Неизвестный обработчик {server}')
+    urls = urls or get_load_urls(using)
+    backend = 'django.core.cache.backends.locmem.LocMemCache' if page_cache \
+        else 'django.core.cache.backends.dummy.DummyCache'
+    caches = {alias: {'BACKEND': backend, 'LOCATION': f'callboard-load-{alias}'} for alias in settings.CACHES}
+    with override_settings(CACHES=caches, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                           QUERY_DETECTOR=False), execute_wrapper(_sql_delay(sql_delay_ms / 1000)):
+        start = time.perf_counter()
+        if server == 'wsgi':
+            results = _run_wsgi(urls, concurrency, total)
+        else:
+            results = asyncio.run(_run_asgi(urls, concurrency, total))
+        elapsed = time.perf_counter() - start
+    errors = [(url, status) for url, status, _ in results if status != 200]
+    if errors:
+        raise BenchmarkError(f'{len(errors)} ответов с ошибкой, например {errors[0][0]}: код {errors[0][1]}')
+    report = {'server': server, 'async_views': getattr(settings, 'ASYNC_VIEWS', False),
+              'concurrency': concurrency, 'requests': total, 'sql_delay_ms': sql_delay_ms,
+              'page_cache': page_cache, 'rps': round(total / elapsed, 1)}
+    report.update(summarize([duration * 1000 for _, _, duration in results]))
+    return report
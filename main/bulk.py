@@ -0,0 +1,166 @@
+"""Массовые операции над объявлениями, иллюстрациями и комментариями (импорт,
+пакетные запросы API).
+
+bulk_create, bulk_update и update() не отправляют сигналов моделей, поэтому то,
+что при обычном сохранении делают обработчики post_save, выполняется здесь:
+поисковые термины записываются сразу, а после фиксации транзакции отправляются
+сигналы ads_created, ads_updated и comments_changed (см. apps.py), по которым
+обновляются версии кэша, создаются миниатюры и т. п. Счетчики объявлений и
+комментариев (main/counters.py) изменяются в той же транзакции."""
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import counters
+from .apps import ads_created, ads_updated, comments_changed
+from .notifications import add_comment_events
+from .search import build_terms
+
+
+def bulk_insert(model, objects, using='default', batch_size=None):
+    '''bulk_create, после которого у всех объектов заполнены ключи'''
+    if not objects:
+        return
+    manager = model.objects.using(using)
+    new = [obj for obj in objects if obj.pk is None]
+    given = [obj.pk for obj in objects if obj.pk is not None]
+    with transaction.atomic(using=using):
+        manager.bulk_create(objects, batch_size=batch_size)
+        if not new or connections[using].features.can_return_rows_from_bulk_insert:
+            return
+        # без RETURNING (SQLite в Django 3.2) bulk_create не сообщает ключи новых записей,
+        # поэтому они читаются, как в seeding._new_pks: до конца транзакции писать в базу SQLite
+        # может только это подключение, так что последние len(new) ключей принадлежат
+        # только что добавленным записям и идут в порядке добавления
+        pks = manager.exclude(pk__in=given) \
+            .order_by('-pk').values_list('pk', flat=True)[:len(new)]
+        for obj, pk in zip(new, sorted(pks)):
+            obj.pk = pk
+            obj._state.adding = False
+            obj._state.db = using
+
+
+def index_ads(ads, using='default', batch_size=None):
+    '''Записывает поисковые термины объявлений (на PostgreSQL вектор заполняет триггер)'''
+    from .models import AdSearchTerm
+    if not ads or connections[using].vendor == 'postgresql':
+        return
+    AdSearchTerm.objects.using(using).filter(ad__in=[ad.pk for ad in ads])._raw_delete(using)
+    AdSearchTerm.objects.using(using).bulk_create(
+        [AdSearchTerm(ad_id=ad.pk, term=term, weight=weight) for ad in ads
+         for term, weight in build_terms(ad).items()],
+        batch_size=batch_size)
+
+
+def ad_info(ad, **extra):
+    return dict(pk=ad.pk, rubric_id=ad.rubric_id, author_id=ad.author_id, is_active=ad.is_active, **extra)
+
+
+def _send_on_commit(signal, sender, using, **kwargs):
+    transaction.on_commit(lambda: signal.send(sender, using=using, **kwargs), using=using)
+
+
+def create_ads(ads, images=(), using='default', batch_size=None):
+    '''Добавляет объявления и их дополнительные иллюстрации (AdditionalImage с ad=объявление)'''
+    from .models import Ad, AdditionalImage
+    if not ads:
+        return
+    images = list(images)
+    with transaction.atomic(using=using):
+        bulk_insert(Ad, ads, using, batch_size)
+        bulk_insert(AdditionalImage, images, using, batch_size)
+        index_ads(ads, using, batch_size)
+        counters.update_rubric_counts(counters.ad_deltas((None, False, ad.rubric_id, ad.is_active) for ad in ads),
+                                      using)
+        names = [ad.image.name for ad in ads if ad.image] + [image.image.name for image in images]
+        _send_on_commit(ads_created, Ad, using, ads=[ad_info(ad) for ad in ads], images=names)
+
+
+def update_ads(ads, fields, using='default', batch_size=None):
+    '''Сохраняет поля fields измененных объявлений одним запросом UPDATE на пачку.
+    Прежние рубрика и is_active берутся из _loaded_rubric_id и _loaded_is_active (см. main.signals)'''
+    from .models import Ad
+    if not ads:
+        return
+    now = timezone.now()
+    for ad in ads:
+        ad.updated_at = now
+    info = [ad_info(ad, previous_rubric_id=getattr(ad, '_loaded_rubric_id', ad.rubric_id),
+                    was_active=getattr(ad, '_loaded_is_active', ad.is_active)) for ad in ads]
+    with transaction.atomic(using=using):
+        Ad.objects.using(using).bulk_update(ads, list({*fields, 'updated_at'}), batch_size=batch_size)
+        if 'title' in fields or 'content' in fields:
+            index_ads(ads, using, batch_size)
+        counters.update_rubric_counts(counters.ad_deltas(
+            (ad['previous_rubric_id'], ad['was_active'], ad['rubric_id'], ad['is_active']) for ad in info), using)
+        names = [ad.image.name for ad in ads if ad.image] if 'image' in fields else []
+        _send_on_commit(ads_updated, Ad, using, images=names, ads=info)
+    for ad in ads:
+        ad._loaded_rubric_id = ad.rubric_id
+        ad._loaded_is_active = ad.is_active
+
+
+def deactivate_ads(ads, using='default'):
+    '''Снимает объявления с публикации одним запросом UPDATE'''
+    from .models import Ad
+    ads = [ad for ad in ads if ad.is_active]
+    if not ads:
+        return 0
+    for ad in ads:
+        ad.is_active = False
+        ad._loaded_is_active = False
+    with transaction.atomic(using=using):
+        Ad.objects.using(using).filter(pk__in=[ad.pk for ad in ads]) \
+            .update(is_active=False, updated_at=timezone.now())
+        counters.update_rubric_counts(counters.ad_deltas((ad.rubric_id, True, None, False) for ad in ads), using)
+        _send_on_commit(ads_updated, Ad, using, images=[],
+                        ads=[ad_info(ad, previous_rubric_id=ad.rubric_id, was_active=True) for ad in ads])
+    return len(ads)
+
+
+def create_images(images, using='default', batch_size=None):
+    '''Добавляет дополнительные иллюстрации к уже существующим объявлениям'''
+    from .models import Ad, AdditionalImage
+    if not images:
+        return
+    with transaction.atomic(using=using):
+        bulk_insert(AdditionalImage, images, using, batch_size)
+        ads = {image.ad.pk: image.ad for image in images}
+        _send_on_commit(ads_updated, Ad, using, images=[image.image.name for image in images],
+                        ads=[ad_info(ad, previous_rubric_id=ad.rubric_id, was_active=ad.is_active)
+                             for ad in ads.values()])
+
+
+def comment_info(comment, **extra):
+    return dict(pk=comment.pk, ad_id=comment.ad_id, is_active=comment.is_active, **extra)
+
+
+def create_comments(comments, using='default', batch_size=None):
+    '''Добавляет комментарии и события для дайджестов авторам объявлений'''
+    from .models import Comment
+    if not comments:
+        return
+    with transaction.atomic(using=using):
+        bulk_insert(Comment, comments, using, batch_size)
+        add_comment_events(comments, using)
+        counters.update_comment_counts(counters.comment_deltas(
+            (comment.ad_id, False, comment.is_active) for comment in comments), using)
+        _send_on_commit(comments_changed, Comment, using,
+                        comments=[comment_info(comment, created=True) for comment in comments])
+
+
+def update_comments(comments, fields, using='default', batch_size=None):
+    '''Сохраняет поля fields комментариев. У каждого комментария должен быть атрибут
+    _loaded_is_active - значение is_active до изменения (см. main.signals)'''
+    from .models import Comment
+    if not comments:
+        return
+    info = [comment_info(comment, was_active=getattr(comment, '_loaded_is_active', comment.is_active))
+            for comment in comments]
+    with transaction.atomic(using=using):
+        Comment.objects.using(using).bulk_update(comments, list(fields), batch_size=batch_size)
+        counters.update_comment_counts(counters.comment_deltas(
+            (comment['ad_id'], comment['was_active'], comment['is_active']) for comment in info), using)
+        _send_on_commit(comments_changed, Comment, using, comments=info)
+    for comment in comments:
+        comment._loaded_is_active = comment.is_active
@@ -0,0 +1,161 @@
+"""Кэширование страниц для анонимных посетителей.
+
+Вместо удаления ключей по шаблону (его не поддерживают кэши в памяти и в файлах)
+используются "версии": для каждой группы данных (все объявления, рубрика, объявление,
+боковая панель) в кэше хранится момент ее последнего изменения. Версии входят в ключи
+кэшированных страниц и фрагментов, поэтому после изменения данных старые записи просто
+перестают использоваться и со временем вытесняются. Версии обновляются обработчиками
+сигналов моделей после фиксации транзакции (см. main.signals). Они же служат значениями ETag и Last-Modified,
+что позволяет отвечать 304 Not Modified, не выполняя контроллер."""
+
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .aio import run_sync
+from .metrics import record_cache
+
+VERSION_PREFIX = 'main:version:'
+PAGE_PREFIX = 'main:page:'
+
+ALL_ADS = 'ads'
+SIDEBAR = 'sidebar'
+
+
+def rubric_key(pk):
+    return f'rubric:{pk}'
+
+
+def ad_key(pk):
+    return f'ad:{pk}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def get_versions(*names):
+    '''Возвращает моменты последнего изменения для групп names. Отсутствующая версия
+    (например, вытесненная из кэша) считается изменившейся только что'''
+    cache = get_cache()
+    keys = [VERSION_PREFIX + name for name in names]
+    found = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in found:
+            cache.add(key, now, None)
+            found[key] = now
+    return [found[key] for key in keys]
+
+
+def touch(*names):
+    '''Отмечает группы данных как измененные'''
+    now = time.time()
+    get_cache().set_many({VERSION_PREFIX + name: now for name in names if name}, None)
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def is_cacheable_request(request):
+    '''Кэшируются только GET/HEAD-запросы гостей, для которых нет всплывающих сообщений'''
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    if request.COOKIES.get(getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages')):
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES and '_messages' in request.session:
+        return False
+    return True
+
+
+def _apply_validators(response, etag, last_modified):
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    return response
+
+
+def _as_timestamp(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return value
+
+
+def cache_anonymous_page(get_dependencies, get_validators=None, store=True, timeout=None):
+    '''Декоратор контроллера. get_dependencies(request, *args, **kwargs) возвращает имена
+    групп данных, от которых зависит страница. get_validators(request, *args, **kwargs),
+    если задан, возвращает дополнительные значения для ETag и моменты изменения
+    (datetime или timestamp) для Last-Modified; если запись не найдена, он возвращает None,
+    и контроллер выполняется как обычно. При store=False страница не сохраняется в кэше,
+    используются только условные запросы (например, для страниц с формами).
+    Подходит и для асинхронных контроллеров.'''
+    if timeout is None:
+        timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+
+    def decorator(view):
+        def before(request, *args, **kwargs):
+            '''Готовый ответ (304 или из кэша) либо None и данные для after()'''
+            if not is_cacheable_request(request):
+                record_cache('bypass')
+                return None, None
+            names = get_dependencies(request, *args, **kwargs)
+            versions = get_versions(*names)
+            extra = []
+            if get_validators:
+                validators = get_validators(request, *args, **kwargs)
+                if validators is None:
+                    return None, None
+                extra = list(validators)
+            etag = make_etag(request.path, request.GET.get('keyword', ''), request.GET.get('page', ''),
+                             *versions, *extra)
+            last_modified = int(max([*versions, *(_as_timestamp(v) for v in extra if isinstance(v, datetime))]))
+            response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+            if response is not None:
+                record_cache('not_modified')
+                return _apply_validators(response, etag, last_modified), None
+            key = PAGE_PREFIX + etag
+            response = get_cache().get(key) if store else None
+            record_cache('bypass' if not store else 'miss' if response is None else 'hit')
+            if response is not None:
+                return _apply_validators(response, etag, last_modified), None
+            return None, (key, etag, last_modified)
+
+        def after(response, state):
+            if state is None:
+                return response
+            key, etag, last_modified = state
+            if store and response.status_code == 200 and not response.streaming and not response.cookies:
+                get_cache().set(key, response, timeout)
+            return _apply_validators(response, etag, last_modified)
+
+        if asyncio.iscoroutinefunction(view):
+            # обращения к кэшу и базе выполняются в потоке пула, см. aio.py
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response, state = await run_sync(before)(request, *args, **kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    response = await run_sync(after)(response, state)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response, state = before(request, *args, **kwargs)
+            if response is None:
+                response = after(view(request, *args, **kwargs), state)
+            return response
+        return wrapper
+    return decorator
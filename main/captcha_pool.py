@@ -0,0 +1,199 @@
+"""Пул заранее созданных капч для формы комментария гостя.
+
+Без пула каждая отрисовка формы добавляет запись CaptchaStore, а каждая проверка
+ответа удаляет все просроченные записи (CaptchaStore.remove_expired()), и картинка
+рисуется при каждом запросе к ней. Команда captcha_pool заранее создает
+CAPTCHA_POOL_SIZE капч пачками (один INSERT на пачку), рисует их картинки в папку
+CAPTCHA_POOL_DIR и периодически удаляет просроченные записи одним запросом DELETE
+вместе с их картинками, пополняя пул новыми.
+
+Запись пула живет CAPTCHA_POOL_LIFETIME минут, а выдается, пока до ее истечения
+остается не меньше CAPTCHA_TIMEOUT минут, - у посетителя столько же времени на ответ,
+сколько и без пула. Ключи пригодных капч каждый процесс держит в памяти и перечитывает
+из базы не чаще раза в CAPTCHA_POOL_REFRESH секунд; решенные капчи отмечаются в кэше,
+чтобы другие процессы не выдавали их до перечитывания. Если пул пуст (команда
+не запускалась), капча создается, как раньше, по одной на отрисовку формы.
+
+Библиотека при CAPTCHA_GET_FROM_POOL не удаляет просроченные записи сама. Если команда
+не пополняла пул последние CAPTCHA_POOL_PURGE_INTERVAL секунд, их при отрисовке формы
+удаляет purge_if_stale() - не чаще раза в CAPTCHA_POOL_PURGE_INTERVAL секунд на все процессы."""
+
+import datetime
+import hashlib
+import os
+import random
+import secrets
+import threading
+import time
+
+from captcha.conf import settings as captcha_settings
+from captcha.models import CaptchaStore
+from captcha.views import captcha_image
+from django.conf import settings
+from django.utils import timezone
+
+from .caching import get_cache
+
+USED_PREFIX = 'main:captcha-used:'
+REFILLED_KEY = 'main:captcha-refilled'
+PURGED_KEY = 'main:captcha-purged'
+PICK_ATTEMPTS = 3
+
+_lock = threading.Lock()
+_keys = []
+_loaded_at = None
+
+
+def get_pool_dir():
+    return str(getattr(settings, 'CAPTCHA_POOL_DIR', os.path.join(settings.MEDIA_ROOT, 'captcha')))
+
+
+def get_lifetime():
+    '''Время жизни записи пула в минутах'''
+    return getattr(settings, 'CAPTCHA_POOL_LIFETIME', 30)
+
+
+def get_refresh():
+    return getattr(settings, 'CAPTCHA_POOL_REFRESH', 60)
+
+
+def get_purge_interval():
+    return getattr(settings, 'CAPTCHA_POOL_PURGE_INTERVAL', 300)
+
+
+def image_path(key, scale=1):
+    return os.path.join(get_pool_dir(), f'{key}@2.png' if scale == 2 else f'{key}.png')
+
+
+def _min_expiration(extra=0):
+    '''Записи, истекающие раньше, посетителям уже не выдаются'''
+    return timezone.now() + datetime.timedelta(minutes=int(captcha_settings.CAPTCHA_TIMEOUT), seconds=extra)
+
+
+def _scales():
+    return (1, 2) if captcha_settings.CAPTCHA_2X_IMAGE else (1,)
+
+
+def render_images(keys):
+    '''Рисует картинки капч keys в папку пула (так же, как их рисует captcha.views)'''
+    os.makedirs(get_pool_dir(), exist_ok=True)
+    for key in keys:
+        for scale in _scales():
+            response = captcha_image(None, key, scale)
+            if response.status_code != 200:
+                continue
+            path = image_path(key, scale)
+            with open(path + '.tmp', 'wb') as file:
+                file.write(response.content)
+            os.replace(path + '.tmp', path)
+
+
+def create(count, batch_size=100):
+    '''Добавляет в пул count капч пачками по batch_size. Возвращает их ключи'''
+    generator = captcha_settings.get_challenge()
+    expiration = timezone.now() + datetime.timedelta(minutes=get_lifetime())
+    created = []
+    while count > 0:
+        stores = []
+        for _ in range(min(count, batch_size)):
+            challenge, response = generator()
+            stores.append(CaptchaStore(challenge=challenge, response=response.lower(), expiration=expiration,
+                                       hashkey=hashlib.sha1(secrets.token_bytes(20)).hexdigest()))
+        CaptchaStore.objects.bulk_create(stores)
+        keys = [store.hashkey for store in stores]
+        render_images(keys)
+        created.extend(keys)
+        count -= len(stores)
+    return created
+
+
+def _file_key(name):
+    return name.split('.')[0].split('@')[0]
+
+
+def purge_expired():
+    '''Удаляет просроченные записи CaptchaStore одним запросом DELETE (без загрузки записей
+    и сигналов) и картинки капч, которых больше нет в базе. Возвращает (записей, файлов)'''
+    expired = CaptchaStore.objects.filter(expiration__lte=timezone.now())
+    rows = expired._raw_delete(expired.db)
+    directory = get_pool_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return rows, 0
+    # решенные капчи удаляет сама библиотека, поэтому с базой сверяются все файлы
+    keys = list({_file_key(name) for name in names})
+    alive = set()
+    for start in range(0, len(keys), 500):
+        alive.update(CaptchaStore.objects.filter(hashkey__in=keys[start:start + 500])
+                     .values_list('hashkey', flat=True))
+    files = 0
+    for name in names:
+        if _file_key(name) not in alive:
+            try:
+                os.remove(os.path.join(directory, name))
+                files += 1
+            except FileNotFoundError:
+                pass
+    return rows, files
+
+
+def refill(size=None, batch_size=100, interval=0):
+    '''Удаляет просроченное и пополняет пул до size капч, пригодных еще interval секунд
+    (до следующего пополнения). Возвращает (создано, удалено записей, удалено файлов)'''
+    size = size if size is not None else getattr(settings, 'CAPTCHA_POOL_SIZE', 500)
+    rows, files = purge_expired()
+    available = CaptchaStore.objects.filter(expiration__gt=_min_expiration(interval)).count()
+    created = create(size - available, batch_size) if available < size else []
+    # пока пул пополняется, просроченное удаляет только команда
+    get_cache().set(REFILLED_KEY, True, interval + get_purge_interval())
+    return len(created), rows, files
+
+
+def purge_if_stale():
+    '''Удаляет просроченные записи, если команда давно не пополняла пул, но не чаще раза
+    в CAPTCHA_POOL_PURGE_INTERVAL секунд. Возвращает результат purge_expired() или None'''
+    cache = get_cache()
+    if cache.get(REFILLED_KEY) is None and cache.add(PURGED_KEY, True, get_purge_interval()):
+        return purge_expired()
+    return None
+
+
+def get_keys():
+    '''Ключи капч пула, которые еще можно выдавать, из памяти процесса'''
+    global _keys, _loaded_at
+    now = time.monotonic()
+    if _loaded_at is None or now - _loaded_at >= get_refresh():
+        with _lock:
+            if _loaded_at is None or now - _loaded_at >= get_refresh():
+                _keys = list(CaptchaStore.objects.filter(expiration__gt=_min_expiration(get_refresh()))
+                             .values_list('hashkey', flat=True))
+                _loaded_at = now
+    return _keys
+
+
+def pick():
+    '''Ключ случайной нерешенной капчи пула или новой капчи, если пул пуст'''
+    purge_if_stale()
+    keys = get_keys()
+    if keys:
+        candidates = random.sample(keys, min(PICK_ATTEMPTS, len(keys)))
+        used = get_cache().get_many([USED_PREFIX + key for key in candidates])
+        for key in candidates:
+            if USED_PREFIX + key not in used:
+                return key
+    return CaptchaStore.generate_key()
+
+
+def mark_used(key):
+    '''Отмечает капчу решенной: библиотека уже удалила ее запись, и выдавать ее нельзя'''
+    get_cache().set(USED_PREFIX + key, True, get_lifetime() * 60)
+    with _lock:
+        if key in _keys:
+            _keys.remove(key)
+
+
+def reset():
+    global _loaded_at
+    with _lock:
+        _loaded_at = None
@@ -0,0 +1,159 @@
+"""Счетчики: количество активных объявлений в рубрике (Rubric.ad_count; у надрубрики -
+сумма по ее подрубрикам) и количество активных комментариев к объявлению
+(Ad.comment_count).
+
+Чтобы выводить их в боковой панели, админке и API без запроса COUNT на каждую строку,
+счетчики хранятся в самих записях и изменяются запросами
+UPDATE ... SET счетчик = счетчик + N в той же транзакции, что и объявления или
+комментарии: обработчиками сигналов моделей (main.signals), массовыми операциями
+(main/bulk.py) и массовым удалением (main/deletion.py). Обычное сохранение записи
+счетчики не перезаписывает (см. save_without_counters()). В боковую панель счетчики
+рубрик попадают с задержкой до RUBRIC_COUNTS_TIMEOUT секунд (см. rubric_tree.py), чтобы
+изменение объявления не сбрасывало кэш всех страниц. Расхождения, если они все же
+появятся (например, после правки базы вручную), исправляет команда
+manage.py reconcile_counters."""
+
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .rubric_tree import get_rubric_tree
+
+
+def save_without_counters(instance, save, counters, *args, **kwargs):
+    '''Сохраняет существующую запись без полей-счетчиков: их значения в объекте могли
+    устареть, пока он был загружен. Вызывается из save() моделей'''
+    if not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert') \
+            and not instance._state.adding and instance.pk is not None:
+        deferred = instance.get_deferred_fields()
+        kwargs['update_fields'] = [field.name for field in instance._meta.concrete_fields
+                                   if not field.primary_key and field.attname not in deferred
+                                   and field.name not in counters]
+    return save(*args, **kwargs)
+
+
+def ad_deltas(changes):
+    '''changes - кортежи (прежняя рубрика, прежнее is_active, рубрика, is_active) объявлений;
+    у нового объявления прежние значения - (None, False), у удаленного новые - (None, False).
+    Возвращает Counter {рубрика: изменение количества активных объявлений}'''
+    deltas = Counter()
+    for old_rubric, was_active, rubric, is_active in changes:
+        if was_active and old_rubric:
+            deltas[old_rubric] -= 1
+        if is_active and rubric:
+            deltas[rubric] += 1
+    return deltas
+
+
+def comment_deltas(changes):
+    '''changes - кортежи (объявление, прежнее is_active, is_active) комментариев.
+    Возвращает Counter {объявление: изменение количества активных комментариев}'''
+    deltas = Counter()
+    for ad, was_active, is_active in changes:
+        deltas[ad] += bool(is_active) - bool(was_active)
+    return deltas
+
+
+def _apply(queryset, field, deltas):
+    '''По одному UPDATE на каждое значение приращения. Возвращает True, если что-то изменено'''
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        value = F(field) + delta
+        if delta < 0:
+            value = Greatest(value, 0) # расхождение не должно ломать сохранение; его исправит сверка
+        queryset.filter(pk__in=sorted(pks)).update(**{field: value})
+    return bool(by_delta)
+
+
+def _get_super_rubrics(pks, using):
+    from .models import SubRubric
+    supers = {node.pk: node.super_rubric.pk for node in get_rubric_tree()}
+    missing = [pk for pk in pks if pk not in supers]
+    if missing:
+        supers.update(SubRubric.objects.using(using).filter(pk__in=missing).values_list('pk', 'super_rubric'))
+    return supers
+
+
+def update_rubric_counts(deltas, using='default'):
+    '''Изменяет счетчики подрубрик из deltas и их надрубрик'''
+    from .models import Rubric
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    supers = _get_super_rubrics(deltas, using)
+    total = Counter(deltas)
+    for pk, delta in deltas.items():
+        if supers.get(pk):
+            total[supers[pk]] += delta
+    _apply(Rubric.objects.using(using), 'ad_count', total)
+
+
+def update_comment_counts(deltas, using='default'):
+    from .models import Ad
+    _apply(Ad.objects.using(using), 'comment_count', deltas)
+
+
+def _count(queryset, field):
+    '''Подзапрос с количеством записей queryset, у которых field равно ключу внешней записи'''
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field) \
+        .annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts), 0)
+
+
+def _active_ads(using):
+    from .models import Ad
+    return Ad.objects.using(using).filter(is_active=True)
+
+
+def count_rubric_ads(using='default'):
+    '''Фактическое количество активных объявлений: {рубрика: количество}'''
+    from .models import Rubric
+    counts = Counter(dict(_active_ads(using).order_by().values('rubric')
+                          .annotate(count=Count('pk')).values_list('rubric', 'count')))
+    supers = Rubric.objects.using(using).filter(super_rubric__isnull=False).values_list('pk', 'super_rubric')
+    for pk, super_pk in supers:
+        counts[super_pk] += counts[pk]
+    return counts
+
+
+def recount_super_rubrics(using='default'):
+    '''Пересчитывает счетчики всех надрубрик (после переноса или удаления подрубрики)'''
+    from .models import Rubric
+    Rubric.objects.using(using).filter(super_rubric__isnull=True) \
+        .update(ad_count=_count(_active_ads(using), 'rubric__super_rubric'))
+
+
+def reconcile_rubric_counts(using='default', fix=True):
+    '''Сверяет счетчики рубрик с фактическими. Возвращает список (рубрика, было, стало)'''
+    from .models import Rubric
+    actual = count_rubric_ads(using)
+    wrong = [(pk, stored, actual[pk]) for pk, stored in Rubric.objects.using(using).values_list('pk', 'ad_count')
+             if stored != actual[pk]]
+    if wrong and fix:
+        rubrics = Rubric.objects.using(using).filter(pk__in=[pk for pk, _, _ in wrong])
+        with transaction.atomic(using=using):
+            # значения вычисляются в самом UPDATE, чтобы не затереть изменения,
+            # сделанные после подсчета
+            rubrics.filter(super_rubric__isnull=False).update(ad_count=_count(_active_ads(using), 'rubric'))
+            rubrics.filter(super_rubric__isnull=True) \
+                .update(ad_count=_count(_active_ads(using), 'rubric__super_rubric'))
+    return wrong
+
+
+def reconcile_comment_counts(using='default', fix=True, batch_size=1000):
+    '''Сверяет счетчики комментариев объявлений. Возвращает количество неверных счетчиков'''
+    from .models import Ad, Comment
+    active = Comment.objects.using(using).filter(is_active=True)
+    actual = dict(active.order_by().values('ad').annotate(count=Count('pk')).values_list('ad', 'count'))
+    wrong = [pk for pk, stored in Ad.objects.using(using).order_by().values_list('pk', 'comment_count')
+             .iterator(chunk_size=batch_size) if actual.get(pk, 0) != stored]
+    if fix:
+        for start in range(0, len(wrong), batch_size):
+            Ad.objects.using(using).filter(pk__in=wrong[start:start + batch_size]) \
+                .update(comment_count=_count(active, 'ad'))
+    return len(wrong)
@@ -0,0 +1,90 @@
+"""Массовое удаление объявлений и пользователей.
+
+Стандартное удаление обходит записи по одной: для каждой иллюстрации Django
+отправляет сигнал post_delete, а django_cleanup удаляет файл прямо в запросе.
+Здесь объявления, их иллюстрации, комментарии (вместе с событиями для дайджестов,
+которые на них ссылаются) и поисковые термины удаляются
+несколькими запросами DELETE ... WHERE ... IN (подзапрос) в одной транзакции
+(там же уменьшаются счетчики объявлений рубрик), а файлы удаляются фоновым
+потоком пачками после фиксации транзакции.
+
+Так как сигналы моделей при этом не отправляются, по окончании отправляется
+сигнал ads_deleted (см. apps.py) с данными удаленных объявлений."""
+
+import logging
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .apps import ads_deleted, ads_updated
+from .counters import ad_deltas, update_rubric_counts
+from .workers import BatchWorker
+
+logger = logging.getLogger(__name__)
+
+
+def remove_files(names):
+    '''Удаляет файлы из хранилища (то же, что делает django_cleanup при удалении записи)'''
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning('Не удалось удалить файл %s', name, exc_info=True)
+
+
+file_remover = BatchWorker('callboard-file-remover', remove_files, batch_size=200)
+
+
+def delete_ads(queryset):
+    '''Удаляет объявления из queryset вместе с иллюстрациями, комментариями и
+    поисковыми терминами. Возвращает количество удаленных объявлений'''
+    from .models import Ad, AdditionalImage, AdSearchTerm, Comment, CommentEvent
+    db = queryset.db
+    with transaction.atomic(using=db):
+        ads = Ad.objects.using(db).filter(pk__in=queryset.values('pk'))
+        deleted = list(ads.values('pk', 'rubric_id', 'author_id', 'is_active'))
+        if not deleted:
+            return 0
+        ad_pks = ads.values('pk')
+        files = list(ads.exclude(image='').values_list('image', flat=True))
+        images = AdditionalImage.objects.using(db).filter(ad__in=ad_pks)
+        files.extend(images.values_list('image', flat=True))
+        # _raw_delete выполняет один DELETE без загрузки объектов и без сигналов
+        for dependent in (images, CommentEvent.objects.using(db).filter(comment__ad__in=ad_pks),
+                          Comment.objects.using(db).filter(ad__in=ad_pks),
+                          AdSearchTerm.objects.using(db).filter(ad__in=ad_pks)):
+            dependent._raw_delete(db)
+        ads._raw_delete(db)
+        update_rubric_counts(ad_deltas((ad['rubric_id'], ad['is_active'], None, False) for ad in deleted), db)
+        transaction.on_commit(lambda: file_remover.put_many(files), using=db)
+        transaction.on_commit(lambda: ads_deleted.send(Ad, ads=deleted, using=db), using=db)
+    return len(deleted)
+
+
+def delete_images(queryset):
+    '''Удаляет дополнительные иллюстрации из queryset одним запросом DELETE.
+    Возвращает количество удаленных иллюстраций'''
+    from .models import Ad, AdditionalImage
+    from .bulk import ad_info
+    db = queryset.db
+    with transaction.atomic(using=db):
+        images = AdditionalImage.objects.using(db).filter(pk__in=queryset.values('pk'))
+        rows = list(images.values_list('image', 'ad'))
+        if not rows:
+            return 0
+        ads = Ad.objects.using(db).filter(pk__in={ad for _, ad in rows}).only('rubric', 'author', 'is_active')
+        images._raw_delete(db)
+        files = [name for name, _ in rows]
+        info = [ad_info(ad, previous_rubric_id=ad.rubric_id, was_active=ad.is_active) for ad in ads]
+        transaction.on_commit(lambda: file_remover.put_many(files), using=db)
+        transaction.on_commit(lambda: ads_updated.send(Ad, ads=info, images=[], using=db), using=db)
+    return len(rows)
+
+
+def delete_users(queryset):
+    '''Удаляет пользователей вместе со всеми их объявлениями'''
+    from .models import Ad
+    db = queryset.db
+    with transaction.atomic(using=db):
+        delete_ads(Ad.objects.using(db).filter(author__in=queryset.values('pk')))
+        return queryset.delete()
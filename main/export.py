@@ -0,0 +1,145 @@
+"""Потоковая выгрузка объявлений в форматах NDJSON и CSV.
+
+Записи читаются через .values().iterator(chunk_size=...) - на PostgreSQL это
+курсор на стороне сервера, - и сразу превращаются в строки вывода, поэтому
+расход памяти не зависит от количества объявлений. Используется командой
+manage.py export_ads и API (api.views.AdExport).
+
+Для синхронизации изменений служит "водяной знак" - непрозрачная строка с
+позицией (updated_at, id) последнего выгруженного изменения. Выгрузка с
+since=<водяной знак> возвращает только объявления, добавленные или измененные
+после него. Верхняя граница выгрузки фиксируется в начале, так что объявления,
+измененные во время выгрузки, попадут в следующую. Удаленные объявления при
+синхронизации не выгружаются.
+
+updated_at проставляется при сохранении, а не при фиксации транзакции: транзакция,
+начатая раньше, может зафиксироваться уже после выгрузки с более поздним водяным
+знаком, и ее изменение было бы пропущено. Поэтому изменения последних
+EXPORT_WATERMARK_LAG секунд откладываются до следующей выгрузки; задержка должна быть
+больше самой долгой транзакции, изменяющей объявления. Массовые изменения через
+update() тоже должны обновлять updated_at (см. main/bulk.py)."""
+
+import csv
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .pagination import CursorEncoder, decode_cursor, encode_cursor
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATS = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv; charset=utf-8',
+}
+
+FIELDS = ('id', 'rubric', 'title', 'content', 'price', 'contacts', 'image', 'author', 'is_active',
+          'created_at', 'updated_at')
+SOURCES = {'rubric': 'rubric_id', 'author': 'author_id'}
+
+
+def get_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def get_lag():
+    return getattr(settings, 'EXPORT_WATERMARK_LAG', 60)
+
+
+def get_fields(names=None):
+    '''Проверяет список выгружаемых полей. Неизвестные поля вызывают ValueError'''
+    if not names:
+        return list(FIELDS)
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    return list(dict.fromkeys(names))
+
+
+def decode_watermark(watermark):
+    position = decode_cursor(watermark)
+    if position is None or len(position[0]) != 2:
+        raise ValueError('Неверный водяной знак')
+    updated_at, pk = position[0]
+    updated_at = parse_datetime(updated_at) if isinstance(updated_at, str) else None
+    if updated_at is None or not isinstance(pk, int):
+        raise ValueError('Неверный водяной знак')
+    return updated_at, pk
+
+
+def encode_watermark(updated_at, pk):
+    return encode_cursor([updated_at, pk])
+
+
+def prepare_export(queryset, since=None):
+    '''Возвращает (набор записей для выгрузки, новый водяной знак). Новый водяной знак
+    отмечает последнее изменение, сделанное не позже чем за EXPORT_WATERMARK_LAG секунд
+    до начала выгрузки; если таких изменений после since нет, возвращается since'''
+    if since:
+        updated_at, pk = decode_watermark(since)
+        queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=pk))
+    queryset = queryset.filter(updated_at__lte=timezone.now() - timedelta(seconds=get_lag()))
+    last = queryset.order_by('-updated_at', '-pk').values_list('updated_at', 'pk').first()
+    if last is None:
+        return queryset.none(), since
+    queryset = queryset.filter(Q(updated_at__lt=last[0]) | Q(updated_at=last[0], pk__lte=last[1]))
+    return queryset.order_by('updated_at', 'pk'), encode_watermark(*last)
+
+
+def iter_rows(queryset, fields, base_url='', chunk_size=None):
+    '''Словари с полями fields для каждого объявления; изображения - адресами файлов'''
+    sources = [SOURCES.get(name, name) for name in fields]
+    for row in queryset.values(*sources).iterator(chunk_size=chunk_size or get_chunk_size()):
+        data = {name: row[source] for name, source in zip(fields, sources)}
+        if 'image' in data:
+            data['image'] = base_url + default_storage.url(data['image']) if data['image'] else None
+        yield data
+
+
+def iter_ndjson(rows, chunk_size=None):
+    '''Строки NDJSON; в выходной поток передаются порциями по chunk_size строк'''
+    chunk_size = chunk_size or get_chunk_size()
+    # время выгружается с точностью до микросекунд, как в водяном знаке
+    encoder = CursorEncoder(ensure_ascii=False, separators=(',', ':'))
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(row))
+        if len(lines) >= chunk_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+class Echo:
+    '''"Файл" для csv.writer, который просто возвращает записанную строку'''
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, fields, chunk_size=None):
+    chunk_size = chunk_size or get_chunk_size()
+    writer = csv.writer(Echo())
+    lines = [writer.writerow(fields)]
+    for row in rows:
+        lines.append(writer.writerow([row[name] for name in fields]))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+def export_ads(queryset, output_format=NDJSON, fields=None, base_url='', chunk_size=None):
+    '''Генератор порций выгрузки (bytes) в формате output_format'''
+    fields = get_fields(fields)
+    rows = iter_rows(queryset, fields, base_url, chunk_size)
+    if output_format == CSV:
+        return iter_csv(rows, fields, chunk_size)
+    if output_format == NDJSON:
+        return iter_ndjson(rows, chunk_size)
+    raise ValueError(f'Неизвестный формат выгрузки: {output_format}')
@@ -4,10 +4,14 @@ from .models import AdvUser
 from django.contrib.auth import password_validation
 from django.core.exceptions import ValidationError
 from django.forms import inlineformset_factory
-from captcha.fields import CaptchaField
+from captcha.fields import CaptchaField, CaptchaTextInput
 
+from . import captcha_pool
 from .apps import user_registered
+from .metrics import phase
 from .models import SuperRubric, SubRubric, Ad, AdditionalImage, Comment
+from .search import search_ads
+from .uploads import HeaderImageField
 
 
 class ChangeUserInfoForm(forms.ModelForm):
@@ -73,6 +77,14 @@ class SubRubricForm(forms.ModelForm):
 
 class SearchForm(forms.Form):
     keyword = forms.CharField(required=False, max_length=20, label='')
+    bound_css_class = '' # bootstrap4 не подсвечивает зеленым поле поиска у связанной формы
+
+    def search(self, queryset):
+        '''Возвращает найденные по ключевому слову объявления, отсортированные по релевантности.
+        Если ключевое слово не задано или не прошло валидацию, набор возвращается без изменений'''
+        if self.is_bound and self.is_valid() and self.cleaned_data['keyword']:
+            return search_ads(queryset, self.cleaned_data['keyword'])
+        return queryset
 
 
 class AdForm(forms.ModelForm):
@@ -80,8 +92,10 @@ class AdForm(forms.ModelForm):
         model = Ad
         fields = "__all__"
         widgets = {'author': forms.HiddenInput}
+        field_classes = {'image': HeaderImageField}
 
-AIFormSet = inlineformset_factory(Ad, AdditionalImage, fields="__all__")
+AIFormSet = inlineformset_factory(Ad, AdditionalImage, fields="__all__",
+                                  field_classes={'image': HeaderImageField})
 
 
 class UserCommentForm(forms.ModelForm):
@@ -91,8 +105,34 @@ class UserCommentForm(forms.ModelForm):
         widgets = {'ad': forms.HiddenInput}
 
 
+class TimedCaptchaTextInput(CaptchaTextInput):
+    '''Поле капчи, время создания которой (запись в базе) учитывается в метриках запроса.
+    Капча берется из пула заранее созданных (см. captcha_pool.py)'''
+
+    def fetch_captcha_store(self, name, value, attrs=None, generator=None):
+        # то же, что CaptchaTextInput.fetch_captcha_store, но ключ выдает captcha_pool.pick()
+        key = captcha_pool.pick()
+        self._value = [key, '']
+        self._key = key
+        self.id_ = self.build_attrs(attrs).get('id', None)
+
+    def render(self, name, value, attrs=None, renderer=None):
+        with phase('captcha'):
+            return super().render(name, value, attrs, renderer)
+
+
+class PooledCaptchaField(CaptchaField):
+    '''Поле капчи, отмечающее решенную капчу в пуле, чтобы ее больше не выдавать'''
+
+    def clean(self, value):
+        value = super().clean(value)
+        if value and value[0]:
+            captcha_pool.mark_used(value[0])
+        return value
+
+
 class GuestCommentForm(forms.ModelForm):
-    captcha = CaptchaField(label='Введите текст с картинки',
+    captcha = PooledCaptchaField(label='Введите текст с картинки', widget=TimedCaptchaTextInput(),
                            error_messages={'invalid': 'Неправильный текст'})
 
     class Meta:
@@ -0,0 +1,365 @@
+"""Массовая загрузка объявлений из файлов NDJSON и CSV.
+
+Строки проверяются без запросов к БД на каждую строку: рубрики загружаются один
+раз, авторы (ключ или имя пользователя) - одним запросом на пачку. Объявления
+пачки добавляются bulk_create в одной транзакции. Строки с ошибками пропускаются
+и попадают в отчет, остальные строки пачки добавляются.
+
+Поля строки: rubric (ключ подрубрики), author (ключ или имя пользователя),
+title, content, price, contacts, is_active, image и images (дополнительные
+иллюстрации; в CSV - через "|"). Остальные поля, например id и created_at
+из выгрузки export_ads, не учитываются. Изображения - пути к файлам в папке
+images_dir или в архиве (zip, tar). Они читаются, проверяются и сохраняются
+в хранилище в пуле процессов.
+
+Объявления добавляются функцией main.bulk.create_ads."""
+
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+import tarfile
+import zipfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q
+from PIL import Image
+
+from .bulk import create_ads
+from .models import Ad, AdditionalImage, AdvUser, MediaBlob, SubRubric
+from .uploads import get_limit
+from .workers import create_process_pool
+
+logger = logging.getLogger(__name__)
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATS = (NDJSON, CSV)
+
+FIELDS = ('rubric', 'author', 'title', 'content', 'price', 'contacts', 'is_active', 'image', 'images')
+IMAGES_SEPARATOR = '|'
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'on', 'да'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'off', 'нет', ''}
+
+_executor = None
+
+
+def get_executor():
+    '''Общий пул процессов для загрузки изображений (создается при первом обращении)'''
+    global _executor
+    if _executor is None:
+        _executor = create_process_pool(getattr(settings, 'IMPORT_WORKERS', 2))
+    return _executor
+
+
+def guess_format(filename, default=NDJSON):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension in ('jsonl', 'json'):
+        return NDJSON
+    return extension if extension in FORMATS else default
+
+
+def read_rows(stream, input_format):
+    '''Строки файла: тройки (номер строки, словарь, ошибка разбора). stream - двоичный
+    файл; читается построчно'''
+    text = codecs.getreader('utf-8-sig')(stream)
+    if input_format == CSV:
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row, None
+        except csv.Error as exc:
+            yield reader.line_num, None, str(exc)
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield number, None, f'Неверный JSON: {exc}'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'Строка должна быть объектом JSON'
+            continue
+        yield number, row, None
+
+
+# Загрузка изображений. Эти функции выполняются в процессах пула
+
+_archives = {}
+
+
+def _open_archive(path):
+    # процесс пула держит открытым только последний архив
+    if path not in _archives:
+        for archive in _archives.values():
+            archive.close()
+        _archives.clear()
+        _archives[path] = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else tarfile.open(path)
+    return _archives[path]
+
+
+def _read_image(reference, images_dir, archive):
+    if archive:
+        source = _open_archive(archive)
+        if isinstance(source, zipfile.ZipFile):
+            return source.read(reference)
+        member = source.extractfile(reference)
+        if member is None:
+            raise KeyError(reference)
+        return member.read()
+    if not images_dir:
+        raise ValueError('Не задана папка с изображениями')
+    root = os.path.realpath(images_dir)
+    path = os.path.realpath(os.path.join(root, reference))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError('Путь ведет за пределы папки с изображениями')
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def ingest_image(task):
+    '''Читает изображение, проверяет его по заголовку и сохраняет в хранилище.
+    Возвращает (ссылка, имя файла, ошибка)'''
+    reference, images_dir, archive = task
+    try:
+        data = _read_image(reference, images_dir, archive)
+        with Image.open(io.BytesIO(data)) as image:
+            image_format, (width, height) = image.format, image.size
+        if image_format not in get_limit('UPLOAD_IMAGE_FORMATS', ('JPEG', 'PNG', 'GIF', 'WEBP')):
+            return reference, None, f'Недопустимый формат изображения {image_format}'
+        if width * height > get_limit('UPLOAD_MAX_PIXELS', 50_000_000):
+            return reference, None, f'Изображение слишком большое: {width} x {height} точек'
+        return reference, default_storage.save(os.path.basename(reference), ContentFile(data)), None
+    except (OSError, KeyError, ValueError) as exc:
+        return reference, None, f'Не удалось загрузить изображение {reference}: {exc}'
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        if not isinstance(errors, dict):
+            errors = {'__all__': [errors] if isinstance(errors, str) else list(errors)}
+        self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {'created': self.created, 'errors': self.errors}
+
+
+class PendingAd:
+    '''Проверенная строка, ожидающая добавления'''
+    def __init__(self, line, ad, image, images):
+        self.line = line
+        self.ad = ad
+        self.image = image
+        self.images = images
+        self.image_names = []
+
+    @property
+    def references(self):
+        return ([self.image] if self.image else []) + self.images
+
+
+class AdImporter:
+    def __init__(self, batch_size=1000, using='default', images_dir=None, archive=None, executor=None,
+                 image_chunk_size=8):
+        self.batch_size = batch_size
+        self.using = using
+        self.images_dir = images_dir
+        self.archive = archive
+        self.executor = executor
+        self.image_chunk_size = image_chunk_size
+        self.result = ImportResult()
+        self._rubrics = None
+        self._authors = {}
+
+    def run(self, rows):
+        '''rows - тройки из read_rows. Возвращает ImportResult'''
+        batch = []
+        for line, row, error in rows:
+            if error:
+                self.result.add_error(line, error)
+                continue
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        self.result.errors.sort(key=lambda error: error['line'])
+        return self.result
+
+    # Проверка строк
+
+    def get_rubrics(self):
+        if self._rubrics is None:
+            self._rubrics = set(SubRubric.objects.using(self.using).values_list('pk', flat=True))
+        return self._rubrics
+
+    def resolve_authors(self, values):
+        '''Загружает одним запросом еще не известных авторов (по ключу или имени)'''
+        unknown = {str(value) for value in values if value not in (None, '') and str(value) not in self._authors}
+        if not unknown:
+            return
+        pks = [int(value) for value in unknown if value.isdigit()]
+        users = list(AdvUser.objects.using(self.using)
+                     .filter(Q(pk__in=pks) | Q(username__in=unknown)).values_list('pk', 'username'))
+        self._authors.update((username, pk) for pk, username in users)
+        # число считается ключом, даже если есть пользователь с таким именем
+        self._authors.update((str(pk), pk) for pk, _ in users)
+        for value in unknown:
+            self._authors.setdefault(value, None)
+
+    @staticmethod
+    def parse_bool(value, default=True):
+        if value is None:
+            return default
+        if isinstance(value, bool):
+            return value
+        value = str(value).strip().lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        raise ValidationError('Ожидается да или нет')
+
+    @staticmethod
+    def parse_images(value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.split(IMAGES_SEPARATOR)
+        if not isinstance(value, list):
+            raise ValidationError('Ожидается список путей к изображениям')
+        return [str(reference).strip() for reference in value if str(reference).strip()]
+
+    def validate(self, line, row):
+        errors = {}
+        rubric = row.get('rubric')
+        if rubric in (None, ''):
+            errors['rubric'] = ['Обязательное поле.']
+        elif not str(rubric).isdigit() or int(rubric) not in self.get_rubrics():
+            errors['rubric'] = [f'Подрубрика {rubric} не найдена.']
+        author = row.get('author')
+        if author in (None, ''):
+            errors['author'] = ['Обязательное поле.']
+        elif self._authors.get(str(author)) is None:
+            errors['author'] = [f'Пользователь {author} не найден.']
+        values = {}
+        for name, parse in (('is_active', self.parse_bool), ('images', self.parse_images)):
+            try:
+                values[name] = parse(row.get(name))
+            except ValidationError as exc:
+                errors[name] = exc.messages
+        price = row.get('price')
+        ad = Ad(title=row.get('title') or '', content=row.get('content') or '', contacts=row.get('contacts') or '',
+                price=0 if price in (None, '') else price, is_active=values.get('is_active', True))
+        try:
+            ad.clean_fields(exclude=['rubric', 'author', 'image', 'search_vector'])
+        except ValidationError as exc:
+            errors.update(exc.message_dict)
+        image = row.get('image')
+        if image is not None and not isinstance(image, str):
+            errors['image'] = ['Ожидается путь к изображению']
+        if errors:
+            self.result.add_error(line, errors)
+            return None
+        ad.rubric_id = int(rubric)
+        ad.author_id = self._authors[str(author)]
+        return PendingAd(line, ad, (image or '').strip(), values['images'])
+
+    # Изображения
+
+    def ingest_images(self, references):
+        tasks = [(reference, self.images_dir, self.archive) for reference in references]
+        if self.executor is None:
+            results = map(ingest_image, tasks)
+        else:
+            results = self.executor.map(ingest_image, tasks, chunksize=self.image_chunk_size)
+        return {reference: (name, error) for reference, name, error in results}
+
+    def release(self, names):
+        '''Уменьшает счетчики ссылок на сохраненные файлы строк, которые не были добавлены'''
+        for name in names:
+            default_storage.delete(name)
+
+    def attach_images(self, pending):
+        '''Загружает изображения пачки; строки с ошибками загрузки исключаются'''
+        references = list(dict.fromkeys(reference for item in pending for reference in item.references))
+        if not references:
+            return pending
+        stored = self.ingest_images(references)
+        accepted = []
+        for item in pending:
+            errors = [stored[reference][1] for reference in item.references if stored[reference][1]]
+            if errors:
+                self.result.add_error(item.line, {'image': errors})
+                continue
+            if item.image:
+                item.ad.image = stored[item.image][0]
+            item.image_names = [stored[reference][0] for reference in item.images]
+            accepted.append(item)
+        # хранилище увеличивает счетчик ссылок при каждом сохранении файла, а ссылок
+        # на него может быть больше или меньше (повторы в пачке, отклоненные строки)
+        uses = {}
+        for item in accepted:
+            for reference in item.references:
+                uses[reference] = uses.get(reference, 0) + 1
+        for reference, (name, error) in stored.items():
+            if error:
+                continue
+            count = uses.get(reference, 0)
+            if count == 0:
+                self.release([name])
+            elif count > 1:
+                MediaBlob.objects.using(self.using).filter(name=name).update(refcount=F('refcount') + count - 1)
+        return accepted
+
+    # Добавление
+
+    def insert(self, pending):
+        create_ads([item.ad for item in pending],
+                   [AdditionalImage(ad=item.ad, image=name) for item in pending for name in item.image_names],
+                   self.using, self.batch_size)
+
+    def import_batch(self, rows):
+        self.resolve_authors(row.get('author') for _, row in rows)
+        pending = [item for item in (self.validate(line, row) for line, row in rows) if item is not None]
+        pending = self.attach_images(pending)
+        if not pending:
+            return
+        try:
+            with transaction.atomic(using=self.using):
+                self.insert(pending)
+            inserted = pending
+        except DatabaseError:
+            # ищем строки, из-за которых не прошла вся пачка: добавляем их по одной
+            logger.warning('Пачка не добавлена, строки добавляются по одной', exc_info=True)
+            inserted = []
+            for item in pending:
+                item.ad.pk = None
+                try:
+                    with transaction.atomic(using=self.using):
+                        self.insert([item])
+                    inserted.append(item)
+                except DatabaseError as exc:
+                    self.result.add_error(item.line, str(exc))
+                    self.release(([item.ad.image.name] if item.ad.image else []) + item.image_names)
+        self.result.created += len(inserted)
+
+
+def import_ads(stream, input_format=NDJSON, **options):
+    '''Загружает объявления из двоичного потока stream. Возвращает ImportResult'''
+    if input_format not in FORMATS:
+        raise ValueError(f'Неизвестный формат: {input_format}')
+    return AdImporter(**options).run(read_rows(stream, input_format))
@@ -0,0 +1,174 @@
+"""Очередь исходящих писем.
+
+В запросе письмо только ставится в очередь (запись OutgoingMail). Команда
+manage.py send_queued_mail выбирает письма пачками, формирует их по шаблонам
+и отправляет через одно SMTP-соединение на всю пачку. При ошибке письмо
+откладывается с экспоненциально растущей паузой, после MAIL_QUEUE_MAX_ATTEMPTS
+неудачных попыток помечается как неотправленное. Результат каждого письма
+записывается сразу после его отправки, а SMTP-соединение открывается вне транзакций:
+если сервер недоступен, письма остаются в очереди до следующего запуска."""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ACTIVATION = 'activation'
+
+RENDERERS = {}
+
+
+def renderer(kind):
+    '''Регистрирует функцию, формирующую письмо вида kind: mail -> (тема, текст, [адреса])'''
+    def decorator(func):
+        RENDERERS[kind] = func
+        return func
+    return decorator
+
+
+def get_host():
+    if settings.ALLOWED_HOSTS:
+        return 'http://' + settings.ALLOWED_HOSTS[0]
+    return 'http://localhost:8000'
+
+
+@renderer(ACTIVATION)
+def render_activation(mail):
+    from .utilities import signer
+    user = mail.user
+    context = {'user': user, 'host': get_host(), 'sign': signer.sign(user.username)}
+    subject = render_to_string('email/activation_letter_subject.txt', context)
+    body_text = render_to_string('email/activation_letter_body.txt', context)
+    return ' '.join(subject.lstrip('\ufeff').split()), body_text.lstrip('\ufeff'), [user.email]
+
+
+def enqueue_mail(kind, user=None, payload=None):
+    from .models import OutgoingMail
+    return OutgoingMail.objects.create(kind=kind, user=user, payload=payload or {})
+
+
+def enqueue_mail_bulk(kind, users, payload=None):
+    from .models import OutgoingMail
+    return OutgoingMail.objects.bulk_create(
+        [OutgoingMail(kind=kind, user=user, payload=payload or {}) for user in users], batch_size=500)
+
+
+def get_retry_delay(attempts):
+    base = getattr(settings, 'MAIL_QUEUE_RETRY_DELAY', 60)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+class MailServerUnavailable(Exception):
+    '''Не удалось подключиться к SMTP-серверу; sent и failed - итоги пачки до этого'''
+
+    def __init__(self, message, sent=0, failed=0):
+        super().__init__(message)
+        self.sent = sent
+        self.failed = failed
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'MAIL_QUEUE_LEASE', 300))
+
+
+def _claim_batch(batch_size):
+    '''Выбирает пачку писем, которые пора отправить, и откладывает их на MAIL_QUEUE_LEASE
+    секунд, чтобы их не взял другой обработчик. Транзакция короткая: письма отправляются
+    уже после нее. На PostgreSQL строки выбираются с SKIP LOCKED'''
+    from .models import OutgoingMail
+    with transaction.atomic():
+        queryset = OutgoingMail.objects.select_related('user') \
+            .filter(status=OutgoingMail.PENDING, next_attempt_at__lte=timezone.now())
+        if db_connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True, of=('self',))
+        batch = list(queryset[:batch_size])
+        if batch:
+            # если обработчик остановится посреди пачки, неотправленные письма вернутся в очередь
+            OutgoingMail.objects.filter(pk__in=[mail.pk for mail in batch]) \
+                .update(next_attempt_at=timezone.now() + get_lease())
+    return batch
+
+
+def _save_result(mail):
+    '''Записывает результат отправки письма сразу после нее, отдельным запросом'''
+    from .models import OutgoingMail
+    OutgoingMail.objects.filter(pk=mail.pk).update(
+        status=mail.status, attempts=mail.attempts, next_attempt_at=mail.next_attempt_at,
+        last_error=mail.last_error, sent_at=mail.sent_at)
+
+
+def _release(mails):
+    '''Возвращает в очередь взятые, но не отправленные письма'''
+    from .models import OutgoingMail
+    if mails:
+        OutgoingMail.objects.filter(pk__in=[mail.pk for mail in mails]).update(next_attempt_at=timezone.now())
+
+
+def send_batch(mail_connection, batch_size=100):
+    '''Отправляет одну пачку писем через открытое соединение mail_connection.
+    Возвращает (отправлено, с ошибкой). Если после ошибки не удалось заново подключиться
+    к SMTP-серверу, оставшиеся письма возвращаются в очередь и выбрасывается MailServerUnavailable'''
+    from .models import OutgoingMail
+    max_attempts = getattr(settings, 'MAIL_QUEUE_MAX_ATTEMPTS', 5)
+    sent = failed = 0
+    batch = _claim_batch(batch_size)
+    for index, mail in enumerate(batch):
+        mail.attempts += 1
+        try:
+            subject, body, to = RENDERERS[mail.kind](mail)
+            if to:
+                EmailMessage(subject, body, to=to, connection=mail_connection).send()
+        except Exception as error:
+            logger.warning('Письмо %s не отправлено: %s', mail.pk, error)
+            mail.last_error = str(error)
+            if mail.attempts >= max_attempts:
+                mail.status = OutgoingMail.FAILED
+            else:
+                mail.next_attempt_at = timezone.now() + get_retry_delay(mail.attempts)
+            failed += 1
+            _save_result(mail)
+            # после ошибки SMTP-соединение может быть разорвано - открываем заново
+            try:
+                mail_connection.close()
+                mail_connection.open()
+            except Exception as error:
+                _release(batch[index + 1:])
+                raise MailServerUnavailable(str(error), sent, failed) from error
+        else:
+            mail.status = OutgoingMail.SENT
+            mail.sent_at = timezone.now()
+            sent += 1
+            _save_result(mail)
+    return sent, failed
+
+
+def send_queued_mail(batch_size=100):
+    '''Отправляет все письма, которые пора отправить, через одно SMTP-соединение.
+    Возвращает (отправлено, с ошибкой). Если SMTP-сервер недоступен, письма остаются
+    в очереди до следующего запуска'''
+    total_sent = total_failed = 0
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as error:
+        logger.warning('SMTP-сервер недоступен: %s', error)
+        return total_sent, total_failed
+    try:
+        while True:
+            try:
+                sent, failed = send_batch(mail_connection, batch_size)
+            except MailServerUnavailable as error:
+                logger.warning('SMTP-сервер недоступен: %s', error)
+                return total_sent + error.sent, total_failed + error.failed
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < batch_size:
+                return total_sent, total_failed
+    finally:
+        mail_connection.close()
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmarks import BenchmarkError, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время (процентили), количество SQL-запросов и выделения памяти для страниц ' \
+           'сайта, API и боковой панели; сравнивает результаты с сохраненными ранее'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help='замеров на сценарий')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', help='названия сценариев или их начала через запятую')
+        parser.add_argument('--no-allocations', action='store_true', help='не считать выделения памяти')
+        parser.add_argument('--json', dest='json_file', help='записать результаты в файл JSON')
+        parser.add_argument('--compare', help='файл JSON с результатами другой версии')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='допустимый рост времени и памяти при сравнении (доля)')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть не меньше 1')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+        only = [name.strip() for name in options['only'].split(',')] if options['only'] else None
+        self.stdout.write(f'{"сценарий":<26}{"запросов":>9}{"p50, мс":>10}{"p95, мс":>10}'
+                          f'{"p99, мс":>10}{"пик, КБ":>10}')
+        try:
+            report = run_benchmarks(repeat=options['repeat'], warmup=options['warmup'], only=only,
+                                    allocations=not options['no_allocations'], using=options['database'],
+                                    log=self.write_result)
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+        if options['json_file']:
+            with open(options['json_file'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if baseline is not None:
+            self.write_comparison(baseline, report, options['threshold'])
+
+    def write_result(self, name, result):
+        self.stdout.write(f'{name:<26}{result["queries"]:>9}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}'
+                          f'{result["p99_ms"]:>10.2f}{result.get("peak_kb", "-"):>10}')
+
+    def write_comparison(self, baseline, report, threshold):
+        commit = baseline.get('meta', {}).get('commit') or 'предыдущий прогон'
+        self.stdout.write(f'\nСравнение с {commit}:')
+        regressions = 0
+        for name, metric, old, new, regression in compare(baseline, report, threshold):
+            change = f'{(new - old) / old:+.0%}' if old else ''
+            line = f'{name:<26}{metric:<10}{old:>12}{new:>12}  {change}'
+            if regression:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line + '  ухудшение'))
+            elif self.verbosity > 1:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Ухудшений: {regressions}')
+        self.stdout.write(self.style.SUCCESS('Ухудшений нет'))
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.query_plans import compare_indexes
+from main.seeding import seed_callboard
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает планы и время запросов страниц без индексов под эти запросы и с ними. ' \
+           'Данные добавляются генератором и вместе с изменениями схемы откатываются по окончании'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ads', type=int, default=100000, help='сколько объявлений добавить (0 - не добавлять)')
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='сколько раз выполнять каждый сценарий')
+        parser.add_argument('--json', dest='json_file', help='записать результаты в файл JSON')
+        parser.add_argument('--plans', action='store_true', help='выводить планы всех запросов')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        with transaction.atomic(using=using):
+            if options['ads']:
+                self.stdout.write(f'Генерация данных: {options["ads"]} объявлений, '
+                                  f'{options["comments"]} комментариев')
+                seed_callboard(users=options['users'], ads=options['ads'], comments=options['comments'],
+                               seed=options['seed'], using=using, log=log)
+            results = compare_indexes(repeat=options['repeat'], using=using)
+            transaction.set_rollback(True, using=using)
+        if not results:
+            raise CommandError('Нет данных для сценариев')
+        self.stdout.write(f'{"сценарий":<20}{"без индексов, мс":>18}{"с индексами, мс":>18}  индексы')
+        for name, result in results.items():
+            before, after = result['before'], result['after']
+            self.stdout.write(f'{name:<20}{before["median_ms"]:>18.2f}{after["median_ms"]:>18.2f}  '
+                              f'{", ".join(after["indexes"]) or "-"}')
+            if options['plans']:
+                for label, run in (('без индексов', before), ('с индексами', after)):
+                    for query in run['queries']:
+                        self.stdout.write(f'  [{label}] {query["sql"]}')
+                        for line in query['plan']:
+                            self.stdout.write(f'      {line}')
+        if options['json_file']:
+            with open(options['json_file'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmarks import BenchmarkError, run_load
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон страниц и API объявлений через обработчик WSGI (пул потоков) или ASGI ' \
+           '(цикл событий) с задержкой каждого SQL-запроса. Асинхронные контроллеры включаются ' \
+           'переменной окружения CALLBOARD_ASYNC_VIEWS=1'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--concurrency', type=int, default=50, help='одновременных запросов')
+        parser.add_argument('--requests', type=int, default=1000, help='всего запросов')
+        parser.add_argument('--sql-delay', type=float, default=2.0,
+                            help='задержка каждого SQL-запроса, мс (сетевая задержка до сервера базы)')
+        parser.add_argument('--page-cache', action='store_true', help='не отключать кэш страниц')
+        parser.add_argument('--json', dest='json_file', help='записать результаты в файл JSON')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency и --requests должны быть не меньше 1')
+        try:
+            report = run_load(server=options['server'], concurrency=options['concurrency'],
+                              total=options['requests'], sql_delay_ms=options['sql_delay'],
+                              page_cache=options['page_cache'], using=options['database'])
+        except BenchmarkError as exc:
+            raise CommandError(str(exc))
+        views = 'асинхронные' if report['async_views'] else 'синхронные'
+        self.stdout.write(f'{report["server"].upper()}, {views} контроллеры, {report["concurrency"]} одновременно: '
+                          f'{report["rps"]} запросов/с, p50 {report["p50_ms"]:.1f} мс, '
+                          f'p95 {report["p95_ms"]:.1f} мс, p99 {report["p99_ms"]:.1f} мс')
+        if options['json_file']:
+            with open(options['json_file'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.captcha_pool import refill
+
+
+class Command(BaseCommand):
+    help = 'Пополняет пул заранее созданных капч (CAPTCHA_POOL_SIZE) и удаляет просроченные капчи ' \
+           'одним запросом вместе с их картинками. С ключом --loop работает постоянно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=None, help='капч в пуле (по умолчанию CAPTCHA_POOL_SIZE)')
+        parser.add_argument('--batch-size', type=int, default=100, help='капч на один INSERT')
+        parser.add_argument('--loop', action='store_true', help='не завершаться, пополнять пул периодически')
+        parser.add_argument('--interval', type=float, default=60, help='пауза между пополнениями, с')
+
+    def handle(self, *args, **options):
+        while True:
+            # при --loop пул пополняется с запасом: капчи должны оставаться пригодными до следующего прохода
+            interval = options['interval'] if options['loop'] else 0
+            created, rows, files = refill(options['size'], options['batch_size'], interval)
+            if created or rows or files or not options['loop']:
+                self.stdout.write(f'Создано капч: {created}, удалено просроченных: {rows}, картинок: {files}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.sessions import SessionStore
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные сессии из базы пачками (SESSION_CLEANUP_BATCH_SIZE записей на DELETE). ' \
+           'Запускать периодически, например раз в сутки по cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='записей на один запрос DELETE')
+
+    def handle(self, *args, **options):
+        deleted = SessionStore.clear_expired(options['batch_size'])
+        self.stdout.write(f'Удалено просроченных сессий: {deleted}')
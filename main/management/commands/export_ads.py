@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from main import export
+from main.models import Ad
+
+
+class Command(BaseCommand):
+    help = 'Выгружает объявления в формате NDJSON или CSV. С --watermark-file выгружает ' \
+           'только изменения после предыдущей выгрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(export.FORMATS), default=export.NDJSON)
+        parser.add_argument('--output', help='файл для выгрузки; по умолчанию - стандартный вывод')
+        parser.add_argument('--fields', help='выгружаемые поля через запятую')
+        parser.add_argument('--since', help='водяной знак предыдущей выгрузки')
+        parser.add_argument('--watermark-file',
+                            help='файл с водяным знаком: читается перед выгрузкой и обновляется после нее')
+        parser.add_argument('--created-after', help='только объявления, опубликованные после этой даты')
+        parser.add_argument('--chunk-size', type=int, default=None, help='записей на одно чтение из курсора')
+
+    def handle(self, *args, **options):
+        since = options['since']
+        watermark_file = Path(options['watermark_file']) if options['watermark_file'] else None
+        if since is None and watermark_file and watermark_file.exists():
+            since = watermark_file.read_text().strip() or None
+        fields = options['fields'].split(',') if options['fields'] else None
+        try:
+            queryset = Ad.objects.all()
+            if options['created_after']:
+                queryset = queryset.filter(created_at__gt=options['created_after'])
+            queryset, watermark = export.prepare_export(queryset, since)
+            stream = export.export_ads(queryset, options['format'], fields, chunk_size=options['chunk_size'])
+        except (ValueError, ValidationError) as exc:
+            raise CommandError(exc)
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in stream:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+        if watermark_file and watermark:
+            watermark_file.write_text(watermark)
+        self.stderr.write(f'Водяной знак: {watermark or "-"}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Ad, AdditionalImage
+from main.thumbnails import generate_variants, get_executor
+
+
+class Command(BaseCommand):
+    help = 'Создает недостающие миниатюры (все псевдонимы и форматы) для уже загруженных изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=20, help='файлов на одно задание пула')
+
+    def handle(self, *args, **options):
+        names = set(Ad.objects.exclude(image='').values_list('image', flat=True).iterator())
+        names.update(AdditionalImage.objects.values_list('image', flat=True).iterator())
+        created = 0
+        results = get_executor().map(generate_variants, sorted(names), chunksize=options['chunk_size'])
+        for count in results:
+            created += count
+        self.stdout.write(self.style.SUCCESS(f'Обработано файлов: {len(names)}, создано миниатюр: {created}'))
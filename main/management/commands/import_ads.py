@@ -0,0 +1,52 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import importing
+from main.workers import create_process_pool
+
+
+class Command(BaseCommand):
+    help = 'Загружает объявления из файла NDJSON или CSV (см. main/importing.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='файл с объявлениями; "-" - стандартный ввод')
+        parser.add_argument('--format', choices=importing.FORMATS,
+                            help='формат файла; по умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=1000, help='объявлений в одной транзакции')
+        parser.add_argument('--images-dir', help='папка, относительно которой указаны пути к изображениям')
+        parser.add_argument('--archive', help='архив zip или tar с изображениями')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='процессов для загрузки изображений; 0 - загружать в этом процессе')
+        parser.add_argument('--errors', help='файл для отчета об ошибках (NDJSON); по умолчанию - вывод ошибок')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        input_format = options['format'] or importing.guess_format(options['file'])
+        executor = create_process_pool(options['workers']) if options['workers'] else None
+        started = time.monotonic()
+        try:
+            stream = sys.stdin.buffer if options['file'] == '-' else open(options['file'], 'rb')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            result = importing.import_ads(stream, input_format, batch_size=options['batch_size'],
+                                          using=options['database'], images_dir=options['images_dir'],
+                                          archive=options['archive'], executor=executor)
+        finally:
+            stream.close()
+            if executor is not None:
+                executor.shutdown()
+        if options['errors']:
+            with open(options['errors'], 'w', encoding='utf-8') as file:
+                for error in result.errors:
+                    file.write(json.dumps(error, ensure_ascii=False) + '\n')
+        else:
+            for error in result.errors:
+                self.stderr.write(f'Строка {error["line"]}: {json.dumps(error["errors"], ensure_ascii=False)}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено объявлений: {result.created}, строк с ошибками: {len(result.errors)}, '
+            f'за {elapsed:.1f} с'))
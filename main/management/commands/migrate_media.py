@@ -0,0 +1,35 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from main.storage import ContentAddressedStorage, count_references, is_blob_name, migrate_file, recount_blobs
+
+
+class Command(BaseCommand):
+    help = 'Переносит загруженные ранее изображения в хранилище по хэшу содержимого ' \
+           'и пересчитывает количество ссылок на файлы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount-only', action='store_true',
+                            help='только пересчитать ссылки и удалить файлы, на которые ничего не ссылается')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('DEFAULT_FILE_STORAGE должно быть main.storage.ContentAddressedStorage')
+        if not options['recount_only']:
+            migrated = missing = 0
+            for name, references in sorted(count_references().items()):
+                if is_blob_name(name):
+                    continue
+                if not default_storage.exists(name):
+                    self.stderr.write(f'Файл не найден: {name}')
+                    missing += 1
+                    continue
+                new_name = migrate_file(default_storage, name, references)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{name} -> {new_name}')
+                migrated += 1
+            self.stdout.write(self.style.SUCCESS(f'Перенесено файлов: {migrated}, не найдено: {missing}'))
+            if migrated:
+                self.stdout.write('Миниатюры для новых имен создаст команда generate_thumbnails')
+        fixed, removed = recount_blobs(default_storage)
+        self.stdout.write(self.style.SUCCESS(f'Исправлено счетчиков ссылок: {fixed}, удалено файлов: {removed}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main.counters import reconcile_comment_counts, reconcile_rubric_counts
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счетчики активных объявлений рубрик и активных комментариев объявлений ' \
+           'с фактическими значениями и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='только показать расхождения')
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        rubrics = reconcile_rubric_counts(using=options['database'], fix=fix)
+        for pk, stored, actual in rubrics:
+            self.stdout.write(f'Рубрика {pk}: {stored} -> {actual}')
+        ads = reconcile_comment_counts(using=options['database'], fix=fix, batch_size=options['batch_size'])
+        verb = 'Найдено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} неверных счетчиков: рубрик - {len(rubrics)}, объявлений - {ads}'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.seeding import seed_callboard
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными для нагрузочных тестов: надрубрики, подрубрики, ' \
+           'пользователи, объявления, иллюстрации и комментарии (bulk_create пачками)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--super-rubrics', type=int, default=5)
+        parser.add_argument('--sub-rubrics', type=int, default=40)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--ads', type=int, default=100000)
+        parser.add_argument('--images', type=int, default=50000, help='дополнительных иллюстраций')
+        parser.add_argument('--image-share', type=float, default=0.6,
+                            help='доля объявлений с основным изображением')
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument('--days', type=int, default=365, help='за сколько дней распределить даты')
+        parser.add_argument('--seed', type=int, default=0, help='одинаковый seed дает одинаковые данные')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if options['super_rubrics'] < 1 or options['sub_rubrics'] < 1 or options['users'] < 1:
+            raise CommandError('Нужны хотя бы одна надрубрика, одна подрубрика и один пользователь')
+        start = time.monotonic()
+        counts = seed_callboard(
+            super_rubrics=options['super_rubrics'], sub_rubrics=options['sub_rubrics'], users=options['users'],
+            ads=options['ads'], comments=options['comments'], image_share=options['image_share'],
+            images=options['images'], days=options['days'], seed=options['seed'],
+            batch_size=options['batch_size'], using=options['database'],
+            log=self.stdout.write if options['verbosity'] > 1 else None)
+        summary = ', '.join(f'{name}: {count}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Добавлено за {time.monotonic() - start:.1f} с - {summary}'))
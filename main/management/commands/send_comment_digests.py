@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.notifications import collect_digests
+
+
+class Command(BaseCommand):
+    help = 'Объединяет новые комментарии в письма-дайджесты для авторов объявлений и ставит их в очередь писем'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='получателей за один проход')
+        parser.add_argument('--loop', action='store_true', help='не завершаться, проверять события периодически')
+        parser.add_argument('--interval', type=float, default=60, help='пауза между проверками, с')
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                processed, created = collect_digests(options['batch_size'])
+                total += created
+                if not processed:
+                    break
+            if total or not options['loop']:
+                self.stdout.write(f'Поставлено в очередь писем: {total}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.mail import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди OutgoingMail. С ключом --loop работает постоянно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='не завершаться, проверять очередь периодически')
+        parser.add_argument('--interval', type=float, default=5, help='пауза между проверками очереди, с')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_mail(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(f'Отправлено: {sent}, с ошибкой: {failed}')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.replicas import get_replicas, sync_sqlite_replica
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в реплики SQLite (CALLBOARD_DB=sqlite) - замена репликации ' \
+           'при локальной проверке чтения с реплик. Изменения, сделанные после копирования, ' \
+           'реплика не видит до следующего запуска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('replicas', nargs='*', help='псевдонимы реплик (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        aliases = options['replicas'] or get_replicas()
+        if not aliases:
+            raise CommandError('Реплики не заданы (REPLICA_DATABASES)')
+        for alias in aliases:
+            if alias not in get_replicas():
+                raise CommandError(f'{alias} нет в REPLICA_DATABASES')
+            try:
+                sync_sqlite_replica(alias)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(f'{alias}: скопирована'))
@@ -0,0 +1,282 @@
+"""Метрики производительности запросов.
+
+Для каждого запроса посредник MetricsMiddleware (main/middlewares.py) собирает:
+количество и время SQL-запросов (обертка выполнения запросов, см. execute_wrapper),
+время отрисовки шаблонов (движок DjangoTemplates ниже), время отдельных этапов
+(phase(), например поиск готовых миниатюр), результат кэша страниц (hit, miss,
+not_modified) и общее время. Значения добавляются в гистограммы в памяти процесса
+с метками по имени маршрута и выводятся в текстовом формате Prometheus по адресу
+/metrics, а для самого запроса - в заголовке Server-Timing.
+
+Накладные расходы - несколько вызовов perf_counter и одна блокировка на наблюдение,
+поэтому метрики можно держать включенными в рабочем режиме. Гистограммы у каждого
+процесса свои: при нескольких рабочих процессах Prometheus видит процесс,
+ответивший на запрос (номер процесса выводится в метке pid)."""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.template.backends import django as django_backend
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+_current = ContextVar('callboard_request_metrics', default=None)
+_execute_wrappers = ContextVar('callboard_execute_wrappers', default=())
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+class Histogram:
+    '''Гистограмма Prometheus: для каждого набора меток - счетчики по корзинам, сумма и количество'''
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def collect(self):
+        '''Строки в текстовом формате Prometheus'''
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in sorted(series.items()):
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket
+                le = bound if isinstance(bound, str) else _format_number(bound)
+                yield f'{self.name}_bucket{{{base}{"," if base else ""}le="{le}"}} {cumulative}'
+            yield f'{self.name}_sum{{{base}}} {_format_number(total)}'
+            yield f'{self.name}_count{{{base}}} {count}'
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{{{_format_labels(self.label_names, labels)}}} {value}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUEST_SECONDS = Histogram('callboard_request_duration_seconds', 'Время обработки запроса',
+                            ('view', 'method'))
+SQL_QUERIES = Histogram('callboard_request_sql_queries', 'SQL-запросов за запрос', ('view',), COUNT_BUCKETS)
+SQL_SECONDS = Histogram('callboard_request_sql_seconds', 'Время SQL-запросов за запрос', ('view',))
+TEMPLATE_SECONDS = Histogram('callboard_request_template_seconds', 'Время отрисовки шаблонов за запрос',
+                             ('view',))
+PHASE_SECONDS = Histogram('callboard_request_phase_seconds', 'Время этапов обработки запроса',
+                          ('view', 'phase'))
+PAGE_CACHE = Counter('callboard_page_cache_total', 'Результаты кэша страниц', ('view', 'result'))
+RESPONSES = Counter('callboard_responses_total', 'Ответы по кодам', ('view', 'status'))
+
+METRICS = (REQUEST_SECONDS, SQL_QUERIES, SQL_SECONDS, TEMPLATE_SECONDS, PHASE_SECONDS, PAGE_CACHE, RESPONSES)
+
+
+def dispatch_execute(execute, sql, params, many, context):
+    '''Постоянная обертка выполнения SQL-запросов всех подключений (добавляется при
+    подключении, см. install_dispatcher): вызывает обертки, заданные execute_wrapper()
+    для текущего запроса. Они хранятся в контекстной переменной и поэтому действуют и в
+    потоках, где асинхронные контроллеры выполняют запросы к базе (см. aio.py)'''
+    for wrapper in _execute_wrappers.get():
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_dispatcher(sender, connection, **kwargs):
+    '''Обработчик сигнала connection_created. Обертка ставится первой в списке, так как
+    connection.execute_wrapper() снимает свою обертку с конца списка'''
+    if dispatch_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, dispatch_execute)
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    '''Обертка wrapper(execute, sql, params, many, context) для SQL-запросов внутри блока
+    на всех подключениях, в том числе из других потоков, запущенных в этом контексте'''
+    token = _execute_wrappers.set((*_execute_wrappers.get(), wrapper))
+    try:
+        yield
+    finally:
+        _execute_wrappers.reset(token)
+
+
+class RequestMetrics:
+    '''Показатели одного запроса'''
+    __slots__ = ('start', 'sql_count', 'sql_time', 'template_time', 'phases', 'cache', 'lock')
+
+    def __init__(self):
+        self.lock = threading.Lock() # запросы асинхронных контроллеров идут из нескольких потоков
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.phases = {}
+        self.cache = None
+
+    def __call__(self, execute, sql, params, many, context):
+        '''Обертка выполнения SQL-запросов (connection.execute_wrapper)'''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.sql_time += duration
+                self.sql_count += 1
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def server_timing(self, total):
+        parts = [f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+                 f'tpl;dur={self.template_time * 1000:.1f}']
+        parts.extend(f'{name};dur={duration * 1000:.1f}' for name, duration in self.phases.items())
+        if self.cache:
+            parts.append(f'cache;desc={self.cache}')
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def start_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def finish_request(metrics, token, view, method, status):
+    '''Добавляет показатели запроса в гистограммы. Возвращает общее время в секундах'''
+    _current.reset(token)
+    total = time.perf_counter() - metrics.start
+    REQUEST_SECONDS.observe(total, view, method)
+    SQL_QUERIES.observe(metrics.sql_count, view)
+    SQL_SECONDS.observe(metrics.sql_time, view)
+    TEMPLATE_SECONDS.observe(metrics.template_time, view)
+    for name, duration in metrics.phases.items():
+        PHASE_SECONDS.observe(duration, view, name)
+    if metrics.cache:
+        PAGE_CACHE.inc(view, metrics.cache)
+    RESPONSES.inc(view, status)
+    return total
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    '''Засчитывает время блока в этап name текущего запроса: with phase('thumbnails'): ...'''
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_phase(name, time.perf_counter() - start)
+
+
+def record_cache(result):
+    '''Результат кэша страниц для текущего запроса: hit, miss, not_modified или bypass (не кэшируется)'''
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache = result
+
+
+def render_prometheus():
+    lines = [f'# pid {os.getpid()}']
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in METRICS:
+        metric.reset()
+
+
+class Template:
+    '''Шаблон, засчитывающий время отрисовки текущему запросу. Вложенные шаблоны
+    ({% extends %}, {% include %}) отрисовываются внутри и отдельно не считаются'''
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    '''Стандартный движок шаблонов с замером времени отрисовки (TEMPLATES[...]['BACKEND'])'''
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
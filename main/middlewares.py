@@ -2,12 +2,28 @@
 в Django соглашениям, весь код, "ответственный" за формирование страниц, следует
 помещать в шаблон, посредник или обработчик контекста."""
 
-from .models import SubRubric, Rubric
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+from . import replicas
+from .aio import run_sync
+from .query_detector import QueryDetector, check
+from .caching import get_versions, SIDEBAR
+from .rubric_tree import get_rubric_counts, get_rubric_tree, with_counts
 
 
 def callboard_context_processor(request):
     context = {}
-    context['rubrics'] = SubRubric.objects.all()
+    counted_at, counts = get_rubric_counts()
+    # дерево рубрик из кэша процесса со счетчиками (см. rubric_tree.py); функция вызывается
+    # шаблоном, только если кэшированного фрагмента боковой панели нет
+    context['rubrics'] = lambda: with_counts(get_rubric_tree(), counts)
+    # ключ кэшированного фрагмента боковой панели: версия рубрик и момент чтения счетчиков
+    context['sidebar_version'] = f'{get_versions(SIDEBAR)[0]}:{counted_at}'
     context['keyword'] = ''
     context['all'] = ''
     if 'keyword' in request.GET:
@@ -24,3 +40,129 @@ def callboard_context_processor(request):
                 context['all'] += '?page=' + page
     return context
 
+
+
+def _view_label(request):
+    '''Метка контроллера для метрик: имя маршрута (main:detail), для безымянных
+    маршрутов - шаблон пути (ads/<int:pk>/). Число разных меток ограничено числом маршрутов'''
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name if match.url_name else (match.route or match.view_name)
+
+
+# посредники ниже работают и в WSGI, и в ASGI (__acall__ вызывается, если get_response -
+# сопрограмма), чтобы в ASGI не переключаться на поток синхронных посредников
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    '''Замеряет запрос: SQL-запросы на всех подключениях, отрисовку шаблонов, этапы
+    и кэш страниц (см. metrics.py). Добавляет результаты в гистограммы и заголовок
+    Server-Timing. Ставится первым в MIDDLEWARE, чтобы учитывать работу остальных посредников'''
+
+    def __init__(self, get_response):
+        if not metrics.is_enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', True)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        request_metrics, token = metrics.start_request()
+        response = None
+        try:
+            with metrics.execute_wrapper(request_metrics):
+                response = self.get_response(request)
+        finally:
+            self.finish(request, request_metrics, token, response)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics, token = metrics.start_request()
+        response = None
+        try:
+            with metrics.execute_wrapper(request_metrics):
+                response = await self.get_response(request)
+        finally:
+            self.finish(request, request_metrics, token, response)
+        return response
+
+    def finish(self, request, request_metrics, token, response):
+        status = response.status_code if response is not None else 500
+        total = metrics.finish_request(request_metrics, token, _view_label(request), request.method, status)
+        if response is not None and self.server_timing:
+            response['Server-Timing'] = request_metrics.server_timing(total)
+
+
+class QueryDetectorMiddleware(MiddlewareMixin):
+    '''Ищет повторяющиеся (N+1) и медленные SQL-запросы каждого запроса к сайту
+    (см. query_detector.py). Работает, только если включен QUERY_DETECTOR'''
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_DETECTOR', settings.DEBUG):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.strict = getattr(settings, 'QUERY_DETECTOR_STRICT', False)
+        self.budgets = getattr(settings, 'QUERY_BUDGETS', {})
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        detector = QueryDetector()
+        with metrics.execute_wrapper(detector):
+            response = self.get_response(request)
+        self.check(request, detector)
+        return response
+
+    async def __acall__(self, request):
+        detector = QueryDetector()
+        with metrics.execute_wrapper(detector):
+            response = await self.get_response(request)
+        self.check(request, detector)
+        return response
+
+    def check(self, request, detector):
+        view = _view_label(request)
+        check(detector, view, self.strict, self.budgets.get(view))
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    '''Направляет чтение запроса на реплику или, после записи, на основную базу
+    (см. replicas.py). Без REPLICA_DATABASES не используется'''
+
+    def __init__(self, get_response):
+        if not replicas.get_replicas():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.cookie = getattr(settings, 'REPLICA_PIN_COOKIE', 'callboard_primary')
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+    def is_pinned(self, request):
+        return request.method in replicas.UNSAFE_METHODS or self.cookie in request.COOKIES
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = replicas.use_replica(None if self.is_pinned(request) else replicas.choose_replica())
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.reset_replica(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        # проверка реплик обращается к базе, поэтому выполняется в потоке пула
+        alias = None if self.is_pinned(request) else await run_sync(replicas.choose_replica)()
+        token = replicas.use_replica(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replicas.reset_replica(token)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if request.method in replicas.UNSAFE_METHODS:
+            # пока cookie жива, чтение идет с основной базы: реплики могли еще не получить записанное
+            response.set_cookie(self.cookie, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
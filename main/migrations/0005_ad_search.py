@@ -0,0 +1,81 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import main.search
+
+
+TRIGGER_SQL = '''
+CREATE FUNCTION main_ad_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('{config}', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('{config}', coalesce(NEW.content, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_ad_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, content ON main_ad
+    FOR EACH ROW EXECUTE PROCEDURE main_ad_search_vector_update();
+
+UPDATE main_ad SET title = title;
+
+CREATE INDEX main_ad_search_vector_gin ON main_ad USING gin (search_vector);
+'''
+
+DROP_TRIGGER_SQL = '''
+DROP INDEX IF EXISTS main_ad_search_vector_gin;
+DROP TRIGGER IF EXISTS main_ad_search_vector_trigger ON main_ad;
+DROP FUNCTION IF EXISTS main_ad_search_vector_update();
+'''
+
+
+def create_search_index(apps, schema_editor):
+    '''На PostgreSQL - триггер и GIN-индекс, на остальных СУБД - заполнение AdSearchTerm'''
+    if schema_editor.connection.vendor == 'postgresql':
+        config = getattr(settings, 'SEARCH_CONFIG', 'russian')
+        schema_editor.execute(TRIGGER_SQL.format(config=config))
+        return
+    Ad = apps.get_model('main', 'Ad')
+    AdSearchTerm = apps.get_model('main', 'AdSearchTerm')
+    db = schema_editor.connection.alias
+    for ad in Ad.objects.using(db).only('pk', 'title', 'content').iterator():
+        AdSearchTerm.objects.using(db).bulk_create(
+            [AdSearchTerm(ad=ad, term=term, weight=weight)
+             for term, weight in main.search.build_terms(ad).items()])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_comment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='search_vector',
+            field=main.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.CreateModel(
+            name='AdSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=40, verbose_name='Слово')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='Вес')),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='main.ad', verbose_name='Объявление')),
+            ],
+            options={
+                'verbose_name': 'Поисковый термин',
+                'verbose_name_plural': 'Поисковые термины',
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
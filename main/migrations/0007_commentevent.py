@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_outgoingmail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создано')),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.comment', verbose_name='Комментарий')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Получатель')),
+            ],
+            options={
+                'verbose_name': 'Событие комментария',
+                'verbose_name_plural': 'События комментариев',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='commentevent',
+            index=models.Index(fields=['recipient', 'created_at'], name='main_commen_recipie_b196af_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field) \
+        .annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts), 0)
+
+
+def fill_counters(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Ad = apps.get_model('main', 'Ad')
+    Comment = apps.get_model('main', 'Comment')
+    Rubric = apps.get_model('main', 'Rubric')
+    active = Ad.objects.using(db).filter(is_active=True)
+    Rubric.objects.using(db).filter(super_rubric__isnull=False).update(ad_count=_count(active, 'rubric'))
+    Rubric.objects.using(db).filter(super_rubric__isnull=True).update(ad_count=_count(active, 'rubric__super_rubric'))
+    Ad.objects.using(db).update(comment_count=_count(Comment.objects.using(db).filter(is_active=True), 'ad'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_ad_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.AddField(
+            model_name='rubric',
+            name='ad_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных объявлений'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ad',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Выводить в списке?'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Выводить на экран?'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at', '-id'], name='main_ad_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['rubric', '-created_at', '-id'], name='main_ad_active_rubric_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='main_ad_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['ad', 'created_at'], name='main_comment_active_ad_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Substr
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from main.utilities import get_timestamp_path
+from main.search import SearchVectorField, TERM_MAX_LENGTH
 
 
 class AdvUser(AbstractUser):
@@ -10,9 +13,10 @@ class AdvUser(AbstractUser):
                                         verbose_name='Присылать оповещения о новых комментариях')
 
     def delete(self, *args, **kwargs): # при удалении пользователя, функция удалит все его записи
-        for ad in self.ad_set.all():
-            ad.delete()
-        super().delete(*args, **kwargs)
+        from main.deletion import delete_ads
+        with transaction.atomic(using=kwargs.get('using') or self._state.db):
+            delete_ads(self.ad_set.all()) # массовое удаление, файлы удаляются в фоне
+            return super().delete(*args, **kwargs)
 
     class Meta(AbstractUser.Meta):
         pass
@@ -23,6 +27,12 @@ class Rubric(models.Model): #модель для всех рубрик
     order = models.SmallIntegerField(default=0, db_index=True, verbose_name='Порядок')
     super_rubric = models.ForeignKey('SuperRubric', on_delete=models.PROTECT, null=True, blank=True,
                                      verbose_name='Надрубрика')
+    ad_count = models.PositiveIntegerField(default=0, editable=False,
+                                           verbose_name='Активных объявлений') # см. main/counters.py
+
+    def save(self, *args, **kwargs):
+        from main.counters import save_without_counters
+        return save_without_counters(self, super().save, ('ad_count',), *args, **kwargs)
 
 
 class SuperRubricManager(models.Manager):
@@ -61,6 +71,36 @@ class SubRubric(Rubric):
         verbose_name_plural = "Подрубрики"
 
 
+class AdQuerySet(models.QuerySet):
+    '''Готовые "планы запросов" для страниц сайта и API. Подтягивают связанные записи
+    одним запросом (select_related) или одним запросом на связь (prefetch_related),
+    чтобы в циклах шаблонов не возникало запросов N+1.'''
+    PREVIEW_LENGTH = 200
+
+    def for_list(self):
+        '''Для списков объявлений: без большого поля content, вместо него - короткий
+        фрагмент content_preview, вычисляемый в СУБД'''
+        return self.select_related('rubric__super_rubric', 'author') \
+            .defer('content', 'contacts', 'search_vector') \
+            .annotate(content_preview=Substr('content', 1, self.PREVIEW_LENGTH))
+
+    def for_detail(self):
+        '''Для страницы объявления: рубрика, автор, дополнительные иллюстрации и
+        активные комментарии (в атрибуте active_comments)'''
+        return self.select_related('rubric__super_rubric', 'author') \
+            .defer('search_vector') \
+            .prefetch_related('additionalimage_set',
+                              models.Prefetch('comment_set', to_attr='active_comments',
+                                              queryset=Comment.objects.filter(is_active=True)))
+
+    def for_edit(self):
+        '''Для форм изменения и удаления объявления'''
+        return self.defer('search_vector')
+
+    def for_api(self):
+        return self.defer('search_vector')
+
+
 class Ad(models.Model):
     rubric = models.ForeignKey(SubRubric, on_delete=models.PROTECT, verbose_name='Рубрика')
     title = models.CharField(max_length=40, verbose_name="Товар")
@@ -69,23 +109,53 @@ class Ad(models.Model):
     contacts = models.TextField(verbose_name='Контакты')
     image = models.ImageField(blank=True, upload_to=get_timestamp_path, verbose_name='Изображение')
     author = models.ForeignKey(AdvUser, on_delete=models.CASCADE, verbose_name='Автор объявления')
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Выводить в списке?')
+    is_active = models.BooleanField(default=True, verbose_name='Выводить в списке?')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликовано')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменено') # отметка для выгрузки изменений
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор') # заполняется триггером PostgreSQL
+    comment_count = models.PositiveIntegerField(default=0, editable=False,
+                                                verbose_name='Комментариев') # см. main/counters.py
+
+    objects = AdQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        from main.counters import save_without_counters
+        return save_without_counters(self, super().save, ('comment_count',), *args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        '''В переопределенном методе delete () перед удалением текущей записи мы перебираем
-        и вызовом метода delete () удаляем все связанные дополнительные иллюстрации.
-        При вызове метода delete () возникает сигнал post delete, обрабатываемый
-        приложением django cieanup, которое в ответ удалит все файлы, хранящиеся
-        в удаленной записи.'''
-        for ai in self.additionalimage_set.all():
-            ai.delete()
-        super().delete(*args, **kwargs)
+        '''Объявление удаляется вместе с дополнительными иллюстрациями, комментариями
+        и поисковыми терминами несколькими запросами DELETE (см. main/deletion.py).
+        Файлы изображений удаляются фоновым потоком после фиксации транзакции.'''
+        from main.deletion import delete_ads
+        count = delete_ads(Ad.objects.using(kwargs.get('using') or self._state.db).filter(pk=self.pk))
+        return count, {self._meta.label: count}
 
     class Meta:
         verbose_name_plural = 'Объявления'
         verbose_name = 'Объявление'
         ordering = ['-created_at']
+        # под запросы страниц: WHERE is_active [AND rubric_id = ...] ORDER BY created_at DESC, id DESC
+        # (id - второй ключ курсорной пагинации). Частичные индексы не хранят снятые
+        # с публикации объявления; отдельный индекс по is_active при этом не нужен
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='main_ad_active_created_idx'),
+            models.Index(fields=['rubric', '-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='main_ad_active_rubric_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='main_ad_author_created_idx'),
+        ]
+
+
+class AdSearchTerm(models.Model):
+    '''Инвертированный индекс для поиска на СУБД без полнотекстового поиска (SQLite).
+    На PostgreSQL не используется.'''
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='search_terms', verbose_name='Объявление')
+    term = models.CharField(max_length=TERM_MAX_LENGTH, db_index=True, verbose_name='Слово')
+    weight = models.PositiveIntegerField(default=1, verbose_name='Вес')
+
+    class Meta:
+        verbose_name = 'Поисковый термин'
+        verbose_name_plural = 'Поисковые термины'
 
 
 class AdditionalImage(models.Model):
@@ -101,10 +171,69 @@ class Comment(models.Model):
     ad = models.ForeignKey(Ad, on_delete=models.CASCADE, verbose_name='Объявление')
     author = models.CharField(max_length=30, verbose_name="Имя автора")
     content = models.TextField(verbose_name='Содержание')
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name="Выводить на экран?")
+    is_active = models.BooleanField(default=True, verbose_name="Выводить на экран?")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликован')
 
     class Meta:
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
         ordering = ['created_at']
+        # комментарии на странице объявления: WHERE ad_id IN (...) AND is_active ORDER BY created_at
+        indexes = [
+            models.Index(fields=['ad', 'created_at'], condition=models.Q(is_active=True),
+                         name='main_comment_active_ad_idx'),
+        ]
+
+
+class OutgoingMail(models.Model):
+    '''Очередь исходящих писем. Письма создаются в запросе, а формируются по шаблонам
+    и отправляются командой manage.py send_queued_mail (см. main/mail.py)'''
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Ожидает отправки'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Не отправлено'),
+    )
+    kind = models.CharField(max_length=30, verbose_name='Вид письма')
+    user = models.ForeignKey(AdvUser, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Получатель')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Данные для шаблона')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name='Состояние')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Отправлено')
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        ordering = ['next_attempt_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+
+class CommentEvent(models.Model):
+    '''Новый комментарий, о котором нужно сообщить автору объявления. События копятся
+    и объединяются в одно письмо-дайджест командой send_comment_digests'''
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, verbose_name='Комментарий')
+    recipient = models.ForeignKey(AdvUser, on_delete=models.CASCADE, verbose_name='Получатель')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Создано')
+
+    class Meta:
+        verbose_name = 'Событие комментария'
+        verbose_name_plural = 'События комментариев'
+        indexes = [models.Index(fields=['recipient', 'created_at'])]
+
+
+class MediaBlob(models.Model):
+    '''Файл в хранилище, адресуемом по содержимому (см. main/storage.py). Одинаковые
+    изображения хранятся один раз; refcount - количество ссылок на файл из записей'''
+    name = models.CharField(max_length=100, unique=True, verbose_name='Имя файла')
+    size = models.PositiveBigIntegerField(default=0, verbose_name='Размер')
+    refcount = models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
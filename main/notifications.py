@@ -0,0 +1,87 @@
+"""Уведомления авторов объявлений о новых комментариях.
+
+Сохранение комментария только добавляет запись CommentEvent (см. main.signals).
+Команда manage.py send_comment_digests собирает события каждого получателя
+за окно COMMENT_DIGEST_WINDOW секунд, считая от самого раннего, и ставит
+в очередь писем (main/mail.py) одно письмо со всеми комментариями. Письма
+получают только активированные пользователи с включенным send_messages."""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .mail import renderer, get_host
+
+COMMENT_DIGEST = 'comment_digest'
+
+
+def get_digest_window():
+    return timedelta(seconds=getattr(settings, 'COMMENT_DIGEST_WINDOW', 900))
+
+
+def add_comment_event(comment):
+    '''Регистрирует событие для автора объявления - один INSERT, без других запросов'''
+    from .models import CommentEvent
+    return CommentEvent.objects.create(comment=comment, recipient_id=comment.ad.author_id)
+
+
+def add_comment_events(comments, using='default'):
+    '''То же для нескольких комментариев: авторы объявлений загружаются одним запросом'''
+    from .models import Ad, CommentEvent
+    authors = dict(Ad.objects.using(using).filter(pk__in={comment.ad_id for comment in comments})
+                   .values_list('pk', 'author_id'))
+    return CommentEvent.objects.using(using).bulk_create(
+        [CommentEvent(comment_id=comment.pk, recipient_id=authors[comment.ad_id]) for comment in comments])
+
+
+def collect_digests(batch_size=500):
+    '''Превращает накопившиеся события в письма-дайджесты.
+    Возвращает (обработано получателей, поставлено писем)'''
+    from .models import AdvUser, CommentEvent, OutgoingMail
+    border = timezone.now() - get_digest_window()
+    due = CommentEvent.objects.values('recipient').annotate(first=Min('created_at')) \
+        .filter(first__lte=border).values_list('recipient', flat=True)
+    with transaction.atomic():
+        recipients = list(due[:batch_size])
+        if not recipients:
+            return 0, 0
+        events = CommentEvent.objects.filter(recipient__in=recipients)
+        comments = {}
+        read = []
+        for pk, recipient, comment in events.order_by('created_at').values_list('pk', 'recipient', 'comment'):
+            comments.setdefault(recipient, []).append(comment)
+            read.append(pk)
+        users = AdvUser.objects.filter(pk__in=recipients, send_messages=True, is_activated=True)
+        mails = [OutgoingMail(kind=COMMENT_DIGEST, user=user, payload={'comments': comments[user.pk]})
+                 for user in users]
+        OutgoingMail.objects.bulk_create(mails)
+        # удаляются только прочитанные события: добавленные после чтения попадут в следующий дайджест
+        for start in range(0, len(read), 500):
+            CommentEvent.objects.filter(pk__in=read[start:start + 500])._raw_delete(CommentEvent.objects.db)
+    return len(recipients), len(mails)
+
+
+@renderer(COMMENT_DIGEST)
+def render_comment_digest(mail):
+    from .models import Comment
+    user = mail.user
+    if not (user.send_messages and user.is_activated):
+        return None, None, []
+    comments = Comment.objects.filter(pk__in=mail.payload.get('comments', []), is_active=True) \
+        .exclude(author=user.username) \
+        .select_related('ad').order_by('ad', 'created_at') # свои комментарии автору не присылаем
+    host = get_host()
+    items = [{'comment': comment,
+              'url': host + reverse('main:detail', kwargs={'rubric_pk': comment.ad.rubric_id, 'pk': comment.ad_id})}
+             for comment in comments]
+    if not items:
+        return None, None, []
+    context = {'user': user, 'host': host, 'items': items}
+    subject = render_to_string('email/comment_digest_subject.txt', context)
+    body_text = render_to_string('email/comment_digest_body.txt', context)
+    return ' '.join(subject.split()), body_text, [user.email]
@@ -0,0 +1,167 @@
+"""Keyset (курсорная) пагинация.
+
+Стандартный Paginator выполняет COUNT(*) и выбирает страницу через OFFSET, поэтому
+чем дальше страница, тем медленнее запрос. Здесь следующая страница выбирается
+условием "строго после последней записи предыдущей страницы" по ключам сортировки
+(по умолчанию -created_at, -id), так что любая страница стоит столько же, сколько первая.
+Позиция передается в адресе в виде непрозрачного курсора."""
+
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder обрезает время до миллисекунд, а для курсора нужно точное значение ключа
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, reverse=False):
+    data = json.dumps({'v': values, 'r': reverse}, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''Возвращает (значения ключей, направление) или None, если курсор поврежден'''
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(data)
+        return list(data['v']), bool(data['r'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def estimate_count(queryset):
+    '''Приблизительное количество записей без COUNT(*). На PostgreSQL для всей таблицы
+    берется pg_class.reltuples, для отфильтрованного набора - оценка планировщика из EXPLAIN.
+    На остальных СУБД выполняется обычный count().'''
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return row[0]
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    '''Курсорный пагинатор. Ключи сортировки берутся из order_by() набора записей
+    (или Meta.ordering модели), к ним добавляется pk для однозначности.
+    Ключами могут быть поля модели и аннотации (например, rank поиска).'''
+
+    def __init__(self, queryset, per_page, approximate_count=True):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.approximate_count = approximate_count
+        self.keys = self.get_keys(queryset)
+
+    @staticmethod
+    def get_keys(queryset):
+        '''Ключи сортировки: список пар (имя, по убыванию)'''
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        keys = []
+        for field in ordering:
+            if not isinstance(field, str):
+                raise ValueError('KeysetPaginator поддерживает сортировку только по именам полей')
+            name = field.lstrip('-')
+            keys.append(('pk' if name == 'id' else name, field.startswith('-')))
+        if not any(name == 'pk' for name, _ in keys):
+            keys.append(('pk', keys[-1][1] if keys else True))
+        return keys
+
+    def _position_filter(self, values, backwards):
+        '''Условие "строго после позиции values" по составному ключу:
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...'''
+        condition = Q()
+        for i, (name, descending) in enumerate(self.keys):
+            lookup = 'lt' if descending != backwards else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for prev_name, _ in self.keys[:i]:
+                step &= Q(**{prev_name: values[self._index(prev_name)]})
+            condition |= step
+        return condition
+
+    def _index(self, name):
+        return [key for key, _ in self.keys].index(name)
+
+    def _ordering(self, backwards):
+        return [('-' if descending != backwards else '') + name for name, descending in self.keys]
+
+    def _cursor_for(self, obj, reverse):
+        # набор записей может быть и набором словарей (.values()), тогда ключи должны входить в него
+        if isinstance(obj, dict):
+            return encode_cursor([obj[name] for name, _ in self.keys], reverse)
+        return encode_cursor([getattr(obj, name) for name, _ in self.keys], reverse)
+
+    def get_page(self, cursor=None):
+        '''Возвращает страницу после (или перед) позицией курсора. Неверный курсор
+        считается отсутствующим - возвращается первая страница'''
+        position = decode_cursor(cursor) if cursor else None
+        if position and len(position[0]) != len(self.keys):
+            position = None
+        backwards = bool(position and position[1])
+        queryset = self.queryset.order_by(*self._ordering(backwards))
+        if position:
+            try:
+                queryset = queryset.filter(self._position_filter(position[0], backwards))
+            except (ValidationError, ValueError, TypeError):
+                return self.get_page()
+        objects = list(queryset[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if backwards:
+            objects.reverse()
+        next_cursor = previous_cursor = None
+        if objects:
+            if has_more or backwards:
+                next_cursor = self._cursor_for(objects[-1], False)
+            if position and not backwards or backwards and has_more:
+                previous_cursor = self._cursor_for(objects[0], True)
+        return KeysetPage(objects, self, next_cursor, previous_cursor)
+
+    @property
+    def count(self):
+        '''Общее количество записей; по умолчанию - приблизительное, см. estimate_count'''
+        if self.approximate_count:
+            return estimate_count(self.queryset)
+        return self.queryset.count()
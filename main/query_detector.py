@@ -0,0 +1,141 @@
+"""Поиск повторяющихся (N+1) и медленных SQL-запросов в режиме разработки.
+
+Для каждого запроса к сайту посредник QueryDetectorMiddleware (main/middlewares.py)
+записывает SQL-запросы вместе с местом, откуда они выполнены: строкой шаблона
+(узел, при отрисовке которого выполнен запрос) и ближайшей строкой кода проекта.
+Запросы одинаковой формы (текст с замененными значениями) из одного места,
+выполненные QUERY_DETECTOR_REPEAT и больше раз, - признак N+1: например,
+{{ ad.rubric.pk }} в цикле index.html без select_related. Такие запросы и запросы
+дольше QUERY_DETECTOR_SLOW_MS записываются в журнал main.query_detector с местами
+вызова. В строгом режиме (QUERY_DETECTOR_STRICT) вместо записи в журнал выбрасывается
+исключение, и тест, запросивший страницу, падает; там же проверяются бюджеты
+запросов контроллеров из QUERY_BUDGETS.
+
+Разбор стека на каждый запрос к базе заметно замедляет работу, поэтому по умолчанию
+поиск включен только при DEBUG (QUERY_DETECTOR)."""
+
+import logging
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+Query = namedtuple('Query', ('fingerprint', 'sql', 'duration', 'location', 'stack'))
+Problem = namedtuple('Problem', ('kind', 'location', 'count', 'duration', 'sql', 'stack'))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+_SKIP_FILES = {__file__, *(os.path.join(os.path.dirname(__file__), name) for name in ('metrics.py', 'aio.py'))}
+
+
+class QueryProblemsDetected(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    '''Форма запроса: строки и числа заменены на %s, списки IN (...) сокращены до одного значения'''
+    sql = _STRING.sub('%s', sql)
+    sql = _NUMBER.sub('%s', sql)
+    sql = _IN_LIST.sub('IN (%s)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _template_location(frame):
+    node = frame.f_locals.get('self')
+    origin = getattr(node, 'origin', None)
+    token = getattr(node, 'token', None)
+    if origin is None or token is None:
+        return None
+    return f'{origin.template_name or origin.name}:{token.lineno}'
+
+
+def get_stack(frame, base_dir=None, limit=8):
+    '''Места вызова от внутреннего к внешнему: узлы шаблонов ("main/index.html:38")
+    и строки кода проекта ("main/views.py:95 in detail"); код Django и библиотек пропускается'''
+    base_dir = str(base_dir or settings.BASE_DIR)
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        filename = code.co_filename
+        if code.co_name == 'render_annotated' and filename.endswith('template/base.py'):
+            location = _template_location(frame)
+            if location and (not stack or stack[-1] != location):
+                stack.append(location)
+        elif filename.startswith(base_dir) and 'site-packages' not in filename \
+                and filename not in _SKIP_FILES:
+            stack.append(f'{filename[len(base_dir):].lstrip("/")}:{frame.f_lineno} in {code.co_name}')
+        frame = frame.f_back
+    return stack
+
+
+class QueryDetector:
+    '''Обертка выполнения SQL-запросов (connection.execute_wrapper), запоминающая запросы и места вызова'''
+
+    def __init__(self, repeat=None, slow_ms=None):
+        self.repeat = repeat or getattr(settings, 'QUERY_DETECTOR_REPEAT', 3)
+        slow_ms = slow_ms if slow_ms is not None else getattr(settings, 'QUERY_DETECTOR_SLOW_MS', 100)
+        self.slow = slow_ms / 1000
+        self.base_dir = str(settings.BASE_DIR)
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            stack = get_stack(sys._getframe(1), self.base_dir)
+            self.queries.append(Query(fingerprint(sql), sql, duration, stack[0] if stack else '?', stack))
+
+    def problems(self):
+        '''Повторяющиеся запросы (kind='repeated') и медленные запросы (kind='slow')'''
+        groups = {}
+        for query in self.queries:
+            groups.setdefault((query.fingerprint, query.location), []).append(query)
+        problems = []
+        for (_, location), queries in groups.items():
+            if len(queries) >= self.repeat:
+                problems.append(Problem('repeated', location, len(queries), sum(q.duration for q in queries),
+                                        queries[0].sql, queries[0].stack))
+        for query in self.queries:
+            if query.duration >= self.slow:
+                problems.append(Problem('slow', query.location, 1, query.duration, query.sql, query.stack))
+        return problems
+
+
+def format_problems(problems, title=''):
+    lines = [title] if title else []
+    for problem in problems:
+        if problem.kind == 'repeated':
+            lines.append(f'{problem.count} одинаковых запросов ({problem.duration * 1000:.1f} мс) '
+                         f'из {problem.location}:')
+        else:
+            lines.append(f'медленный запрос ({problem.duration * 1000:.1f} мс) из {problem.location}:')
+        lines.append(f'    {problem.sql}')
+        lines.extend(f'      {location}' for location in problem.stack)
+    return '\n'.join(lines)
+
+
+def check(detector, view, strict=False, budget=None):
+    '''Сообщает о проблемах, найденных детектором за запрос к контроллеру view:
+    пишет в журнал или, при strict, выбрасывает QueryProblemsDetected'''
+    problems = detector.problems()
+    executed = len(detector.queries)
+    over_budget = budget is not None and executed > budget
+    if not problems and not over_budget:
+        return
+    title = f'{view}: {executed} SQL-запросов' + (f' при бюджете {budget}' if budget is not None else '')
+    message = format_problems(problems, title)
+    if over_budget:
+        message += '\n' + '\n'.join(f'{i}. {query.location}: {query.sql}'
+                                     for i, query in enumerate(detector.queries, start=1))
+    if strict:
+        raise QueryProblemsDetected(message)
+    logger.warning(message)
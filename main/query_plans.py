@@ -0,0 +1,140 @@
+"""Проверка планов запросов страниц сайта: используются ли индексы под эти запросы.
+
+Для каждого сценария (первая и дальняя страница списка, рубрика, профиль, комментарии
+на странице объявления) выполняются те же наборы записей, что и в контроллерах;
+запросы перехватываются, для каждого выводится план (EXPLAIN) и время выполнения.
+compare_indexes() прогоняет сценарии дважды - с индексами из Meta.indexes моделей
+и со схемой без них (как до миграции 0011), - в транзакции, которая затем
+откатывается. Используется командой manage.py benchmark_indexes."""
+
+import statistics
+import time
+
+from django.db import connections, models
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from .pagination import KeysetPaginator, encode_cursor
+
+PAGE_SIZE = 2 # как в контроллерах
+
+
+def get_listing_indexes():
+    '''Индексы под запросы страниц: [(модель, индекс)]'''
+    from .models import Ad, Comment
+    return [(model, index) for model in (Ad, Comment) for index in model._meta.indexes]
+
+
+def get_legacy_indexes():
+    '''Индексы, которые были вместо них: отдельные индексы по is_active'''
+    from .models import Ad, Comment
+    return [(Ad, models.Index(fields=['is_active'], name='main_ad_is_active_legacy')),
+            (Comment, models.Index(fields=['is_active'], name='main_comment_is_active_legacy'))]
+
+
+def explain(sql, using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        return [row[-1] for row in rows] # id, parent, notused, detail
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def analyze(using='default'):
+    '''Обновляет статистику планировщика после добавления данных или изменения индексов'''
+    from .models import Ad, Comment
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for model in (Ad, Comment):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        elif connection.vendor == 'sqlite':
+            cursor.execute('ANALYZE')
+
+
+def _execute_indexes(indexes, using, create):
+    connection = connections[using]
+    schema_editor = connection.schema_editor()
+    with connection.cursor() as cursor:
+        for model, index in indexes:
+            statement = index.create_sql(model, schema_editor) if create else index.remove_sql(model, schema_editor)
+            cursor.execute(str(statement))
+
+
+def get_scenarios(using='default'):
+    '''Сценарии: {название: функция без аргументов, выполняющая запросы страницы}'''
+    from .models import Ad, Rubric
+    from .views import detail_validators
+    ads = Ad.objects.using(using)
+    active = ads.filter(is_active=True)
+    scenarios = {}
+
+    def listing(queryset, cursor=None):
+        return lambda: list(KeysetPaginator(queryset, PAGE_SIZE).get_page(cursor))
+
+    scenarios['index'] = listing(active.for_list())
+    total = active.count()
+    if total:
+        middle = active.order_by('-created_at', '-pk').values_list('created_at', 'pk')[total // 2]
+        scenarios['index_deep'] = listing(active.for_list(), encode_cursor(list(middle)))
+    rubrics = Rubric.objects.using(using).filter(super_rubric__isnull=False, ad_count__gt=0).order_by('ad_count')
+    rare, popular = rubrics.first(), rubrics.last()
+    if popular:
+        scenarios['by_rubric'] = listing(active.for_list().filter(rubric=popular.pk))
+        scenarios['by_rubric_rare'] = listing(active.for_list().filter(rubric=rare.pk))
+    author = ads.order_by().values('author').annotate(count=Count('pk')).order_by('-count').first()
+    if author:
+        scenarios['profile'] = listing(ads.for_list().filter(author=author['author']))
+    ad = ads.order_by('-comment_count').only('pk', 'rubric').first()
+    if ad:
+        scenarios['detail_comments'] = lambda: ads.for_detail().get(pk=ad.pk).active_comments
+        scenarios['detail_validators'] = lambda: detail_validators(None, ad.rubric_id, ad.pk)
+    return scenarios
+
+
+def run_scenario(func, repeat=20, using='default'):
+    '''Возвращает словарь: медиана и 95-й процентиль времени в мс, запросы и их планы'''
+    with CaptureQueriesContext(connections[using]) as context:
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'queries': [{'sql': query['sql'], 'plan': explain(query['sql'], using)}
+                    for query in context.captured_queries],
+    }
+
+
+def uses_indexes(result, indexes):
+    '''Имена индексов из indexes, встречающиеся в планах запросов сценария'''
+    names = {index.name for _, index in indexes}
+    return sorted({name for query in result['queries'] for line in query['plan']
+                   for name in names if name in line})
+
+
+def compare_indexes(repeat=20, using='default'):
+    '''Прогоняет сценарии без индексов под запросы страниц и с ними.
+    Вызывается внутри транзакции: схема временно меняется. Возвращает
+    {сценарий: {'before': результат, 'after': результат}}'''
+    listing_indexes, legacy_indexes = get_listing_indexes(), get_legacy_indexes()
+    scenarios = get_scenarios(using)
+    results = {name: {} for name in scenarios}
+    _execute_indexes(listing_indexes, using, create=False)
+    _execute_indexes(legacy_indexes, using, create=True)
+    analyze(using)
+    for name, func in scenarios.items():
+        results[name]['before'] = run_scenario(func, repeat, using)
+    _execute_indexes(legacy_indexes, using, create=False)
+    _execute_indexes(listing_indexes, using, create=True)
+    analyze(using)
+    for name, func in scenarios.items():
+        results[name]['after'] = run_scenario(func, repeat, using)
+        results[name]['after']['indexes'] = uses_indexes(results[name]['after'], listing_indexes)
+    return results
@@ -0,0 +1,168 @@
+"""Чтение с реплик базы данных.
+
+Маршрутизатор ReplicaRouter (DATABASE_ROUTERS) отправляет чтение при обработке
+запросов к сайту на одну из реплик REPLICA_DATABASES, а запись - на основную базу.
+Реплика выбирается один раз на запрос, чтобы все чтения видели одно состояние данных.
+Чтение идет с основной базы:
+    - вне запросов к сайту (команды manage.py, фоновые процессы) - они часто читают
+      только что записанное;
+    - внутри транзакции основной базы;
+    - в запросах POST, PUT, PATCH и DELETE;
+    - в течение REPLICA_PIN_SECONDS секунд после такого запроса: посредник
+      ReplicaMiddleware ставит cookie REPLICA_PIN_COOKIE, и пользователь, добавивший
+      объявление или комментарий, сразу видит его ("read your writes");
+    - если реплика указывает на ту же базу, что и основная (TEST MIRROR в тестах);
+    - если ни одна реплика не прошла проверку: доступность и, для PostgreSQL,
+      отставание не больше REPLICA_MAX_LAG секунд. Проверка повторяется не чаще
+      раза в REPLICA_CHECK_INTERVAL секунд.
+
+Постоянные соединения (CONN_MAX_AGE) перед началом запроса проверяются
+не чаще раза в DATABASE_HEALTH_CHECK_INTERVAL секунд и закрываются, если сервер
+их разорвал (в Django 3.2 нет CONN_HEALTH_CHECKS).
+
+Другие посетители могут увидеть изменения с задержкой репликации, в том числе
+в страницах, закэшированных в это время (main/caching.py)."""
+
+import random
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_replica = ContextVar('callboard_replica', default=None) # псевдоним реплики текущего запроса или None
+
+_lock = threading.Lock()
+_health = {} # псевдоним реплики: (исправна, момент проверки)
+_local = threading.local()
+
+
+def get_replicas():
+    return getattr(settings, 'REPLICA_DATABASES', ())
+
+
+def is_mirror(alias):
+    '''Указывает ли псевдоним на ту же базу, что и основной: так бывает в тестах, где реплики
+    с TEST MIRROR подключаются к тестовой базе default. Такое чтение идет через основное
+    подключение - подключение-зеркало не видит данных незавершенной транзакции теста'''
+    keys = ('ENGINE', 'NAME', 'HOST', 'PORT')
+    replica, default = connections[alias].settings_dict, connections[DEFAULT_DB_ALIAS].settings_dict
+    return all(replica.get(key) == default.get(key) for key in keys)
+
+
+def get_replication_lag(connection):
+    '''Отставание реплики PostgreSQL в секундах (0, если все полученные изменения применены);
+    для других СУБД - None'''
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                       'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+
+def check_replica(alias):
+    '''Доступна ли реплика и не отстает ли больше REPLICA_MAX_LAG секунд'''
+    connection = connections[alias]
+    try:
+        connection.ensure_connection()
+        if not connection.is_usable():
+            connection.close()
+            return False
+        lag = get_replication_lag(connection)
+    except DatabaseError:
+        connection.close()
+        return False
+    return lag is None or lag <= getattr(settings, 'REPLICA_MAX_LAG', 5)
+
+
+def is_healthy(alias):
+    interval = getattr(settings, 'REPLICA_CHECK_INTERVAL', 10)
+    now = time.monotonic()
+    healthy, checked_at = _health.get(alias, (True, None))
+    if checked_at is not None and now - checked_at < interval:
+        return healthy
+    with _lock:
+        healthy, checked_at = _health.get(alias, (True, None))
+        if checked_at is None or now - checked_at >= interval:
+            healthy = check_replica(alias)
+            _health[alias] = (healthy, now)
+    return healthy
+
+
+def choose_replica():
+    '''Случайная исправная реплика или None'''
+    replicas = [alias for alias in get_replicas() if not is_mirror(alias) and is_healthy(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+def use_replica(alias):
+    '''Направляет чтение до reset_replica(token) на реплику alias (None - на основную базу)'''
+    return _replica.set(alias)
+
+
+def reset_replica(token):
+    _replica.reset(token)
+
+
+def pin_primary():
+    '''Дальше в текущем запросе читать с основной базы (например, после записи в запросе GET)'''
+    _replica.set(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        alias = _replica.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block or is_mirror(alias):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема реплик обновляется репликацией
+        return False if db in get_replicas() else None
+
+
+def sync_sqlite_replica(alias):
+    '''Копирует основную базу SQLite в реплику alias - замена репликации при локальной проверке'''
+    source, target = connections[DEFAULT_DB_ALIAS], connections[alias]
+    if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+        raise ValueError(f'{alias}: копировать можно только базу SQLite в базу SQLite')
+    target.close()
+    source_db = sqlite3.connect(source.settings_dict['NAME'])
+    target_db = sqlite3.connect(target.settings_dict['NAME'])
+    try:
+        source_db.backup(target_db)
+    finally:
+        target_db.close()
+        source_db.close()
+    _health.pop(alias, None)
+
+
+def check_connections(**kwargs):
+    '''Обработчик сигнала request_started: закрывает разорванные постоянные соединения'''
+    interval = getattr(settings, 'DATABASE_HEALTH_CHECK_INTERVAL', 30)
+    checked = _local.__dict__.setdefault('checked', {})
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or now - checked.get(connection.alias, 0) < interval:
+            continue
+        checked[connection.alias] = now
+        if not connection.is_usable():
+            connection.close()
@@ -0,0 +1,116 @@
+"""Кэш дерева рубрик для боковой панели.
+
+Дерево строится одним запросом и хранится в памяти процесса в виде кортежа
+неизменяемых узлов. При изменении или удалении рубрики кэш сбрасывается
+обработчиками сигналов (см. main.signals). Если задан параметр RUBRIC_TREE_CACHE
+(псевдоним кэша из CACHES), номер версии дерева хранится в общем кэше, и сброс,
+выполненный в одном процессе, видят все остальные процессы.
+
+Счетчики объявлений рубрик меняются при каждом добавлении или снятии объявления,
+поэтому дерево и кэшированный фрагмент боковой панели из-за них не сбрасываются:
+счетчики читаются отдельным запросом и хранятся в кэше страниц
+RUBRIC_COUNTS_TIMEOUT секунд (get_rubric_counts()), а фрагмент перерисовывается,
+когда они перечитаны. Версии страниц (main/caching.py) от счетчиков не зависят: страница
+гостя из кэша показывает счетчики на момент отрисовки, пока не изменятся данные самой
+страницы или не истечет PAGE_CACHE_TIMEOUT, а по ответу 304 (тот же ETag) браузер
+показывает прежние счетчики, пока не изменятся данные страницы."""
+
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+
+from .caching import get_cache
+
+SuperRubricNode = namedtuple('SuperRubricNode', ('pk', 'name', 'ad_count'))
+SubRubricNode = namedtuple('SubRubricNode', ('pk', 'name', 'super_rubric', 'ad_count'))
+
+VERSION_KEY = 'main:rubric_tree:version'
+COUNTS_KEY = 'main:rubric_tree:counts'
+
+_lock = threading.Lock()
+_tree = None
+_version = None
+
+
+def _shared_cache():
+    alias = getattr(settings, 'RUBRIC_TREE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _shared_version(cache):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def build_rubric_tree():
+    '''Строит дерево подрубрик с надрубриками одним запросом, в порядке SubRubric.Meta.ordering'''
+    from .models import SubRubric
+    supers = {}
+    tree = []
+    # дерево хранится до следующего изменения рубрик или счетчиков, поэтому читается
+    # с основной базы: реплика в момент сброса кэша могла еще не получить изменение
+    rows = SubRubric.objects.using(router.db_for_write(SubRubric)).values_list('pk', 'name', 'ad_count',
+                                         'super_rubric__pk', 'super_rubric__name', 'super_rubric__ad_count')
+    for pk, name, ad_count, super_pk, super_name, super_ad_count in rows:
+        if super_pk not in supers:
+            supers[super_pk] = SuperRubricNode(super_pk, super_name, super_ad_count)
+        tree.append(SubRubricNode(pk, name, supers[super_pk], ad_count))
+    return tuple(tree)
+
+
+def get_rubric_tree():
+    '''Возвращает дерево рубрик. На "теплом" кэше не выполняет ни одного SQL-запроса'''
+    global _tree, _version
+    cache = _shared_cache()
+    version = _shared_version(cache) if cache else None
+    tree = _tree
+    if tree is not None and _version == version:
+        return tree
+    with _lock:
+        if _tree is None or _version != version:
+            _tree = build_rubric_tree()
+            _version = version
+        return _tree
+
+
+def invalidate_rubric_tree():
+    global _tree
+    with _lock:
+        _tree = None
+    cache = _shared_cache()
+    if cache:
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+
+
+def get_rubric_counts():
+    '''Возвращает момент чтения счетчиков из базы и словарь {рубрика: количество объявлений}.
+    Счетчики хранятся в кэше страниц RUBRIC_COUNTS_TIMEOUT секунд'''
+    from .models import Rubric
+    cache = get_cache()
+    counts = cache.get(COUNTS_KEY)
+    if counts is None:
+        counts = (time.time(), dict(Rubric.objects.values_list('pk', 'ad_count')))
+        cache.set(COUNTS_KEY, counts, getattr(settings, 'RUBRIC_COUNTS_TIMEOUT', 60))
+    return counts
+
+
+def with_counts(tree, counts):
+    '''Узлы дерева tree со счетчиками из counts (см. get_rubric_counts())'''
+    supers = {}
+    nodes = []
+    for node in tree:
+        super_rubric = node.super_rubric
+        if super_rubric.pk not in supers:
+            supers[super_rubric.pk] = super_rubric._replace(ad_count=counts.get(super_rubric.pk, 0))
+        nodes.append(node._replace(super_rubric=supers[super_rubric.pk], ad_count=counts.get(node.pk, 0)))
+    return nodes
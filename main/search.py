@@ -0,0 +1,137 @@
+"""Полнотекстовый поиск по объявлениям.
+
+На PostgreSQL поиск идет по столбцу main_ad.search_vector (tsvector), который
+поддерживается триггером в БД и покрыт GIN-индексом. Результаты сортируются
+по ts_rank. На остальных СУБД (например, SQLite при запуске тестов) используется
+простой инвертированный индекс - модель AdSearchTerm, который перестраивается
+при сохранении объявления."""
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import F, FloatField, Lookup, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast
+
+TITLE_WEIGHT = 4 # вес слова из заголовка, слово из описания весит 1
+TERM_MAX_LENGTH = 40
+TOKEN_RE = re.compile(r'\w+')
+
+
+def get_search_config():
+    return getattr(settings, 'SEARCH_CONFIG', 'russian')
+
+
+class SearchVectorField(models.Field):
+    '''Столбец tsvector на PostgreSQL. На других СУБД столбец создается, но не используется.
+    Поле объявлено здесь, а не взято из django.contrib.postgres, чтобы модели
+    загружались и без psycopg2.'''
+    description = 'Поисковый вектор'
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'tsvector'
+        return 'text'
+
+
+@SearchVectorField.register_lookup
+class SearchMatch(Lookup):
+    '''search_vector__match=SearchQuery(...) -> search_vector @@ query. Именно такое
+    условие позволяет планировщику использовать GIN-индекс.'''
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} @@ {rhs}', lhs_params + rhs_params
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def build_terms(ad):
+    '''Возвращает словарь {слово: вес} для инвертированного индекса'''
+    weights = Counter()
+    for term in tokenize(ad.title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(ad.content):
+        weights[term] += 1
+    return {term[:TERM_MAX_LENGTH]: weight for term, weight in weights.items()}
+
+
+def index_ad(ad, using=None):
+    '''Перестраивает записи инвертированного индекса для одного объявления.
+    На PostgreSQL ничего не делает - там вектор обновляет триггер.'''
+    using = using or ad._state.db or 'default'
+    if connections[using].vendor == 'postgresql':
+        return
+    from .models import AdSearchTerm
+    AdSearchTerm.objects.using(using).filter(ad=ad).delete()
+    AdSearchTerm.objects.using(using).bulk_create(
+        [AdSearchTerm(ad=ad, term=term, weight=weight) for term, weight in build_terms(ad).items()])
+
+
+def rebuild_index(using='default', batch_size=500):
+    '''Полная перестройка поискового индекса (для уже существующих объявлений)'''
+    from .models import Ad, AdSearchTerm
+    if connections[using].vendor == 'postgresql':
+        with connections[using].cursor() as cursor:
+            cursor.execute('UPDATE main_ad SET title = title')  # срабатывает триггер
+        return Ad.objects.using(using).count()
+    AdSearchTerm.objects.using(using).all().delete()
+    count = 0
+    batch = []
+    for ad in Ad.objects.using(using).only('pk', 'title', 'content').iterator(chunk_size=batch_size):
+        batch.extend(AdSearchTerm(ad=ad, term=term, weight=weight) for term, weight in build_terms(ad).items())
+        count += 1
+        if len(batch) >= batch_size:
+            AdSearchTerm.objects.using(using).bulk_create(batch)
+            batch = []
+    AdSearchTerm.objects.using(using).bulk_create(batch)
+    return count
+
+
+def _postgres_search(queryset, keyword):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+    query = SearchQuery(keyword, config=get_search_config())
+    # ts_rank возвращает real; приводим к double, чтобы значение ранга без потерь
+    # проходило через курсор пагинации (см. main.pagination)
+    return queryset.filter(search_vector__match=query) \
+        .annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField())) \
+        .order_by('-rank', '-created_at')
+
+
+def _term_range(term):
+    # поиск по префиксу через диапазон, чтобы работал обычный b-tree индекс
+    return Q(term__gte=term, term__lt=term + '\uffff')
+
+
+def _fallback_search(queryset, keyword):
+    from .models import AdSearchTerm
+    terms = tokenize(keyword)
+    if not terms:
+        return queryset
+    terms_q = Q()
+    for term in terms:
+        queryset = queryset.filter(pk__in=AdSearchTerm.objects.filter(_term_range(term)).values('ad'))
+        terms_q |= _term_range(term)
+    rank = AdSearchTerm.objects.filter(terms_q, ad=OuterRef('pk')).values('ad') \
+        .annotate(total=Sum('weight')).values('total')
+    return queryset.annotate(rank=Subquery(rank)).order_by('-rank', '-created_at')
+
+
+def search_ads(queryset, keyword):
+    '''Фильтрует набор объявлений по ключевым словам и сортирует по релевантности'''
+    keyword = keyword.strip()
+    if not keyword:
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        return _postgres_search(queryset, keyword)
+    return _fallback_search(queryset, keyword)
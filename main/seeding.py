@@ -0,0 +1,168 @@
+"""Генератор синтетических данных для нагрузочных тестов и проверки планов запросов.
+
+Записи добавляются bulk_create пачками; время публикации объявлений и комментариев
+распределено по периоду days дней, доли рубрик и активности комментариев неравномерны,
+как на живой доске. Генератор детерминирован: при одинаковом seed получаются
+одинаковые данные. Сигналы моделей не отправляются, поэтому счетчики
+(main/counters.py) и поисковый индекс обновляются здесь же, для каждой пачки."""
+
+import io
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+WORDS = ('велосипед', 'диван', 'ноутбук', 'телефон', 'шкаф', 'куртка', 'коляска', 'холодильник',
+         'гитара', 'палатка', 'самокат', 'монитор', 'кресло', 'стол', 'пальто', 'часы', 'лыжи',
+         'новый', 'бу', 'отличный', 'срочно', 'недорого', 'торг', 'доставка', 'гарантия',
+         'красный', 'черный', 'детский', 'спортивный', 'зимний', 'кожаный', 'деревянный')
+USER_PREFIX = 'seed_user_'
+SAMPLE_IMAGES = 8 # столько разных файлов; записи ссылаются на них многократно
+
+
+def _text(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    '''bulk_create заполняет поля auto_now и auto_now_add текущим временем;
+    внутри блока время задается явно'''
+    fields = [(field, field.auto_now, field.auto_now_add) for model in models
+              for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)
+              or getattr(field, 'auto_now', False)]
+    try:
+        for field, _, _ in fields:
+            field.auto_now = field.auto_now_add = False
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _new_pks(model, count, using):
+    '''Ключи последних count добавленных записей (bulk_create на SQLite их не возвращает)'''
+    pks = model.objects.using(using).order_by('-pk').values_list('pk', flat=True)[:count]
+    return sorted(pks)
+
+
+def _bulk_create(model, objects, using, batch_size):
+    model.objects.using(using).bulk_create(objects, batch_size=batch_size)
+    return _new_pks(model, len(objects), using)
+
+
+def make_sample_images(rnd, count=SAMPLE_IMAGES):
+    '''Сохраняет в хранилище count небольших изображений и возвращает их имена'''
+    names = []
+    for i in range(count):
+        color = tuple(rnd.randrange(256) for _ in range(3))
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), color).save(buffer, 'JPEG')
+        names.append(default_storage.save(f'seed_{i}.jpg', ContentFile(buffer.getvalue())))
+    return names
+
+
+def _add_references(uses, using):
+    '''Хранилище по хэшу (main/storage.py) считает ссылки на файлы; при сохранении
+    файла засчитана одна ссылка, остальные добавляются здесь'''
+    from .models import MediaBlob
+    for name, count in uses.items():
+        if count != 1:
+            MediaBlob.objects.using(using).filter(name=name).update(refcount=F('refcount') + count - 1)
+
+
+def seed_callboard(super_rubrics=5, sub_rubrics=40, users=1000, ads=100000, comments=200000,
+                   image_share=0.0, images=0, days=365, seed=0, batch_size=2000, using='default', log=None):
+    '''Добавляет записи и возвращает словарь с их количеством. image_share - доля объявлений
+    с основным изображением, images - количество дополнительных иллюстраций.
+    log(сообщение) сообщает о ходе работы'''
+    from .bulk import index_ads
+    from .counters import ad_deltas, comment_deltas, update_comment_counts, update_rubric_counts
+    from .models import Ad, AdditionalImage, AdvUser, Comment, Rubric, SubRubric, SuperRubric
+    from .thumbnails import generate_variants
+    log = log or (lambda message: None)
+    rnd = random.Random(seed)
+    now = timezone.now()
+    period = timedelta(days=days).total_seconds()
+
+    def moment():
+        # свежих объявлений больше, чем старых
+        return now - timedelta(seconds=period * rnd.random() ** 2)
+
+    with transaction.atomic(using=using), explicit_timestamps(Ad, Comment, AdvUser):
+        # номера в именах продолжают уже существующие, чтобы имена оставались уникальными
+        tag = Rubric.objects.using(using).count()
+        super_pks = _bulk_create(SuperRubric, [SuperRubric(name=f'Раздел {tag + i}', order=i)
+                                               for i in range(super_rubrics)], using, batch_size)
+        rubric_pks = _bulk_create(SubRubric, [
+            SubRubric(name=f'Рубрика {tag + i}', order=i, super_rubric_id=super_pks[i % len(super_pks)])
+            for i in range(sub_rubrics)], using, batch_size)
+        # вес рубрики убывает с номером (распределение Ципфа)
+        rubric_weights = [1 / (i + 1) for i in range(len(rubric_pks))]
+        log(f'Рубрик: {super_rubrics} + {sub_rubrics}')
+
+        password = make_password(None) # вход под этими пользователями невозможен
+        tag = AdvUser.objects.using(using).count()
+        user_pks = _bulk_create(AdvUser, [
+            AdvUser(username=f'{USER_PREFIX}{tag + i}', email=f'{USER_PREFIX}{tag + i}@example.com',
+                    password=password, date_joined=moment()) for i in range(users)], using, batch_size)
+        log(f'Пользователей: {users}')
+
+        sample_images = make_sample_images(rnd) if image_share or images else []
+        uses = dict.fromkeys(sample_images, 0)
+        ad_times = {}
+        for start in range(0, ads, batch_size):
+            batch = []
+            for _ in range(min(batch_size, ads - start)):
+                created_at = moment()
+                image = rnd.choice(sample_images) if sample_images and rnd.random() < image_share else ''
+                if image:
+                    uses[image] += 1
+                batch.append(Ad(rubric_id=rnd.choices(rubric_pks, rubric_weights)[0],
+                                author_id=rnd.choice(user_pks), title=_text(rnd, 3)[:40],
+                                content=_text(rnd, rnd.randint(10, 60)), price=rnd.randint(1, 100000),
+                                contacts=f'+7 900 {rnd.randint(0, 9999999):07d}', image=image,
+                                is_active=rnd.random() < 0.9, created_at=created_at, updated_at=created_at))
+            for ad, pk in zip(batch, _bulk_create(Ad, batch, using, batch_size)):
+                ad.pk = pk
+                ad_times[pk] = ad.created_at
+            index_ads(batch, using, batch_size)
+            update_rubric_counts(ad_deltas((None, False, ad.rubric_id, ad.is_active) for ad in batch), using)
+            log(f'Объявлений: {len(ad_times)}')
+
+        ad_pks = list(ad_times)
+        for start in range(0, images if ad_pks else 0, batch_size):
+            batch = [AdditionalImage(ad_id=rnd.choice(ad_pks), image=rnd.choice(sample_images))
+                     for _ in range(min(batch_size, images - start))]
+            for image in batch:
+                uses[image.image.name] += 1
+            AdditionalImage.objects.using(using).bulk_create(batch, batch_size=batch_size)
+            log(f'Иллюстраций: {start + len(batch)}')
+        _add_references(uses, using)
+
+        created = 0
+        while ad_pks and created < comments:
+            batch = []
+            for _ in range(min(batch_size, comments - created)):
+                # к небольшой части объявлений пишут большую часть комментариев
+                ad_pk = ad_pks[int(len(ad_pks) * rnd.random() ** 2)]
+                posted = ad_times[ad_pk] + (now - ad_times[ad_pk]) * rnd.random()
+                batch.append(Comment(ad_id=ad_pk, author=f'Гость {rnd.randint(1, 9999)}',
+                                     content=_text(rnd, rnd.randint(3, 20)), is_active=rnd.random() < 0.95,
+                                     created_at=posted))
+            Comment.objects.using(using).bulk_create(batch, batch_size=batch_size)
+            update_comment_counts(comment_deltas((comment.ad_id, False, comment.is_active) for comment in batch),
+                                  using)
+            created += len(batch)
+            log(f'Комментариев: {created}')
+    for name in sample_images:
+        generate_variants(name) # миниатюры нескольких файлов создаются сразу, а не из страниц
+    return {'super_rubrics': super_rubrics, 'sub_rubrics': sub_rubrics, 'users': users,
+            'ads': ads, 'images': images, 'comments': comments}
@@ -0,0 +1,165 @@
+"""Сессии в кэше с отложенной записью в базу (SESSION_ENGINE = 'main.sessions').
+
+Стандартный движок db читает django_session при каждом запросе вошедшего
+пользователя и пишет в нее при каждом изменении сессии (вход, всплывающие
+сообщения, не уместившиеся в cookie). Здесь сессия читается из кэша
+SESSION_CACHE_ALIAS; в базу обращение идет, только если записи в кэше нет
+(вытеснена или кэш перезапущен). Изменения сначала записываются в кэш, а в базу -
+фоновым потоком пачками (одна транзакция на пачку, несколько изменений одной сессии
+сводятся к последнему), так что запрос не ждет записи в базу.
+
+Кэш должен быть общим для всех рабочих процессов (файлы, Redis): в кэше в памяти
+у каждого процесса своя копия, и выход пользователя в одном процессе не завершал бы
+сессию в других. Поэтому с LocMemCache и DummyCache движок не работает
+(ImproperlyConfigured), а settings.py с CALLBOARD_CACHE=locmem выбирает движок db.
+
+Удаление сессии (выход, смена ключа при входе) записывается в базу сразу, чтобы
+после сбоя процесса завершенная сессия не восстановилась из базы. Изменения,
+не дошедшие до базы к остановке процесса, записываются при выходе (atexit), а при
+аварийном завершении остаются только в кэше.
+
+Просроченные сессии удаляются командой clear_sessions (или стандартной clearsessions)
+пачками по SESSION_CLEANUP_BATCH_SIZE записей - без загрузки записей и долгих блокировок."""
+
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from django.db import IntegrityError, OperationalError, close_old_connections, router, transaction
+from django.utils import timezone
+
+from .workers import BatchWorker
+
+KEY_PREFIX = 'main.sessions'
+WRITE_ATTEMPTS = 3 #попыток записи пачки в базу
+
+
+def _save_one(model, db, session):
+    '''Запись одной сессии, когда ее одновременно добавил другой процесс'''
+    queryset = model.objects.using(db).filter(session_key=session.session_key)
+    values = {'session_data': session.session_data, 'expire_date': session.expire_date}
+    if queryset.update(**values):
+        return
+    try:
+        with transaction.atomic(using=db):
+            session.save(using=db, force_insert=True)
+    except IntegrityError:
+        queryset.update(**values)
+
+
+def _write(model, db, latest):
+    deleted = [key for key, (data, _) in latest.items() if data is None]
+    changed = {key: value for key, value in latest.items() if value[0] is not None}
+    with transaction.atomic(using=db):
+        if deleted:
+            model.objects.using(db).filter(session_key__in=deleted)._raw_delete(db)
+        if changed:
+            existing = set(model.objects.using(db).filter(session_key__in=list(changed))
+                           .values_list('session_key', flat=True))
+            sessions = [model(session_key=key, session_data=data, expire_date=expire_date)
+                        for key, (data, expire_date) in changed.items()]
+            model.objects.using(db).bulk_update([s for s in sessions if s.session_key in existing],
+                                                ['session_data', 'expire_date'])
+            new = [s for s in sessions if s.session_key not in existing]
+            try:
+                with transaction.atomic(using=db):
+                    model.objects.using(db).bulk_create(new)
+            except IntegrityError:
+                # часть сессий успел добавить другой процесс - они записываются по одной
+                for session in new:
+                    _save_one(model, db, session)
+
+
+def write_sessions(items):
+    '''Записывает в базу пачку изменений сессий (ключ, данные, срок); данные None - удаление.
+    Несколько изменений одной сессии сводятся к последнему'''
+    latest = {}
+    for session_key, session_data, expire_date in items:
+        latest[session_key] = (session_data, expire_date)
+    model = SessionStore.get_model_class()
+    db = router.db_for_write(model)
+    try:
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                _write(model, db, latest)
+                return
+            except OperationalError:
+                # например, "database is locked" в SQLite при одновременной записи из запроса
+                if attempt == WRITE_ATTEMPTS:
+                    raise
+                time.sleep(0.5 * attempt)
+    finally:
+        close_old_connections()
+
+
+session_writer = BatchWorker('callboard-session-writer', write_sessions, batch_size=500)
+
+
+def check_cache(cache):
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured('Для сессий main.sessions нужен кэш, общий для рабочих процессов '
+                                   '(SESSION_CACHE_ALIAS): файлы, Redis или Memcached')
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        check_cache(self._cache)
+
+    def _get_session_from_db(self):
+        # на случай промаха кэша сессия читается с основной базы: на реплику она
+        # могла еще не попасть
+        model = self.model
+        try:
+            return model.objects.using(router.db_for_write(model)).get(
+                session_key=self.session_key, expire_date__gt=timezone.now())
+        except (model.DoesNotExist, SuspiciousOperation):
+            self._session_key = None
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if must_create:
+            # новый ключ занимается в кэше; совпадение со старой сессией только
+            # в базе исключает проверка exists() при выборе ключа
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+        session_writer.put((self.session_key, self.encode(data), self.get_expiry_date()))
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+        model = self.model
+        db = router.db_for_write(model)
+        model.objects.using(db).filter(session_key=session_key)._raw_delete(db)
+        # изменения этой сессии, еще стоящие в очереди, не должны вернуть ее в базу:
+        # удаление в очереди идет после них
+        session_writer.put((session_key, None, None))
+
+    @classmethod
+    def clear_expired(cls, batch_size=None):
+        '''Удаляет просроченные сессии пачками. Возвращает количество удаленных'''
+        batch_size = batch_size or getattr(settings, 'SESSION_CLEANUP_BATCH_SIZE', 1000)
+        model = cls.get_model_class()
+        db = router.db_for_write(model)
+        now = timezone.now()
+        deleted = 0
+        while True:
+            keys = list(model.objects.using(db).filter(expire_date__lt=now)
+                        .values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            # _raw_delete выполняет один DELETE без загрузки записей и сигналов
+            deleted += model.objects.using(db).filter(session_key__in=keys)._raw_delete(db)
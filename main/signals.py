@@ -0,0 +1,211 @@
+"""Обработчики сигналов моделей. Подключаются в MainConfig.ready()"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_init, pre_save
+from django.dispatch import receiver
+
+from . import caching
+from . import counters
+from .apps import ads_created, ads_deleted, ads_updated, comments_changed
+from .models import Ad, Rubric, Comment, AdditionalImage
+from .notifications import add_comment_event
+from .rubric_tree import invalidate_rubric_tree
+from . import thumbnails
+from .search import index_ad
+from .storage import ContentAddressedStorage
+
+
+@receiver(post_save, sender=Ad)
+def ad_search_index_handler(sender, instance, raw=False, using=None, **kwargs):
+    '''поддерживает инвертированный поисковый индекс в актуальном состоянии
+    (на PostgreSQL index_ad ничего не делает - вектор обновляет триггер)'''
+    if not raw:
+        index_ad(instance, using=using)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def rubric_tree_handler(sender, **kwargs):
+    '''сбрасывает кэш дерева рубрик. Сигналы отправляются от имени прокси-моделей
+    SuperRubric и SubRubric, поэтому отбор идет по подклассам Rubric, а не по sender=Rubric'''
+    if issubclass(sender, Rubric):
+        invalidate_rubric_tree()
+
+
+@receiver(post_init, sender=Ad)
+def ad_remember_rubric_handler(sender, instance, **kwargs):
+    # запоминаем исходную рубрику, чтобы при переносе объявления обновить обе рубрики,
+    # и исходное значение is_active - для массовых изменений (main/bulk.py)
+    instance._loaded_rubric_id = instance.__dict__.get('rubric_id')
+    instance._loaded_is_active = instance.__dict__.get('is_active')
+
+
+@receiver(post_init, sender=Comment)
+def comment_remember_active_handler(sender, instance, **kwargs):
+    # и исходное объявление: комментарий могут перенести к другому (в админке)
+    instance._loaded_is_active = instance.__dict__.get('is_active')
+    instance._loaded_ad_id = instance.__dict__.get('ad_id')
+
+
+@receiver(post_save, sender=Ad)
+def ad_counters_handler(sender, instance, created=False, raw=False, using=None, **kwargs):
+    '''счетчик активных объявлений рубрики. Подключается раньше ad_page_cache_handler,
+    который обновляет _loaded_rubric_id'''
+    if raw:
+        return
+    old = (None, False) if created else (instance._loaded_rubric_id, instance._loaded_is_active)
+    counters.update_rubric_counts(counters.ad_deltas([(*old, instance.rubric_id, instance.is_active)]), using)
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_delete, sender=Ad)
+def ad_delete_counters_handler(sender, instance, using=None, **kwargs):
+    counters.update_rubric_counts(counters.ad_deltas([(instance.rubric_id, instance.is_active, None, False)]),
+                                  using)
+
+
+@receiver(post_save, sender=Comment)
+def comment_counters_handler(sender, instance, created=False, raw=False, using=None, **kwargs):
+    '''счетчик активных комментариев объявления; при переносе комментария - обоих объявлений.
+    Подключается раньше ad_part_page_cache_handler, который обновляет _loaded_ad_id'''
+    if raw:
+        return
+    if created:
+        changes = [(instance.ad_id, False, instance.is_active)]
+    elif instance._loaded_ad_id not in (None, instance.ad_id):
+        changes = [(instance._loaded_ad_id, instance._loaded_is_active, False),
+                   (instance.ad_id, False, instance.is_active)]
+    else:
+        changes = [(instance.ad_id, instance._loaded_is_active, instance.is_active)]
+    counters.update_comment_counts(counters.comment_deltas(changes), using)
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_delete, sender=Comment)
+def comment_delete_counters_handler(sender, instance, using=None, **kwargs):
+    counters.update_comment_counts(counters.comment_deltas([(instance.ad_id, instance.is_active, False)]), using)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def rubric_counters_handler(sender, instance, raw=False, using=None, **kwargs):
+    '''счетчик надрубрики - сумма по подрубрикам; подрубрику могли перенести или удалить'''
+    if issubclass(sender, Rubric) and instance.super_rubric_id and not raw:
+        counters.recount_super_rubrics(using)
+
+
+def touch_on_commit(using, *names):
+    '''Отмечает группы данных измененными после фиксации транзакции: если сменить версию
+    раньше, параллельный запрос гостя прочитает старые записи и сохранит страницу под новой
+    версией. Имена вычисляются сразу, пока у записи прежние значения'''
+    transaction.on_commit(lambda: caching.touch(*names), using=using)
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+def ad_page_cache_handler(sender, instance, using=None, **kwargs):
+    touch_on_commit(using, caching.ALL_ADS, caching.ad_key(instance.pk), caching.rubric_key(instance.rubric_id),
+                    caching.rubric_key(instance._loaded_rubric_id) if instance._loaded_rubric_id else None)
+    instance._loaded_rubric_id = instance.rubric_id
+
+
+@receiver(ads_deleted)
+def ads_deleted_page_cache_handler(sender, ads, **kwargs):
+    '''массовое удаление (main/deletion.py) не отправляет post_delete'''
+    names = {caching.ALL_ADS}
+    for ad in ads:
+        names.update((caching.ad_key(ad['pk']), caching.rubric_key(ad['rubric_id'])))
+    caching.touch(*names)
+
+
+@receiver(ads_created)
+@receiver(ads_updated)
+def ads_bulk_page_cache_handler(sender, ads, **kwargs):
+    '''массовые операции (main/bulk.py) не отправляют post_save'''
+    names = {caching.ALL_ADS}
+    for ad in ads:
+        names.update((caching.ad_key(ad['pk']), caching.rubric_key(ad['rubric_id'])))
+        if ad.get('previous_rubric_id'):
+            names.add(caching.rubric_key(ad['previous_rubric_id']))
+    caching.touch(*names)
+
+
+@receiver(comments_changed)
+def comments_bulk_page_cache_handler(sender, comments, **kwargs):
+    caching.touch(*{caching.ad_key(comment['ad_id']) for comment in comments})
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=AdditionalImage)
+@receiver(post_delete, sender=AdditionalImage)
+def ad_part_page_cache_handler(sender, instance, using=None, **kwargs):
+    loaded_ad_id = getattr(instance, '_loaded_ad_id', None)
+    touch_on_commit(using, caching.ad_key(instance.ad_id), caching.ad_key(loaded_ad_id) if loaded_ad_id else None)
+    if sender is Comment:
+        instance._loaded_ad_id = instance.ad_id
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def rubric_page_cache_handler(sender, instance, using=None, **kwargs):
+    '''название рубрики выводится в боковой панели на всех страницах'''
+    if issubclass(sender, Rubric):
+        touch_on_commit(using, caching.SIDEBAR, caching.rubric_key(instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+def comment_notification_handler(sender, instance, created=False, raw=False, **kwargs):
+    '''уведомление автору объявления отправится в дайджесте, см. notifications.py'''
+    if created and not raw:
+        add_comment_event(instance)
+
+
+@receiver(post_init, sender=Ad)
+@receiver(post_init, sender=AdditionalImage)
+def remember_image_handler(sender, instance, **kwargs):
+    # имя файла из базы; у новой записи вместо него может быть выгружаемый файл
+    value = instance.__dict__.get('image')
+    instance._loaded_image = value if isinstance(value, str) else None
+
+
+@receiver(pre_save, sender=Ad)
+@receiver(pre_save, sender=AdditionalImage)
+def image_upload_handler(sender, instance, **kwargs):
+    # файл еще не сохранен в хранилище - его сохранит FileField.pre_save()
+    value = instance.__dict__.get('image')
+    instance._image_uploaded = bool(value) and not isinstance(value, str) and not getattr(value, '_committed', False)
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_save, sender=AdditionalImage)
+def image_reupload_handler(sender, instance, raw=False, **kwargs):
+    '''хранилище по хэшу (main/storage.py) считает каждую выгрузку новой ссылкой на файл.
+    Если выгружен тот же файл, что уже прикреплен, имя не меняется, и django_cleanup
+    не удаляет прежнюю ссылку - лишняя ссылка снимается здесь'''
+    if not raw and getattr(instance, '_image_uploaded', False) and instance.image.name == instance._loaded_image \
+            and isinstance(instance.image.storage, ContentAddressedStorage):
+        instance.image.storage.delete(instance.image.name)
+    instance._image_uploaded = False
+    if 'image' in instance.__dict__:
+        instance._loaded_image = instance.image.name
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_save, sender=AdditionalImage)
+def thumbnails_handler(sender, instance, raw=False, **kwargs):
+    '''миниатюры создаются в пуле процессов после фиксации транзакции, см. thumbnails.py'''
+    if raw or not instance.image or not getattr(settings, 'THUMBNAIL_PREGENERATE', True):
+        return
+    name = instance.image.name
+    transaction.on_commit(lambda: thumbnails.schedule(name))
+
+
+@receiver(ads_created)
+@receiver(ads_updated)
+def ads_bulk_thumbnails_handler(sender, images, **kwargs):
+    # сигнал отправляется уже после фиксации транзакции
+    if getattr(settings, 'THUMBNAIL_PREGENERATE', True):
+        for name in images:
+            thumbnails.schedule(name)
@@ -0,0 +1,235 @@
+"""Статические файлы в рабочем режиме.
+
+Хранилище CompressedManifestStaticFilesStorage (STATICFILES_STORAGE, включается
+переменной окружения CALLBOARD_STATIC_MANIFEST=1) при collectstatic
+добавляет к именам файлов хэш содержимого (main/style.css -> main/style.5e3b....css,
+ссылки url() в CSS переписываются) и рядом с файлами текстовых форматов сохраняет
+сжатые копии .gz и, если установлен пакет brotli, .br. Сжатие выполняется один раз
+при сборке с наибольшей степенью, а не при каждом запросе.
+
+Контроллер serve() отдает файлы из STATIC_ROOT: сжатую копию, если ее принимает
+браузер (Accept-Encoding), и для файлов с хэшем в имени - заголовок Cache-Control
+с годовым сроком и immutable, так как при изменении файла меняется и его имя.
+Файлы без хэша кэшируются на STATIC_MAX_AGE секунд. При DEBUG файлы, которых нет
+в STATIC_ROOT (collectstatic не выполнялся), берутся из папок приложений без кэширования.
+
+При STATIC_FONT_AWESOME_SUBSET шрифты font-awesome при сборке сокращаются до значков,
+классы которых (fa-...) встречаются в шаблонах или перечислены в STATIC_FONT_AWESOME_ICONS,
+а из CSS удаляются правила остальных значков. Нужен пакет fonttools."""
+
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.staticfiles import views as staticfiles_views
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.template import engines
+from django.utils._os import safe_join
+from django.utils.cache import add_never_cache_headers, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.map', '.xml', '.html', '.eot', '.ttf', '.otf', '.ico')
+COMPRESS_MIN_SIZE = 256 # меньшие файлы сжатие почти не уменьшает
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # в порядке предпочтения
+
+FONT_AWESOME_DIR = 'font-awesome-4.7.0'
+FONT_AWESOME_CSS = ('css/font-awesome.css', 'css/font-awesome.min.css')
+FONT_AWESOME_FONTS = {'fonts/fontawesome-webfont.woff2': 'woff2', 'fonts/fontawesome-webfont.woff': 'woff',
+                      'fonts/fontawesome-webfont.ttf': None}
+
+_ICON_CLASS = re.compile(r'\bfa-([a-z0-9-]+)')
+# правило значка: .fa-remove:before, .fa-close:before { content: "\f00d"; }
+_ICON_RULE = re.compile(r'((?:\.fa-[a-z0-9-]+:before,?\s*)+)\{\s*content:\s*"\\(f[0-9a-f]+)";?\s*\}\s*')
+_RULE_SELECTOR = re.compile(r'\.fa-([a-z0-9-]+):before')
+
+
+def compress(data):
+    '''Сжатые варианты данных: {'.gz': ..., '.br': ...}; варианты, которые не меньше
+    исходных данных, пропускаются'''
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: content for suffix, content in variants.items() if len(content) < len(data)}
+
+
+def find_used_icons():
+    '''Имена значков font-awesome (без fa-), встречающихся в шаблонах, и значков из
+    STATIC_FONT_AWESOME_ICONS'''
+    icons = set(getattr(settings, 'STATIC_FONT_AWESOME_ICONS', ()))
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    with open(os.path.join(root, name), encoding='utf-8', errors='ignore') as file:
+                        icons.update(_ICON_CLASS.findall(file.read()))
+    return icons
+
+
+def subset_css(css, icons):
+    '''CSS font-awesome без правил неиспользуемых значков. Возвращает (CSS, коды символов)'''
+    codepoints = set()
+
+    def replace(match):
+        selectors = [name for name in _RULE_SELECTOR.findall(match.group(1)) if name in icons]
+        if not selectors:
+            return ''
+        codepoints.add(int(match.group(2), 16))
+        return ', '.join(f'.fa-{name}:before' for name in selectors) + f' {{ content: "\\{match.group(2)}"; }}\n'
+
+    return _ICON_RULE.sub(replace, css), codepoints
+
+
+def subset_font(data, codepoints, flavor):
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        raise ImproperlyConfigured('Для STATIC_FONT_AWESOME_SUBSET нужен пакет fonttools')
+    font = TTFont(BytesIO(data))
+    options = subset.Options()
+    options.flavor = flavor
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    out = BytesIO()
+    subset.save_font(font, out, options)
+    return out.getvalue()
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    '''Хранилище статических файлов с хэшем содержимого в именах и сжатыми копиями (.gz, .br)'''
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+        if getattr(settings, 'STATIC_FONT_AWESOME_SUBSET', False):
+            self.subset_font_awesome(paths)
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception):
+                names.add(name)
+                if hashed_name:
+                    names.add(hashed_name)
+            yield name, hashed_name, processed
+        for name in sorted(names):
+            self.compress_file(name)
+
+    def compress_file(self, name):
+        if not name.lower().endswith(COMPRESS_EXTENSIONS) or not self.exists(name):
+            return
+        with self.open(name) as file:
+            data = file.read()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return
+        for suffix, content in compress(data).items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(content))
+
+    def subset_font_awesome(self, paths):
+        '''Заменяет шрифты и CSS font-awesome в STATIC_ROOT сокращенными вариантами;
+        хэши имен затем считаются по ним'''
+        icons = find_used_icons()
+        codepoints = set()
+        for css_name in FONT_AWESOME_CSS:
+            name = posixpath.join(FONT_AWESOME_DIR, css_name)
+            if name not in paths:
+                continue
+            storage, path = paths[name]
+            with storage.open(path) as file:
+                css, used = subset_css(file.read().decode('utf-8'), icons)
+            codepoints |= used
+            self._replace(paths, name, css.encode('utf-8'))
+        for font_name, flavor in FONT_AWESOME_FONTS.items():
+            name = posixpath.join(FONT_AWESOME_DIR, font_name)
+            if name not in paths:
+                continue
+            storage, path = paths[name]
+            with storage.open(path) as file:
+                self._replace(paths, name, subset_font(file.read(), codepoints, flavor))
+
+    def _replace(self, paths, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content))
+        paths[name] = (self, name)
+
+
+def accepted_encodings(request):
+    '''Кодировки из Accept-Encoding, которые браузер принимает (q > 0)'''
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+_hashed_names = None
+
+
+def is_immutable(name):
+    '''Файл с хэшем содержимого в имени (есть среди имен манифеста collectstatic)'''
+    global _hashed_names
+    if _hashed_names is None:
+        _hashed_names = frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+    return name in _hashed_names
+
+
+def serve(request, path):
+    '''Статический файл из STATIC_ROOT со сжатием и долгим кэшированием'''
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, name) if settings.STATIC_ROOT else None
+    except SuspiciousFileOperation:
+        raise Http404
+    if full_path is None or not os.path.isfile(full_path):
+        if settings.DEBUG:
+            response = staticfiles_views.serve(request, path)
+            add_never_cache_headers(response)
+            return response
+        raise Http404
+    encoding, file_path = None, full_path
+    accepted = accepted_encodings(request)
+    for coding, suffix in ENCODINGS:
+        if coding in accepted and os.path.isfile(full_path + suffix):
+            encoding, file_path = coding, full_path + suffix
+            break
+    stat = os.stat(file_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        # тип - по имени исходного файла, а не сжатой копии
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type,
+                                filename=os.path.basename(full_path))
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if is_immutable(name):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'STATIC_MAX_AGE', 60))
+    return response
@@ -0,0 +1,158 @@
+"""Хранилище файлов, адресуемое по содержимому.
+
+Файл получает имя по хэшу SHA-256 своего содержимого и раскладывается по вложенным
+папкам по первым символам хэша: ab/cd/abcd...ef.jpg. Так в одной папке не
+оказывается миллионов файлов, а одновременные выгрузки не конфликтуют по именам.
+
+Одинаковые изображения (например, одна и та же фотография в нескольких объявлениях)
+хранятся одним файлом. Количество ссылок на файл ведется в модели MediaBlob:
+save() увеличивает его, delete() (его вызывают django_cleanup и main.deletion)
+уменьшает, и файл удаляется только вместе с последней ссылкой. Повторная выгрузка
+в запись того же файла, что в ней уже есть, ссылку не добавляет (см. main.signals). Слишком большие
+изображения после выгрузки уменьшаются на месте (main.uploads.downscale_original),
+поэтому имя файла - это хэш содержимого в момент выгрузки.
+
+Файлы, сохраненные до перехода на это хранилище, в MediaBlob не записаны и
+удаляются как обычно. Перенести их помогает команда manage.py migrate_media."""
+
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def get_shard_options():
+    return getattr(settings, 'MEDIA_SHARD_DEPTH', 2), getattr(settings, 'MEDIA_SHARD_WIDTH', 2)
+
+
+def hash_content(content):
+    '''SHA-256 содержимого файла; файл читается частями'''
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def get_blob_name(digest, filename):
+    depth, width = get_shard_options()
+    extension = os.path.splitext(filename)[1].lower()
+    shards = [digest[i * width:(i + 1) * width] for i in range(depth)]
+    return posixpath.join(*shards, digest + extension)
+
+
+def is_blob_name(name):
+    '''Имя уже построено по хэшу содержимого (файл перенесен в новое хранилище)'''
+    depth, width = get_shard_options()
+    parts = name.split('/')
+    if len(parts) != depth + 1:
+        return False
+    digest = os.path.splitext(parts[-1])[0]
+    return len(digest) == 64 and all(part == digest[i * width:(i + 1) * width]
+                                      for i, part in enumerate(parts[:-1]))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        from .models import MediaBlob
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = get_blob_name(hash_content(content), self.get_valid_name(os.path.basename(name)))
+        with transaction.atomic():
+            # блокировка строки не дает двум одновременным выгрузкам записать один файл дважды
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                name=name, defaults={'size': content.size})
+            if not self.exists(name):
+                super()._save(name, content)
+            MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+        return name
+
+    def delete(self, name):
+        from .models import MediaBlob
+        if not name:
+            return
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                if blob.refcount > 1:
+                    MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                    return
+                blob.delete()
+            transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        from .models import MediaBlob
+        # пока удалялась запись, этот же файл мог быть выгружен снова
+        if not MediaBlob.objects.filter(name=name).exists():
+            super().delete(name)
+
+
+def get_file_fields():
+    '''Поля моделей, файлы которых хранятся в хранилище по умолчанию'''
+    from .models import Ad, AdditionalImage
+    return [(Ad, 'image'), (AdditionalImage, 'image')]
+
+
+def count_references():
+    '''Количество ссылок на каждый файл по данным моделей'''
+    references = {}
+    for model, field in get_file_fields():
+        rows = model.objects.exclude(**{field: ''}).values(field).annotate(n=Count('pk')).values_list(field, 'n')
+        for name, count in rows.iterator():
+            references[name] = references.get(name, 0) + count
+    return references
+
+
+def migrate_file(storage, name, references):
+    '''Переносит файл name, сохраненный до перехода на хранилище по хэшу: сохраняет его
+    под новым именем, заменяет имя во всех записях и удаляет старый файл.
+    Возвращает новое имя'''
+    from .models import Ad, MediaBlob
+    with transaction.atomic():
+        with storage.open(name, 'rb') as content:
+            new_name = storage.save(name, content)
+        if references > 1:
+            MediaBlob.objects.filter(name=new_name).update(refcount=F('refcount') + references - 1)
+        for model, field in get_file_fields():
+            values = {field: new_name}
+            if model is Ad:
+                # auto_now при update() не срабатывает, а изображение выгружается (main/export.py)
+                values['updated_at'] = timezone.now()
+            # update() не отправляет сигналов, так что django_cleanup не удаляет файлы
+            model.objects.filter(**{field: name}).update(**values)
+        storage.delete(name)
+    return new_name
+
+
+def recount_blobs(storage):
+    '''Пересчитывает количество ссылок на файлы и удаляет файлы, на которые ничего не
+    ссылается (например, оставшиеся после отката транзакции). Возвращает
+    (исправлено записей, удалено файлов)'''
+    from .models import MediaBlob
+    references = count_references()
+    fixed = removed = 0
+    for blob in MediaBlob.objects.iterator():
+        count = references.get(blob.name, 0)
+        if count == blob.refcount:
+            continue
+        if count:
+            MediaBlob.objects.filter(pk=blob.pk).update(refcount=count)
+            fixed += 1
+        else:
+            blob.delete()
+            storage.delete(blob.name)
+            removed += 1
+    return fixed, removed
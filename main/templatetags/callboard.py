@@ -0,0 +1,30 @@
+from django import template
+
+from easy_thumbnails.alias import aliases
+
+from main.caching import ad_key, get_versions
+from main.metrics import phase
+from main.thumbnails import get_variant_url
+
+register = template.Library()
+
+
+@register.filter
+def ad_version(ad):
+    '''Версия объявления для ключа кэшированного фрагмента: {% cache 600 ad_card ad.pk ad|ad_version %}'''
+    return get_versions(ad_key(ad.pk))[0]
+
+
+@register.inclusion_tag('layout/picture.html')
+def picture(fieldfile, alias, css_class=''):
+    '''Выводит готовую миниатюру изображения, не создавая ее: {% picture ad.image 'default' 'mr-3' %}'''
+    size = (aliases.get(alias) or {}).get('size', (0, 0))
+    with phase('thumbnails'):
+        return {
+            'url': get_variant_url(fieldfile, alias),
+            'webp_url': get_variant_url(fieldfile, alias, 'webp'),
+            'original': fieldfile.url if fieldfile else '',
+            'width': size[0],
+            'height': size[1],
+            'css_class': css_class,
+        }
@@ -0,0 +1,69 @@
+"""Вспомогательные средства для тестов: проверка "бюджета" SQL-запросов на страницу
+и отсутствия повторяющихся (N+1) запросов (см. query_detector.py).
+
+Пример:
+    class IndexTests(QueryBudgetMixin, TestCase):
+        def test_index(self):
+            self.assertPageQueryBudget('/', 4)
+            self.assertNoRepeatedQueries('/')
+
+Чтобы все запросы тестового клиента проверялись посредником QueryDetectorMiddleware,
+в настройках тестов задаются QUERY_DETECTOR = True, QUERY_DETECTOR_STRICT = True
+и, при необходимости, бюджеты контроллеров QUERY_BUDGETS = {'main:index': 4}.
+"""
+
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from .query_detector import QueryDetector, QueryProblemsDetected, format_problems
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(budget, using='default'):
+    '''Контекстный менеджер: падает с перечнем запросов, если внутри блока
+    выполнено больше budget SQL-запросов'''
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    executed = len(context.captured_queries)
+    if executed > budget:
+        queries = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1))
+        raise QueryBudgetExceeded(f'Выполнено {executed} запросов при бюджете {budget}:\n{queries}')
+
+
+@contextmanager
+def detect_queries(repeat=None, slow_ms=None, using='default'):
+    '''Контекстный менеджер: падает с местами вызова, если внутри блока выполнены
+    repeat и больше запросов одинаковой формы из одного места или медленные запросы'''
+    detector = QueryDetector(repeat, slow_ms)
+    with connections[using].execute_wrapper(detector):
+        yield detector
+    problems = detector.problems()
+    if problems:
+        raise QueryProblemsDetected(format_problems(problems, f'Выполнено {len(detector.queries)} запросов'))
+
+
+class QueryBudgetMixin:
+    '''Примесь к django.test.TestCase'''
+
+    def assertQueryBudget(self, budget, func, *args, using='default', **kwargs):
+        with query_budget(budget, using=using):
+            return func(*args, **kwargs)
+
+    def assertPageQueryBudget(self, url, budget, method='get', data=None, using='default', **extra):
+        '''Запрашивает страницу тестовым клиентом и проверяет число запросов.
+        Количество запросов не должно зависеть от числа записей на странице'''
+        with query_budget(budget, using=using):
+            response = getattr(self.client, method)(url, data, **extra)
+        return response
+
+    def assertNoRepeatedQueries(self, url, method='get', data=None, repeat=None, using='default', **extra):
+        '''Запрашивает страницу и проверяет, что в ней нет запросов N+1 и медленных запросов'''
+        with detect_queries(repeat, using=using):
+            response = getattr(self.client, method)(url, data, **extra)
+        return response
@@ -0,0 +1,108 @@
+import json
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from main.deletion import file_remover, remove_files
+from main.models import Ad, Comment, MediaBlob
+
+from .utils import DataMixin, TempMediaMixin, make_image
+
+
+@override_settings(THUMBNAIL_PREGENERATE=False)
+class BatchTests(DataMixin, TempMediaMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(self.alice)
+        # файлы удаляются в этом же потоке: фоновый поток не видит данных транзакции теста
+        patcher = mock.patch.object(file_remover, 'put_many', remove_files)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def batch(self, operations, **files):
+        return self.client.post('/batch', {'operations': json.dumps(operations), **files})
+
+    def test_replaced_image_is_released(self):
+        ad = self.create_ad(self.alice, 'С фото', image=make_image())
+        old_name = ad.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.batch([{'action': 'update', 'type': 'ad', 'id': ad.pk, 'data': {'image': 'photo'}}],
+                                  photo=make_image('blue'))
+        self.assertEqual(response.status_code, 200, response.content)
+        ad.refresh_from_db()
+        self.assertNotEqual(ad.image.name, old_name)
+        self.assertFalse(MediaBlob.objects.filter(name=old_name).exists())
+        self.assertEqual(MediaBlob.objects.get(name=ad.image.name).refcount, 1)
+
+    def test_same_image_keeps_one_reference(self):
+        ad = self.create_ad(self.alice, 'С фото', image=make_image())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.batch([{'action': 'update', 'type': 'ad', 'id': ad.pk, 'data': {'image': 'photo'}}],
+                                  photo=make_image())
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(MediaBlob.objects.get(name=Ad.objects.get(pk=ad.pk).image.name).refcount, 1)
+
+
+class PermissionTests(DataMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(self.bob)
+
+    def patch(self, url, data):
+        return self.client.patch(url, json.dumps(data), content_type='application/json')
+
+    def test_guest_cannot_write(self):
+        self.client.logout()
+        self.assertIn(self.client.post('/comments/', {'ad': self.ad_a.pk, 'content': 'Привет'}).status_code,
+                      (401, 403))
+        self.assertIn(self.patch(f'/ads/{self.ad_a.pk}/', {'title': 'Чужое'}).status_code, (401, 403))
+        self.assertEqual(self.client.get(f'/ads/{self.ad_a.pk}/').status_code, 200)
+
+    def test_only_author_edits_ad(self):
+        self.assertEqual(self.patch(f'/ads/{self.ad_a.pk}/', {'title': 'Чужое'}).status_code, 403)
+        self.assertEqual(self.client.post(f'/ads/{self.ad_a.pk}/deactivate').status_code, 403)
+        self.assertEqual(self.patch(f'/ads/{self.ad_b.pk}/', {'title': 'Свое'}).status_code, 200)
+        self.assertEqual(Ad.objects.get(pk=self.ad_a.pk).title, 'Продам велосипед')
+
+    def test_comment_author_is_taken_from_user(self):
+        response = self.client.post('/comments/', {'ad': self.ad_a.pk, 'content': 'Привет', 'author': 'alice'})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Comment.objects.get(pk=response.json()['id']).author, 'bob')
+
+    def test_comment_on_inactive_ad(self):
+        Ad.objects.filter(pk=self.ad_a.pk).update(is_active=False)
+        response = self.client.post('/comments/', {'ad': self.ad_a.pk, 'content': 'Привет'})
+        self.assertEqual(response.status_code, 400)
+        self.client.force_login(self.alice)
+        response = self.client.post('/comments/', {'ad': self.ad_a.pk, 'content': 'Привет'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_comment_cannot_be_moved(self):
+        comment = self.create_comment(self.ad_b, author='guest')
+        response = self.patch(f'/comments/{comment.pk}/',
+                              {'ad': self.ad_a.pk, 'author': 'alice', 'content': 'Новый'})
+        self.assertEqual(response.status_code, 200, response.content)
+        comment.refresh_from_db()
+        self.assertEqual((comment.ad_id, comment.author, comment.content), (self.ad_b.pk, 'guest', 'Новый'))
+
+    def test_only_ad_author_edits_comments(self):
+        comment = self.create_comment(self.ad_a)
+        self.assertEqual(self.patch(f'/comments/{comment.pk}/', {'content': 'Чужой'}).status_code, 403)
+        self.assertEqual(self.client.post(f'/comments/{comment.pk}/deactivate').status_code, 403)
+
+    def test_batch_rejects_foreign_ads(self):
+        response = self.client.post('/batch', json.dumps({'operations': [
+            {'action': 'update', 'type': 'ad', 'id': self.ad_b.pk, 'data': {'title': 'Свое'}},
+            {'action': 'update', 'type': 'ad', 'id': self.ad_a.pk, 'data': {'title': 'Чужое'}},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(Ad.objects.get(pk=self.ad_b.pk).title, 'Продам машину')
+
+    def test_batch_comment_author(self):
+        response = self.client.post('/batch', json.dumps({'operations': [
+            {'action': 'create', 'type': 'comment', 'data': {'ad': self.ad_a.pk, 'content': 'Привет',
+                                                             'author': 'alice'}},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Comment.objects.get(pk=response.json()['results'][0]['id']).author, 'bob')
@@ -0,0 +1,25 @@
+from django.test import TestCase
+
+from main.bulk import bulk_insert, create_comments
+from main.models import Comment
+
+from .utils import DataMixin
+
+
+class BulkInsertTests(DataMixin, TestCase):
+
+    def test_keys_match_inserted_rows(self):
+        '''ключи, полученные после bulk_create, указывают на записи тех же объектов'''
+        self.create_comment(self.ad_b, content='Раньше')
+        comments = [Comment(ad=self.ad_a, author='guest', content='Комментарий %d' % i) for i in range(5)]
+        create_comments(comments, batch_size=2)
+        for comment in comments:
+            self.assertEqual(Comment.objects.get(pk=comment.pk).content, comment.content)
+            self.assertFalse(comment._state.adding)
+
+    def test_given_keys_are_kept(self):
+        given = Comment(pk=1000, ad=self.ad_a, author='guest', content='С ключом')
+        new = Comment(ad=self.ad_a, author='guest', content='Без ключа')
+        bulk_insert(Comment, [new, given])
+        self.assertEqual(given.pk, 1000)
+        self.assertEqual(Comment.objects.get(pk=new.pk).content, 'Без ключа')
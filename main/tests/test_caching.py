@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from main import caching
+
+from .utils import DataMixin
+
+
+class PageCacheVersionTests(DataMixin, TestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+
+    def versions(self, *names):
+        return caching.get_versions(*names)
+
+    def test_versions_change_after_commit(self):
+        '''пока транзакция не зафиксирована, параллельные запросы видят старые записи,
+        поэтому версии меняются только после фиксации'''
+        names = (caching.ALL_ADS, caching.ad_key(self.ad_a.pk), caching.rubric_key(self.rubric.pk))
+        before = self.versions(*names)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.ad_a.title = 'Продам велосипед недорого'
+            self.ad_a.save()
+            self.create_comment(self.ad_a)
+            self.rubric.name = 'Легковые автомобили'
+            self.rubric.save()
+            self.assertEqual(self.versions(*names), before)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        after = self.versions(*names)
+        self.assertTrue(all(new > old for new, old in zip(after, before)))
+
+    def test_cached_page_is_replaced_after_change(self):
+        self.assertContains(self.client.get('/'), 'Продам велосипед')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_ad(self.bob, 'Продам лодку')
+        self.assertContains(self.client.get('/'), 'Продам лодку')
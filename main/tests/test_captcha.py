@@ -0,0 +1,59 @@
+import datetime
+import os
+
+from captcha.models import CaptchaStore
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from main import captcha_pool
+from main.caching import get_cache
+
+from .utils import TempMediaMixin
+
+
+class CaptchaPoolTests(TempMediaMixin, TestCase):
+
+    def setUp(self):
+        self.override = override_settings(CAPTCHA_POOL_DIR=os.path.join(self.media_root, self._testMethodName))
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+        get_cache().clear()
+        captcha_pool.reset()
+
+    def expire(self, keys):
+        CaptchaStore.objects.filter(hashkey__in=keys) \
+            .update(expiration=timezone.now() - datetime.timedelta(minutes=1))
+
+    def test_refill(self):
+        created, rows, files = captcha_pool.refill(size=5, batch_size=2)
+        self.assertEqual((created, rows, files), (5, 0, 0))
+        keys = list(CaptchaStore.objects.values_list('hashkey', flat=True))
+        self.assertTrue(os.path.exists(captcha_pool.image_path(keys[0])))
+        self.assertIn(captcha_pool.pick(), keys)
+        self.expire(keys[:2])
+        self.assertEqual(captcha_pool.refill(size=5)[1:], (2, 2 * len(captcha_pool._scales())))
+        self.assertFalse(os.path.exists(captcha_pool.image_path(keys[0])))
+
+    def test_used_key_is_not_picked(self):
+        key, = captcha_pool.create(1)
+        captcha_pool.mark_used(key)
+        self.assertNotEqual(captcha_pool.pick(), key)
+
+    def test_fallback_rows_are_purged_without_command(self):
+        '''без команды просроченные капчи, созданные по одной, удаляются при отрисовке формы,
+        но не чаще раза в CAPTCHA_POOL_PURGE_INTERVAL секунд'''
+        stale = captcha_pool.pick()
+        self.expire([stale])
+        get_cache().clear()
+        fresh = captcha_pool.pick()
+        self.assertFalse(CaptchaStore.objects.filter(hashkey=stale).exists())
+        self.expire([fresh])
+        captcha_pool.pick()
+        self.assertTrue(CaptchaStore.objects.filter(hashkey=fresh).exists())
+
+    def test_no_purge_while_command_runs(self):
+        captcha_pool.refill(size=1)
+        key = CaptchaStore.generate_key()
+        self.expire([key])
+        captcha_pool.pick()
+        self.assertTrue(CaptchaStore.objects.filter(hashkey=key).exists())
@@ -0,0 +1,79 @@
+from django.test import TestCase, override_settings
+
+from main import caching
+from main.counters import reconcile_comment_counts, reconcile_rubric_counts
+from main.models import Ad, Comment, Rubric
+from main.rubric_tree import COUNTS_KEY, get_rubric_counts
+
+from .utils import DataMixin
+
+
+class CounterTests(DataMixin, TestCase):
+
+    def assertCounts(self, rubric_count, super_count):
+        self.assertEqual(Rubric.objects.get(pk=self.rubric.pk).ad_count, rubric_count)
+        self.assertEqual(Rubric.objects.get(pk=self.super_rubric.pk).ad_count, super_count)
+
+    def test_ad_counts(self):
+        self.assertCounts(2, 2)
+        ad = self.create_ad(self.alice, 'Продам лодку')
+        self.assertCounts(3, 3)
+        ad.is_active = False
+        ad.save()
+        self.assertCounts(2, 2)
+        self.ad_a.delete()
+        self.assertCounts(1, 1)
+        self.assertEqual(reconcile_rubric_counts(), [])
+
+    def test_comment_counts(self):
+        comment = self.create_comment(self.ad_a)
+        self.create_comment(self.ad_a, is_active=False)
+        self.assertEqual(Ad.objects.get(pk=self.ad_a.pk).comment_count, 1)
+        comment.is_active = False
+        comment.save()
+        self.assertEqual(Ad.objects.get(pk=self.ad_a.pk).comment_count, 0)
+        self.assertEqual(reconcile_comment_counts(), 0)
+
+    def test_comment_moved_to_other_ad(self):
+        comment = self.create_comment(self.ad_a)
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.ad = self.ad_b
+        comment.save()
+        self.assertEqual(Ad.objects.get(pk=self.ad_a.pk).comment_count, 0)
+        self.assertEqual(Ad.objects.get(pk=self.ad_b.pk).comment_count, 1)
+        self.assertEqual(reconcile_comment_counts(), 0)
+
+    def test_stored_counters_are_not_overwritten(self):
+        '''объект, загруженный до изменения счетчика, не затирает его при сохранении'''
+        stale = Ad.objects.get(pk=self.ad_a.pk)
+        self.create_comment(self.ad_a)
+        stale.title = 'Продам велосипед недорого'
+        stale.save()
+        self.assertEqual(Ad.objects.get(pk=self.ad_a.pk).comment_count, 1)
+
+
+@override_settings(RUBRIC_COUNTS_TIMEOUT=60)
+class SidebarCountsTests(DataMixin, TestCase):
+
+    def setUp(self):
+        caching.get_cache().clear()
+
+    def test_ad_changes_do_not_invalidate_sidebar(self):
+        '''изменение объявления не меняет версию боковой панели, от которой зависят
+        все кэшированные страницы; счетчики перечитываются по истечении срока'''
+        sidebar_version = caching.get_versions(caching.SIDEBAR)
+        counted_at, counts = get_rubric_counts()
+        self.assertEqual(counts[self.rubric.pk], 2)
+        self.create_ad(self.alice, 'Продам лодку')
+        self.assertEqual(caching.get_versions(caching.SIDEBAR), sidebar_version)
+        self.assertEqual(get_rubric_counts(), (counted_at, counts))
+        caching.get_cache().delete(COUNTS_KEY)
+        self.assertEqual(get_rubric_counts()[1][self.rubric.pk], 3)
+        self.assertEqual(get_rubric_counts()[1][self.super_rubric.pk], 3)
+
+    def test_sidebar_renders_counts(self):
+        response = self.client.get('/')
+        self.assertContains(response, self.rubric.name)
+        self.assertContains(response, '<span class="badge bg-secondary">2</span>', count=2)
+        with self.assertNumQueries(0):
+            get_rubric_counts()
@@ -0,0 +1,32 @@
+from django.db import connection
+from django.test import TestCase
+
+from main.deletion import delete_ads, delete_users, file_remover
+from main.models import Ad, AdvUser, Comment, CommentEvent
+from .utils import DataMixin
+
+
+class DeletionTests(DataMixin, TestCase):
+    def test_delete_ads_with_pending_digest_events(self):
+        comment = self.create_comment(self.ad_a)
+        self.assertTrue(CommentEvent.objects.filter(comment=comment).exists())
+        self.assertEqual(delete_ads(Ad.objects.filter(pk=self.ad_a.pk)), 1)
+        connection.check_constraints()
+        self.assertFalse(Comment.objects.filter(pk=comment.pk).exists())
+        self.assertFalse(CommentEvent.objects.exists())
+        self.assertTrue(Ad.objects.filter(pk=self.ad_b.pk).exists())
+
+    def test_delete_users_with_ads_and_comments(self):
+        self.create_comment(self.ad_a)
+        self.create_comment(self.ad_b)
+        delete_users(AdvUser.objects.filter(pk=self.alice.pk))
+        connection.check_constraints()
+        self.assertFalse(Ad.objects.filter(author_id=self.alice.pk).exists())
+        self.assertEqual(list(Comment.objects.values_list('ad', flat=True)), [self.ad_b.pk])
+        self.assertEqual(CommentEvent.objects.count(), 1)
+
+    def test_delete_nothing(self):
+        self.assertEqual(delete_ads(Ad.objects.none()), 0)
+
+    def tearDown(self):
+        file_remover.flush()
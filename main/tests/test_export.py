@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from main.export import prepare_export
+from main.models import Ad, AdvUser
+from main.storage import migrate_file
+
+from .utils import DataMixin, TempMediaMixin
+
+
+def age(ads, seconds):
+    Ad.objects.filter(pk__in=[ad.pk for ad in ads]).update(updated_at=timezone.now() - timedelta(seconds=seconds))
+
+
+@override_settings(EXPORT_WATERMARK_LAG=60)
+class ExportWatermarkTests(DataMixin, TestCase):
+
+    def export(self, since=None):
+        queryset, watermark = prepare_export(Ad.objects.all(), since)
+        return list(queryset.values_list('pk', flat=True)), watermark
+
+    def test_recent_changes_are_deferred(self):
+        '''изменение, сделанное меньше EXPORT_WATERMARK_LAG секунд назад, могло принадлежать
+        еще не зафиксированной транзакции и выгружается в следующий раз'''
+        age([self.ad_a], 120)
+        pks, watermark = self.export()
+        self.assertEqual(pks, [self.ad_a.pk])
+        age([self.ad_b], 90)
+        pks, watermark = self.export(watermark)
+        self.assertEqual(pks, [self.ad_b.pk])
+        self.assertEqual(self.export(watermark), ([], watermark))
+
+    def test_nothing_to_export(self):
+        self.assertEqual(self.export(), ([], None))
+
+
+@override_settings(EXPORT_WATERMARK_LAG=0, THUMBNAIL_PREGENERATE=False)
+class MigrateFileTests(DataMixin, TempMediaMixin, TestCase):
+
+    def test_migrated_image_is_exported_again(self):
+        name = 'old/photo.png'
+        default_storage._save(name, ContentFile(b'old image'))
+        Ad.objects.filter(pk=self.ad_a.pk).update(image=name)
+        age([self.ad_a, self.ad_b], 120)
+        _, watermark = prepare_export(Ad.objects.all())
+        new_name = migrate_file(default_storage, name, 1)
+        queryset, _ = prepare_export(Ad.objects.all(), watermark)
+        self.assertEqual(list(queryset.values_list('pk', 'image')), [(self.ad_a.pk, new_name)])
+
+
+@override_settings(EXPORT_WATERMARK_LAG=0)
+class ExportApiTests(DataMixin, TestCase):
+
+    def test_only_staff_exports(self):
+        self.assertIn(self.client.get('/ads/export').status_code, (401, 403))
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get('/ads/export').status_code, 403)
+        admin = AdvUser.objects.create_user('admin', 'admin@example.com', 'admin-password', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get('/ads/export?fields=id,title')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
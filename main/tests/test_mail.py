@@ -0,0 +1,90 @@
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+
+from main.mail import ACTIVATION, enqueue_mail, send_queued_mail
+from main.models import OutgoingMail
+
+from .utils import DataMixin
+
+
+class FlakyBackend(EmailBackend):
+    '''Почтовый бэкенд, который не отправляет письма на адреса из fail_to
+    и не подключается, пока down; при down_after_error сервер отключается после ошибки'''
+    fail_to = set()
+    down = False
+    down_after_error = False
+
+    def open(self):
+        if FlakyBackend.down:
+            raise ConnectionRefusedError('SMTP-сервер недоступен')
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & FlakyBackend.fail_to:
+                FlakyBackend.down = FlakyBackend.down_after_error
+                raise OSError('Соединение разорвано')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='main.tests.test_mail.FlakyBackend', MAIL_QUEUE_MAX_ATTEMPTS=3)
+class MailQueueTests(DataMixin, TestCase):
+
+    def setUp(self):
+        FlakyBackend.fail_to = set()
+        FlakyBackend.down = FlakyBackend.down_after_error = False
+
+    def test_sends_pending_mail(self):
+        queued = [enqueue_mail(ACTIVATION, user) for user in (self.alice, self.bob)]
+        self.assertEqual(send_queued_mail(), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        for item in queued:
+            item.refresh_from_db()
+            self.assertEqual(item.status, OutgoingMail.SENT)
+            self.assertEqual(item.attempts, 1)
+            self.assertIsNotNone(item.sent_at)
+        self.assertEqual(send_queued_mail(), (0, 0))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_mail_is_retried_later(self):
+        FlakyBackend.fail_to = {self.alice.email}
+        failing = enqueue_mail(ACTIVATION, self.alice)
+        self.assertEqual(send_queued_mail(), (0, 1))
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutgoingMail.PENDING)
+        self.assertEqual(failing.attempts, 1)
+        self.assertIn('Соединение разорвано', failing.last_error)
+        # до истечения паузы письмо не отправляется повторно
+        self.assertEqual(send_queued_mail(), (0, 0))
+
+    def test_server_down(self):
+        queued = enqueue_mail(ACTIVATION, self.alice)
+        FlakyBackend.down = True
+        self.assertEqual(send_queued_mail(), (0, 0))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutgoingMail.PENDING)
+        self.assertEqual(queued.attempts, 0)
+
+    def test_reconnect_failure_keeps_results(self):
+        '''Если после ошибки не удалось переподключиться, уже отправленные письма
+        не отправляются повторно, попытки не теряются, а остальные письма остаются в очереди'''
+        FlakyBackend.fail_to = {self.bob.email}
+        FlakyBackend.down_after_error = True
+        first = enqueue_mail(ACTIVATION, self.alice)
+        failing = enqueue_mail(ACTIVATION, self.bob)
+        last = enqueue_mail(ACTIVATION, self.alice)
+        self.assertEqual(send_queued_mail(), (1, 1))
+        for item in (first, failing, last):
+            item.refresh_from_db()
+        self.assertEqual(first.status, OutgoingMail.SENT)
+        self.assertEqual(failing.attempts, 1)
+        self.assertEqual(last.status, OutgoingMail.PENDING)
+        self.assertEqual(last.attempts, 0)
+
+        FlakyBackend.down = False
+        FlakyBackend.fail_to = set()
+        self.assertEqual(send_queued_mail(), (1, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        last.refresh_from_db()
+        self.assertEqual(last.status, OutgoingMail.SENT)
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from main.models import CommentEvent, OutgoingMail
+from main.notifications import COMMENT_DIGEST, collect_digests
+
+from .utils import DataMixin
+
+
+@override_settings(COMMENT_DIGEST_WINDOW=60)
+class CommentDigestTests(DataMixin, TestCase):
+
+    def age_events(self):
+        CommentEvent.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+
+    def test_events_become_one_digest(self):
+        first = self.create_comment(self.ad_a)
+        second = self.create_comment(self.ad_a)
+        self.assertEqual(collect_digests(), (0, 0))
+        self.age_events()
+        self.assertEqual(collect_digests(), (1, 1))
+        mail = OutgoingMail.objects.get()
+        self.assertEqual((mail.kind, mail.user), (COMMENT_DIGEST, self.alice))
+        self.assertEqual(mail.payload['comments'], [first.pk, second.pk])
+        self.assertFalse(CommentEvent.objects.exists())
+
+    def test_event_added_during_collection_is_kept(self):
+        '''событие, добавленное между чтением и удалением, не удаляется без письма'''
+        self.create_comment(self.ad_a)
+        self.age_events()
+        late = []
+        bulk_create = QuerySet.bulk_create
+
+        def bulk_create_and_comment(queryset, objs, *args, **kwargs):
+            if queryset.model is OutgoingMail:
+                late.append(self.create_comment(self.ad_a))
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', bulk_create_and_comment):
+            self.assertEqual(collect_digests(), (1, 1))
+        self.assertEqual(list(CommentEvent.objects.values_list('comment', flat=True)), [late[0].pk])
+        self.assertNotIn(late[0].pk, OutgoingMail.objects.get().payload['comments'])
@@ -0,0 +1,75 @@
+from django.test import TestCase
+
+from main.caching import get_cache
+from main.models import Ad, AdditionalImage
+from main.query_detector import QueryProblemsDetected
+from main.rubric_tree import invalidate_rubric_tree
+from main.testing import QueryBudgetExceeded, QueryBudgetMixin, detect_queries, query_budget
+
+from .utils import DataMixin
+
+
+class QueryHelpersTests(DataMixin, TestCase):
+
+    def test_query_budget(self):
+        with query_budget(1):
+            list(Ad.objects.all())
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'Выполнено 2 запросов при бюджете 1'):
+            with query_budget(1):
+                list(Ad.objects.all())
+                list(Ad.objects.all())
+
+    def test_detect_repeated_queries(self):
+        for index in range(5):
+            self.create_ad(self.bob, f'Объявление {index}')
+        with detect_queries(repeat=3):
+            list(Ad.objects.select_related('rubric'))
+        with self.assertRaises(QueryProblemsDetected):
+            with detect_queries(repeat=3):
+                for ad in Ad.objects.all():
+                    ad.rubric.name
+
+
+class PageQueryTests(DataMixin, QueryBudgetMixin, TestCase):
+    '''Количество запросов страниц не зависит от числа объявлений, иллюстраций и комментариев.
+    Кэши сбрасываются: в бюджет входят чтение дерева рубрик и счетчиков боковой панели'''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for index in range(10):
+            ad = cls.create_ad(cls.alice, f'Объявление {index}')
+            cls.create_comment(ad)
+        for index in range(5):
+            cls.create_comment(cls.ad_a, content=f'Комментарий {index}')
+            AdditionalImage.objects.create(ad=cls.ad_a, image=f'old/photo{index}.png')
+
+    def setUp(self):
+        get_cache().clear()
+        invalidate_rubric_tree()
+
+    def test_guest_pages(self):
+        self.assertPageQueryBudget('/', 3)
+        self.assertPageQueryBudget(f'/{self.rubric.pk}/', 4)
+        self.assertPageQueryBudget(f'/{self.rubric.pk}/{self.ad_a.pk}/', 9)
+
+    def test_user_pages(self):
+        self.client.force_login(self.alice)
+        self.assertPageQueryBudget('/', 5)
+        self.assertPageQueryBudget(f'/{self.rubric.pk}/{self.ad_a.pk}/', 7)
+
+    def test_api(self):
+        self.assertPageQueryBudget('/ads/all', 1)
+        self.assertPageQueryBudget(f'/ads/{self.ad_a.pk}/', 1)
+        self.assertPageQueryBudget(f'/ads/{self.ad_a.pk}/comments/', 1)
+        self.assertPageQueryBudget('/rubrics/', 1)
+
+    def test_no_repeated_queries(self):
+        for url in ('/', f'/{self.rubric.pk}/', f'/{self.rubric.pk}/{self.ad_a.pk}/', '/ads/all',
+                    f'/ads/{self.ad_a.pk}/comments/'):
+            response = self.assertNoRepeatedQueries(url, repeat=3)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_cached_guest_page(self):
+        self.client.get('/')
+        self.assertPageQueryBudget('/', 0)
@@ -0,0 +1,82 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.sessions import SessionStore, session_writer, write_sessions
+
+
+class SessionStoreTests(TransactionTestCase):
+    '''Запись в базу идет фоновым потоком, поэтому данные теста фиксируются (TransactionTestCase)'''
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        override = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'sessions': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                 'LOCATION': cache_dir}},
+            SESSION_CACHE_ALIAS='sessions')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def create_session(self):
+        session = SessionStore()
+        session['user'] = 'alice'
+        session.save(must_create=True)
+        session_writer.flush()
+        return session.session_key
+
+    def test_local_memory_cache_is_rejected(self):
+        with override_settings(SESSION_CACHE_ALIAS='default'):
+            with self.assertRaises(ImproperlyConfigured):
+                SessionStore()
+
+    def test_session_is_read_from_cache(self):
+        key = self.create_session()
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(SessionStore(key)['user'], 'alice')
+        self.assertEqual(context.captured_queries, [])
+
+    def test_session_is_read_from_database_after_cache_miss(self):
+        key = self.create_session()
+        SessionStore(key)._cache.clear()
+        self.assertEqual(SessionStore(key)['user'], 'alice')
+
+    def test_delete_is_written_at_once(self):
+        '''удаление записывается в базу сразу, и изменения из очереди не возвращают сессию'''
+        key = self.create_session()
+        session = SessionStore(key)
+        queued = []
+        # очередь записывается здесь же, после удаления, - как если бы фоновый поток отстал
+        with mock.patch.object(session_writer, 'put', queued.append):
+            session['user'] = 'bob'
+            session.save()
+            session.delete()
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        write_sessions(queued)
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        self.assertFalse(SessionStore(key).exists(key))
+
+    def test_changes_of_existing_session(self):
+        key = self.create_session()
+        session = SessionStore(key)
+        session['user'] = 'bob'
+        session.save()
+        session_writer.flush()
+        self.assertEqual(SessionStore().decode(Session.objects.get(session_key=key).session_data)['user'], 'bob')
+
+    def test_clear_expired(self):
+        key = self.create_session()
+        Session.objects.create(session_key='e' * 32, session_data='',
+                               expire_date=timezone.now() - timedelta(days=1))
+        self.assertEqual(SessionStore.clear_expired(batch_size=1), 1)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [key])
@@ -0,0 +1,66 @@
+import importlib.util
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.test import SimpleTestCase, TestCase
+
+from main import replicas
+from main.models import Ad
+
+from .utils import DataMixin
+
+ENVIRONMENT = ('CALLBOARD_DB', 'CALLBOARD_SQLITE_REPLICA', 'CALLBOARD_DB_REPLICAS', 'CALLBOARD_STATIC_MANIFEST',
+               'CALLBOARD_CACHE')
+
+
+def load_settings(**environ):
+    '''Заново выполняет callboard/settings.py с переменными окружения environ'''
+    clean = {key: value for key, value in os.environ.items() if key not in ENVIRONMENT}
+    spec = importlib.util.find_spec(settings.SETTINGS_MODULE)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, {**clean, **environ}, clear=True):
+        spec.loader.exec_module(module)
+    return module
+
+
+class SettingsTests(SimpleTestCase):
+
+    def test_sqlite_replica_is_opt_in(self):
+        module = load_settings(CALLBOARD_DB='sqlite')
+        self.assertEqual(list(module.DATABASES), ['default'])
+        self.assertEqual(module.REPLICA_DATABASES, [])
+        module = load_settings(CALLBOARD_DB='sqlite', CALLBOARD_SQLITE_REPLICA='1')
+        self.assertEqual(module.REPLICA_DATABASES, ['replica'])
+        self.assertEqual(module.DATABASES['replica']['TEST'], {'MIRROR': 'default'})
+
+    def test_manifest_storage_is_opt_in(self):
+        module = load_settings()
+        self.assertFalse(hasattr(module, 'STATICFILES_STORAGE'))
+        module = load_settings(CALLBOARD_STATIC_MANIFEST='1')
+        self.assertEqual(module.STATICFILES_STORAGE, 'main.staticfiles.CompressedManifestStaticFilesStorage')
+
+    def test_cached_sessions_need_shared_cache(self):
+        self.assertEqual(load_settings().SESSION_ENGINE, 'django.contrib.sessions.backends.db')
+        self.assertEqual(load_settings(CALLBOARD_CACHE='file').SESSION_ENGINE, 'main.sessions')
+
+
+class ReplicaRouterTests(DataMixin, TestCase):
+
+    def test_mirror_is_read_through_default(self):
+        '''реплика-зеркало (TEST MIRROR) читается через основное подключение, которое видит
+        данные незавершенной транзакции теста'''
+        self.assertTrue(replicas.is_mirror(DEFAULT_DB_ALIAS))
+        token = replicas.use_replica(DEFAULT_DB_ALIAS)
+        try:
+            self.assertEqual(replicas.ReplicaRouter().db_for_read(Ad), DEFAULT_DB_ALIAS)
+            self.assertEqual(Ad.objects.count(), 2)
+        finally:
+            replicas.reset_replica(token)
+
+    def test_page_with_replicas_configured(self):
+        with self.settings(REPLICA_DATABASES=[DEFAULT_DB_ALIAS]):
+            self.assertIsNone(replicas.choose_replica())
+            response = self.client.get('/')
+        self.assertContains(response, self.ad_a.title)
@@ -0,0 +1,41 @@
+from django.test import TestCase, override_settings
+
+from main.models import Ad, MediaBlob
+from main.storage import count_references
+
+from .utils import DataMixin, TempMediaMixin, make_image
+
+
+@override_settings(THUMBNAIL_PREGENERATE=False)
+class ContentAddressedStorageTests(DataMixin, TempMediaMixin, TestCase):
+
+    def assertRefcounts(self):
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'refcount')), count_references())
+
+    def test_identical_files_are_stored_once(self):
+        first = self.create_ad(self.alice, 'Первое', image=make_image())
+        second = self.create_ad(self.bob, 'Второе', image=make_image())
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+        self.assertRefcounts()
+
+    def test_reupload_to_same_record(self):
+        '''повторная выгрузка того же файла в ту же запись не добавляет ссылку'''
+        ad = self.create_ad(self.alice, 'Первое', image=make_image())
+        ad = Ad.objects.get(pk=ad.pk)
+        ad.image = make_image()
+        ad.save()
+        ad.image = make_image()
+        ad.save()
+        self.assertEqual(MediaBlob.objects.get().refcount, 1)
+        self.assertRefcounts()
+
+    def test_replaced_file_is_released(self):
+        ad = self.create_ad(self.alice, 'Первое', image=make_image())
+        ad = Ad.objects.get(pk=ad.pk)
+        old_name = ad.image.name
+        ad.image = make_image('blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            ad.save()
+        self.assertFalse(MediaBlob.objects.filter(name=old_name).exists())
+        self.assertRefcounts()
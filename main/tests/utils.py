@@ -0,0 +1,63 @@
+"""Общие данные для тестов. Тесты запускаются на SQLite:
+
+    CALLBOARD_DB=sqlite python manage.py test
+"""
+
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from PIL import Image
+
+from main.models import AdvUser, SuperRubric, SubRubric, Ad, Comment
+
+
+class DataMixin:
+    '''Рубрика, два пользователя и по объявлению у каждого'''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.super_rubric = SuperRubric.objects.create(name='Транспорт')
+        cls.rubric = SubRubric.objects.create(name='Автомобили', super_rubric=cls.super_rubric)
+        cls.alice = AdvUser.objects.create_user('alice', 'alice@example.com', 'alice-password',
+                                                is_activated=True)
+        cls.bob = AdvUser.objects.create_user('bob', 'bob@example.com', 'bob-password', is_activated=True)
+        cls.ad_a = cls.create_ad(cls.alice, 'Продам велосипед')
+        cls.ad_b = cls.create_ad(cls.bob, 'Продам машину')
+
+    @classmethod
+    def create_ad(cls, author, title, **kwargs):
+        kwargs.setdefault('rubric', cls.rubric)
+        return Ad.objects.create(author=author, title=title, content=title, contacts='+7 900 000-00-00',
+                                 **kwargs)
+
+    @staticmethod
+    def create_comment(ad, author='guest', content='Комментарий', **kwargs):
+        return Comment.objects.create(ad=ad, author=author, content=content, **kwargs)
+
+
+class TempMediaMixin:
+    '''MEDIA_ROOT во временной папке, удаляемой после тестов класса'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+def make_image(color='red', name='photo.png'):
+    '''Выгружаемый файл с картинкой PNG 8x8; картинки одного цвета одинаковы'''
+    content = BytesIO()
+    Image.new('RGB', (8, 8), color).save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
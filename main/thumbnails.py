@@ -0,0 +1,103 @@
+"""Заблаговременное создание миниатюр.
+
+Тег {% thumbnail %} из easy_thumbnails создает отсутствующую миниатюру прямо во время
+вывода шаблона. Здесь все варианты изображения - все псевдонимы из THUMBNAIL_ALIASES
+в каждом формате из THUMBNAIL_VARIANT_EXTENSIONS (jpg и webp) - создаются в пуле
+фоновых процессов сразу после сохранения объявления или иллюстрации. Шаблоны
+(тег {% picture %} из callboard) только проверяют, готова ли миниатюра, и, если нет,
+выводят исходное изображение и ставят миниатюру в очередь. Перед созданием миниатюр
+слишком большие исходные изображения уменьшаются (см. main.uploads.downscale_original)."""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+
+from .workers import create_process_pool
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def get_extensions():
+    return getattr(settings, 'THUMBNAIL_VARIANT_EXTENSIONS', ('jpg', 'webp'))
+
+
+def get_variant_thumbnailer(storage, name, extension=None):
+    thumbnailer = get_thumbnailer(storage, name)
+    if extension:
+        thumbnailer.thumbnail_extension = extension
+    return thumbnailer
+
+
+def generate_variants(name):
+    '''Создает все варианты изображения name из хранилища по умолчанию.
+    Выполняется в процессе пула. Возвращает количество новых миниатюр'''
+    created = 0
+    for extension in get_extensions():
+        thumbnailer = get_variant_thumbnailer(default_storage, name, extension)
+        for alias, options in aliases.all(include_global=True).items():
+            options = dict(options, ALIAS=alias)
+            if thumbnailer.get_existing_thumbnail(options) is None:
+                thumbnailer.get_thumbnail(options, generate=True)
+                created += 1
+    return created
+
+
+def process_image(name):
+    '''Обработка только что загруженного изображения в процессе пула:
+    уменьшение исходного изображения и создание всех вариантов'''
+    from .uploads import downscale_original
+    if not default_storage.exists(name):
+        return 0 # файл успели удалить, пока задание ждало в очереди
+    downscale_original(name)
+    return generate_variants(name)
+
+
+def get_executor():
+    '''Пул процессов создается при первом обращении'''
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = create_process_pool(getattr(settings, 'THUMBNAIL_WORKERS', 2))
+        return _executor
+
+
+def _done(name, future):
+    with _lock:
+        _pending.discard(name)
+    if future.exception() is not None:
+        logger.error('Не удалось создать миниатюры для %s', name, exc_info=future.exception())
+
+
+def schedule(name):
+    '''Ставит создание миниатюр для файла name в очередь пула. Повторные вызовы
+    для файла, который еще обрабатывается, ничего не делают'''
+    if not name:
+        return None
+    with _lock:
+        if name in _pending:
+            return None
+        _pending.add(name)
+    future = get_executor().submit(process_image, name)
+    future.add_done_callback(lambda f: _done(name, f))
+    return future
+
+
+def get_variant_url(fieldfile, alias, extension=None):
+    '''Адрес готовой миниатюры или None, если ее еще нет (тогда она ставится в очередь).
+    Изображение при этом никогда не кодируется'''
+    if not fieldfile:
+        return None
+    thumbnailer = get_variant_thumbnailer(fieldfile.storage, fieldfile.name, extension)
+    thumbnail = thumbnailer.get_existing_thumbnail(aliases.get(alias))
+    if thumbnail is None:
+        schedule(fieldfile.name)
+        return None
+    return thumbnail.url
@@ -0,0 +1,124 @@
+"""Загрузка изображений объявлений с ограниченным расходом памяти.
+
+- LimitedUploadHandler пишет каждый файл во временный файл на диске частями
+  и следит за ограничениями на запрос: не больше UPLOAD_MAX_FILES файлов и
+  UPLOAD_MAX_TOTAL_SIZE байт. Лишние файлы отбрасываются, не дочитываясь,
+  а ошибки сохраняются в request.upload_errors.
+- HeaderImageField проверяет изображение по заголовку файла (формат и размеры),
+  не декодируя его целиком, как это делает forms.ImageField.
+- downscale_original уменьшает слишком большие исходные изображения; вызывается
+  в пуле фоновых процессов (см. main.thumbnails.process_image).
+"""
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+
+def get_limit(name, default):
+    return getattr(settings, name, default)
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    '''Обработчик выгрузки: файлы только во временных файлах, с лимитами на запрос'''
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_files = get_limit('UPLOAD_MAX_FILES', 10)
+        self.max_total_size = get_limit('UPLOAD_MAX_TOTAL_SIZE', 30 * 1024 * 1024)
+        self.files_count = 0
+        self.total_size = 0
+        if request is not None:
+            request.upload_errors = []
+
+    def add_error(self, message):
+        if self.request is not None and message not in self.request.upload_errors:
+            self.request.upload_errors.append(message)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.files_count += 1
+        if self.files_count > self.max_files:
+            self.add_error(f'Можно загрузить не более {self.max_files} файлов за раз')
+            raise SkipFile()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.total_size += len(raw_data)
+        if self.total_size > self.max_total_size:
+            self.add_error(f'Общий размер файлов не должен превышать {filesizeformat(self.max_total_size)}')
+            raise SkipFile()
+        return super().receive_data_chunk(raw_data, start)
+
+
+def check_upload_limits(request, *forms_):
+    '''Добавляет ошибки превышения лимитов выгрузки в первую форму.
+    Возвращает True, если лимиты не превышены'''
+    errors = getattr(request, 'upload_errors', None)
+    if not errors:
+        return True
+    if forms_:
+        for error in errors:
+            forms_[0].add_error(None, error)
+    return False
+
+
+class HeaderImageField(forms.ImageField):
+    '''Поле изображения, которое читает только заголовок файла'''
+    default_error_messages = dict(forms.ImageField.default_error_messages, **{
+        'format': 'Допустимые форматы изображений: %(formats)s.',
+        'too_large': 'Изображение слишком большое: %(width)s x %(height)s точек.',
+    })
+
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+        if hasattr(data, 'temporary_file_path'):
+            source = data.temporary_file_path()
+        else:
+            source = data
+            if hasattr(data, 'seek'):
+                data.seek(0)
+        formats = get_limit('UPLOAD_IMAGE_FORMATS', ('JPEG', 'PNG', 'GIF', 'WEBP'))
+        try:
+            # Image.open читает только заголовок, пиксели не декодируются
+            with Image.open(source) as image:
+                image_format, (width, height) = image.format, image.size
+        except Exception as exc:
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+        finally:
+            if hasattr(data, 'seek') and callable(data.seek):
+                data.seek(0)
+        if image_format not in formats:
+            raise ValidationError(self.error_messages['format'], code='format',
+                                  params={'formats': ', '.join(formats)})
+        if width * height > get_limit('UPLOAD_MAX_PIXELS', 50_000_000):
+            raise ValidationError(self.error_messages['too_large'], code='too_large',
+                                  params={'width': width, 'height': height})
+        f.content_type = Image.MIME.get(image_format)
+        return f
+
+
+def downscale_original(name, storage=None):
+    '''Уменьшает исходное изображение name, если оно больше UPLOAD_MAX_DIMENSION
+    точек по любой стороне. Файл перезаписывается под тем же именем.
+    Возвращает True, если изображение было уменьшено'''
+    storage = storage or default_storage
+    max_dimension = get_limit('UPLOAD_MAX_DIMENSION', 2560)
+    with storage.open(name, 'rb') as source:
+        with Image.open(source) as image:
+            if max(image.size) <= max_dimension:
+                return False
+            image_format = image.format
+            # для JPEG draft декодирует сразу в уменьшенном масштабе - так нужно меньше памяти
+            image.draft('RGB', (max_dimension, max_dimension))
+            image.thumbnail((max_dimension, max_dimension))
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            with storage.open(name, 'wb') as target:
+                image.save(target, format=image_format, quality=90)
+    return True
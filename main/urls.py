@@ -1,14 +1,17 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import index, other_page, BBLoginView, profile, BBLogoutView, ChangeUserInfoView, BBPasswordChangeView, \
     RegisterUserView, RegisterDoneView, user_activate, DeleteUserView, by_rubric, detail, profile_ad_detail, \
-    profile_ad_add, profile_ad_change, profile_ad_delete
+    profile_ad_add, profile_ad_change, profile_ad_delete, index_async, by_rubric_async, detail_async
+
+async_views = getattr(settings, 'ASYNC_VIEWS', False) # при ASGI страницы объявлений обслуживают асинхронные контроллеры
 
 app_name = 'main'
 urlpatterns = [
-    path('', index, name='index'),
-    path('<int:rubric_pk>/<int:pk>/', detail, name='detail'),
-    path('<int:pk>/', by_rubric, name='by_rubric'),
+    path('', index_async if async_views else index, name='index'),
+    path('<int:rubric_pk>/<int:pk>/', detail_async if async_views else detail, name='detail'),
+    path('<int:pk>/', by_rubric_async if async_views else by_rubric, name='by_rubric'),
     path('<str:page>/', other_page, name='other'),
     path('accounts/login/', BBLoginView.as_view(), name='login'),  # accounts/login/ - путь для авторизации
     # пользователей в джанго по умолчанию
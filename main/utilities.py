@@ -1,28 +1,28 @@
-from django.template.loader import render_to_string
 from django.core.signing import Signer
 from datetime import datetime
 from os.path import splitext
 
-from callboard.settings import ALLOWED_HOSTS
-
 
 signer = Signer()
 
 
 def send_activation_notification(user):
-    if ALLOWED_HOSTS:
-        host = 'http://' + ALLOWED_HOSTS[0]
-    else:
-        host = 'http://localhost:8000'
-    context = {'user': user, 'host': host, 'sign': signer.sign(user.username)}
-    subject = render_to_string('email/activation_letter_subject.txt', context)
-    body_text = render_to_string('email/activation_letter_body.txt', context)
-    user.email_user(subject, body_text)
+    '''Ставит письмо с активацией в очередь. Письмо формируется и отправляется
+    командой send_queued_mail (см. main/mail.py)'''
+    from .mail import enqueue_mail, ACTIVATION
+    enqueue_mail(ACTIVATION, user)
+
+
+def send_activation_notifications(users):
+    '''Ставит в очередь письма с активацией для нескольких пользователей одним запросом'''
+    from .mail import enqueue_mail_bulk, ACTIVATION
+    enqueue_mail_bulk(ACTIVATION, users)
 
 
 def get_timestamp_path(instance, filename):
-    '''функция генерирующая имена картинок. splitext(filename) - оставит только имя файла, без расширения,
-    datetime.now().timestamp()-прикрепит дату и время в имя файла. '''
-    return f'{datetime.now().timestamp()},{splitext(filename)}'
+    '''функция генерирующая имена картинок. splitext(filename)[1] - оставит только расширение файла,
+    datetime.now().timestamp()-прикрепит дату и время в имя файла. Хранилище main.storage
+    использует из этого имени только расширение, а сам файл называет по хэшу содержимого'''
+    return f'{datetime.now().timestamp()}{splitext(filename)[1]}'
 
 
@@ -1,69 +1,83 @@
+import asyncio
+import time
+
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView, PasswordChangeView
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.paginator import Paginator
 from django.core.signing import BadSignature
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
-from django.http import HttpResponse, Http404
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, Http404
 from django.urls import reverse_lazy
+from django.utils.cache import patch_cache_control
 from django.views.generic import UpdateView, CreateView, TemplateView, DeleteView
 
-from .models import AdvUser, SubRubric, Ad, Comment, Rubric
+from .models import AdvUser, SubRubric, Ad, AdditionalImage, Comment, Rubric
 from .forms import ChangeUserInfoForm, RegisterUserForm, SearchForm, AdForm, AIFormSet, UserCommentForm, \
     GuestCommentForm
+from . import captcha_pool
+from .aio import render_async, run_sync
+from .deletion import delete_users
+from .caching import cache_anonymous_page, ALL_ADS, SIDEBAR, ad_key, rubric_key
+from .metrics import render_prometheus
+from .pagination import KeysetPaginator
+from .uploads import check_upload_limits
 from .utilities import signer
-
-
+from captcha.conf import settings as captcha_settings
+from captcha.views import captcha_image as render_captcha_image
+
+
+def detail_validators(request, rubric_pk, pk):
+    '''Значения для ETag и Last-Modified страницы объявления: время публикации объявления
+    и последнего комментария. Страница гостя содержит капчу, которая живет CAPTCHA_TIMEOUT
+    минут, поэтому в ETag добавлен номер интервала длиной в половину этого времени -
+    закэшированная браузером страница не будет показывать устаревшую капчу'''
+    # последний комментарий берется подзапросом - он читает одну запись индекса
+    # main_comment_active_ad_idx, а не группирует все комментарии объявления
+    last_comment = Comment.objects.filter(ad=OuterRef('pk'), is_active=True) \
+        .order_by('-created_at').values('created_at')[:1]
+    row = Ad.objects.filter(pk=pk).annotate(last_comment=Subquery(last_comment)) \
+        .values_list('created_at', 'last_comment').first()
+    if row is None:
+        return None
+    created_at, last_comment = row
+    captcha_interval = int(time.time() // (captcha_settings.CAPTCHA_TIMEOUT * 30))
+    return [created_at] + ([last_comment] if last_comment else []) + [captcha_interval]
+
+
+@cache_anonymous_page(lambda request: [ALL_ADS, SIDEBAR])
 def index(request):
-    ads = Ad.objects.filter(is_active=True)[:10]
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        q = Q(title__icontains=keyword) | Q(content__icontains=keyword)
-        ads = ads.filter(q)
-    else:
-        keyword = ''
-    form = SearchForm(initial={'keyword': keyword})
-    paginator = Paginator(ads, 2)
-    if 'page' in request.GET:
-        page_num = request.GET['page']
-    else:
-        page_num = 1
-    page = paginator.get_page(page_num)
+    form = SearchForm(request.GET)
+    ads = form.search(Ad.objects.for_list().filter(is_active=True))
+    paginator = KeysetPaginator(ads, 2)
+    page = paginator.get_page(request.GET.get('page'))
     context = {'page': page, 'ads': page.object_list, 'form': form}
     return render(request, 'main/index.html', context)
 
 
+@cache_anonymous_page(lambda request, pk: [rubric_key(pk), SIDEBAR])
 def by_rubric(request, pk):
-    rubric = get_object_or_404(SubRubric, pk=pk)
-    ads = Ad.objects.filter(is_active=True, rubric=pk)
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        q = Q(title__icontains=keyword) | Q(content__icontains=keyword)
-        ads = ads.filter(q)
-    else:
-        keyword = ''
-    form = SearchForm(initial={'keyword': keyword})
-    paginator = Paginator(ads, 2)
-    if 'page' in request.GET:
-        page_num = request.GET['page']
-    else:
-        page_num = 1
-    page = paginator.get_page(page_num)
+    rubric = get_object_or_404(SubRubric.objects.select_related('super_rubric'), pk=pk)
+    ads = Ad.objects.for_list().filter(is_active=True, rubric=pk)
+    form = SearchForm(request.GET)
+    ads = form.search(ads)
+    paginator = KeysetPaginator(ads, 2)
+    page = paginator.get_page(request.GET.get('page'))
     context = {'rubric': rubric, 'page': page, 'ads': page.object_list, 'form': form}
     return render(request, 'main/by_rubric.html', context)
 
 
-def detail(request, rubric_pk, pk):
-    ad = get_object_or_404(Ad, pk=pk)
-    ais = ad.additionalimage_set.all()
-    comments = Comment.objects.filter(ad=pk, is_active=True)
-    initial = {'ad': ad.pk}
+def get_comment_form(request, pk):
+    '''Форма комментария к объявлению pk. При POST комментарий сохраняется,
+    а в случае ошибок возвращается заполненная форма'''
+    initial = {'ad': pk}
     if request.user.is_authenticated:
         initial['author'] = request.user.username
         form_class = UserCommentForm
@@ -78,11 +92,62 @@ def detail(request, rubric_pk, pk):
         else:
             form = c_form
             messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
+    return form
+
+
+@cache_anonymous_page(lambda request, rubric_pk, pk: [ad_key(pk), SIDEBAR],
+                      get_validators=detail_validators, store=False) # в странице есть CSRF-токен и капча
+def detail(request, rubric_pk, pk):
+    form = get_comment_form(request, pk)
+    # объявление с иллюстрациями и комментариями загружается после обработки формы,
+    # чтобы только что добавленный комментарий попал на страницу
+    ad = get_object_or_404(Ad.objects.for_detail(), pk=pk)
+    ais = ad.additionalimage_set.all()
+    comments = ad.active_comments
 
     context = {'ad': ad, 'ais': ais, 'comments': comments, 'form': form}
     return render(request, 'main/detail.html', context)
 
 
+# асинхронные варианты контроллеров для ASGI (ASYNC_VIEWS, см. main/urls.py и aio.py):
+# запросы к базе выполняются в потоках пула, независимые - одновременно
+
+
+@cache_anonymous_page(lambda request: [ALL_ADS, SIDEBAR])
+async def index_async(request):
+    form = SearchForm(request.GET)
+    ads = form.search(Ad.objects.for_list().filter(is_active=True))
+    page = await run_sync(KeysetPaginator(ads, 2).get_page)(request.GET.get('page'))
+    context = {'page': page, 'ads': page.object_list, 'form': form}
+    return await render_async(request, 'main/index.html', context)
+
+
+@cache_anonymous_page(lambda request, pk: [rubric_key(pk), SIDEBAR])
+async def by_rubric_async(request, pk):
+    form = SearchForm(request.GET)
+    ads = form.search(Ad.objects.for_list().filter(is_active=True, rubric=pk))
+    rubric, page = await asyncio.gather(
+        run_sync(get_object_or_404)(SubRubric.objects.select_related('super_rubric'), pk=pk),
+        run_sync(KeysetPaginator(ads, 2).get_page)(request.GET.get('page')))
+    context = {'rubric': rubric, 'page': page, 'ads': page.object_list, 'form': form}
+    return await render_async(request, 'main/by_rubric.html', context)
+
+
+@cache_anonymous_page(lambda request, rubric_pk, pk: [ad_key(pk), SIDEBAR],
+                      get_validators=detail_validators, store=False)
+async def detail_async(request, rubric_pk, pk):
+    form = await run_sync(get_comment_form)(request, pk)
+    # объявление, иллюстрации и комментарии - тремя одновременными запросами вместо
+    # последовательных запросов prefetch_related
+    ad, ais, comments = await asyncio.gather(
+        run_sync(get_object_or_404)(Ad.objects.select_related('rubric__super_rubric', 'author')
+                                    .defer('search_vector'), pk=pk),
+        run_sync(list)(AdditionalImage.objects.filter(ad=pk)),
+        run_sync(list)(Comment.objects.filter(ad=pk, is_active=True)))
+    context = {'ad': ad, 'ais': ais, 'comments': comments, 'form': form}
+    return await render_async(request, 'main/detail.html', context)
+
+
 def user_activate(request, sign):
     """Контоллер активации нового пользователя"""
     try:
@@ -112,27 +177,18 @@ def other_page(request, page):
 @login_required
 def profile(request):
     '''декоратор дает доступ к странице только авторизованным пользователям'''
-    ads = Ad.objects.filter(author=request.user.pk)
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        q = Q(title__icontains=keyword) | Q(content__icontains=keyword)
-        ads = ads.filter(q)
-    else:
-        keyword = ''
-    form = SearchForm(initial={'keyword': keyword})
-    paginator = Paginator(ads, 2)
-    if 'page' in request.GET:
-        page_num = request.GET['page']
-    else:
-        page_num = 1
-    page = paginator.get_page(page_num)
+    ads = Ad.objects.for_list().filter(author=request.user.pk)
+    form = SearchForm(request.GET)
+    ads = form.search(ads)
+    paginator = KeysetPaginator(ads, 2)
+    page = paginator.get_page(request.GET.get('page'))
     context = {'page': page, 'ads': page.object_list, 'form': form}
     return render(request, 'main/profile.html', context)
 
 
 @login_required
 def profile_ad_detail(request, rubric_pk, pk):
-    ad = get_object_or_404(Ad, pk=pk)
+    ad = get_object_or_404(Ad.objects.for_detail(), pk=pk)
     ais = ad.additionalimage_set.all()
     context = {'ad': ad, 'ais': ais}
     return render(request, 'main/profile_ad_detail.html', context)
@@ -142,13 +198,14 @@ def profile_ad_detail(request, rubric_pk, pk):
 def profile_ad_add(request):
     if request.method == 'POST':
         form = AdForm(request.POST, request.FILES)
-        if form.is_valid():
-            ad = form.save()
-            formset = AIFormSet(request.POST, request.FILES, instance=ad)
-            if formset.is_valid():
+        formset = AIFormSet(request.POST, request.FILES, instance=form.instance)
+        if check_upload_limits(request, form) and form.is_valid() and formset.is_valid():
+            with transaction.atomic():
+                ad = form.save()
+                formset.instance = ad
                 formset.save()
-                messages.add_message(request, messages.SUCCESS, 'Объявление добавлено')
-                return redirect('main:profile')
+            messages.add_message(request, messages.SUCCESS, 'Объявление добавлено')
+            return redirect('main:profile')
     else:
         form = AdForm(initial={'author': request.user.pk})
         formset = AIFormSet()
@@ -158,16 +215,16 @@ def profile_ad_add(request):
 
 @login_required
 def profile_ad_change(request, pk):
-    ad = get_object_or_404(Ad, pk=pk)
+    ad = get_object_or_404(Ad.objects.for_edit(), pk=pk)
     if request.method == 'POST':
         form = AdForm(request.POST, request.FILES, instance=ad)
-        if form.is_valid():
-            ad = form.save()
-            formset = AIFormSet(request.POST, request.FILES, instance=ad)
-            if formset.is_valid():
+        formset = AIFormSet(request.POST, request.FILES, instance=ad)
+        if check_upload_limits(request, form) and form.is_valid() and formset.is_valid():
+            with transaction.atomic():
+                form.save()
                 formset.save()
-                messages.add_message(request, messages.SUCCESS, 'Объявление изменено')
-                return redirect('main:profile')
+            messages.add_message(request, messages.SUCCESS, 'Объявление изменено')
+            return redirect('main:profile')
     else:
         form = AdForm(instance=ad)
         formset = AIFormSet(instance=ad)
@@ -177,7 +234,7 @@ def profile_ad_change(request, pk):
 
 @login_required
 def profile_ad_delete(request, pk):
-    ad = get_object_or_404(Ad, pk=pk)
+    ad = get_object_or_404(Ad.objects.for_edit(), pk=pk)
     if request.method == "POST":
         ad.delete()
         messages.add_message(request, messages.SUCCESS, 'Объявление удалено')
@@ -272,8 +329,33 @@ class DeleteUserView(LoginRequiredMixin, DeleteView):
         messages.add_message(request, messages.SUCCESS, 'Пользователь удален')
         return super().post(request, *args, kwargs)
 
+    def delete(self, request, *args, **kwargs):
+        '''пользователь и его объявления удаляются массово, файлы - в фоне (см. deletion.py)'''
+        self.object = self.get_object()
+        delete_users(AdvUser.objects.filter(pk=self.object.pk))
+        return HttpResponseRedirect(self.get_success_url())
+
     def get_object(self, queryset=None):
         if not queryset:
             queryset = self.get_queryset()
         return get_object_or_404(queryset, pk=self.user_id)
 
+
+def metrics(request):
+    '''Метрики процесса в текстовом формате Prometheus. Доступны персоналу и адресам
+    из METRICS_ALLOWED_IPS'''
+    allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if not allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def captcha_image(request, key, scale=1):
+    '''Картинка капчи: заранее нарисованная командой captcha_pool или, для капч не из пула,
+    нарисованная библиотекой'''
+    try:
+        response = FileResponse(open(captcha_pool.image_path(key, scale), 'rb'), content_type='image/png')
+    except FileNotFoundError:
+        return render_captcha_image(request, key, scale)
+    patch_cache_control(response, private=True, max_age=captcha_settings.CAPTCHA_TIMEOUT * 60)
+    return response
@@ -0,0 +1,88 @@
+"""Фоновые обработчики.
+
+BatchWorker работает в отдельном потоке процесса: принимает задания через очередь
+и передает их функции-обработчику пачками, чтобы медленные операции (удаление
+файлов и т. п.) не выполнялись внутри запроса. create_process_pool создает пул
+процессов для работы, нагружающей процессор (обработка изображений)."""
+
+import atexit
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    def __init__(self, name, handler, batch_size=100, wait=1.0):
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.wait = wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def put_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        self._ensure_started()
+        for item in items:
+            self._queue.put(item)
+
+    def put(self, item):
+        self.put_many([item])
+
+    def _take_batch(self, block):
+        batch = []
+        try:
+            batch.append(self._queue.get(block=block, timeout=self.wait if block else None))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _process(self, batch):
+        try:
+            self.handler(batch)
+        except Exception:
+            logger.exception('Ошибка фонового обработчика %s', self.name)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch(block=True)
+            if batch:
+                self._process(batch)
+
+    def flush(self):
+        '''Дожидается обработки всех поставленных в очередь заданий'''
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+
+def _init_process():
+    import django
+    django.setup()
+
+
+def create_process_pool(max_workers):
+    '''Пул процессов с настроенным Django. Используется запуск "spawn",
+    чтобы процессы не наследовали соединения с БД родительского процесса'''
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_process)